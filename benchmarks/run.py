@@ -0,0 +1,182 @@
+"""Benchmarks of the sublayers, run from the root of the repository:
+
+python -m benchmarks.run startup|validation|suggestions|scan
+"""
+
+import argparse
+import difflib
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sublayers import validation
+from sublayers.handler import Handler
+from sublayers.scanner import scan
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_in(folder, script, *args):
+    """Runs the script in a new interpreter in folder, returns its output"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        cwd=folder,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout
+
+
+def fill_stores(folder, size):
+    """Creates an address book and a notebook with size records in folder"""
+    script = (
+        "from sublayers.addressbook import AddressBook, Record as Contact, Name, Phone\n"
+        "from sublayers.notebook import Notebook, Record as Note\n"
+        "book = AddressBook()\n"
+        "notebook = Notebook()\n"
+        f"for i in range({size}):\n"
+        "    contact = Contact(Name(f'contact {i}'))\n"
+        "    contact.add_phone(Phone(f'099{i % 10_000_000:07d}'))\n"
+        "    book.add_record(contact)\n"
+        "    note = Note(title=f'note {i}')\n"
+        "    note.create_title(record=note, user_title=f'note {i}')\n"
+        "    note.create_text(record=note, user_text=f'text of note {i} ' * 20)\n"
+        "    note.create_tag(record=note, user_tag=f'tag{i % 50}')\n"
+        "    notebook.add_record(note)\n"
+        "book.write_contacts()\n"
+        "notebook.write_notes()\n"
+    )
+    run_in(folder, script)
+
+
+def time_to_prompt(folder):
+    """Seconds from the start of the interpreter until the main menu is ready"""
+    script = (
+        "import time\n"
+        "import interface\n"
+        "print(time.time() - float(__import__('sys').argv[1]))\n"
+    )
+    output = run_in(folder, script, str(time.time()))
+    return float(output)
+
+
+def startup(sizes=(0, 1_000, 20_000), repeat=5):
+    """Prints time to the main menu for data files of different sizes"""
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            fill_stores(folder, size)
+            data_size = sum(
+                os.path.getsize(os.path.join(path, name))
+                for path, _, names in os.walk(folder)
+                for name in names
+            )
+            best = min(time_to_prompt(folder) for _ in range(repeat))
+            print(
+                f"{size:>6} records, {data_size / 1024:>8.0f} KB of data: "
+                f"{best * 1000:.0f} ms to the menu"
+            )
+
+
+def validation_throughput(size=1_000_000):
+    """Prints throughput of batch validation against per-value validation"""
+    phones = [f"+38099{i % 10_000_000:07d}" for i in range(size)]
+    emails = [f"user{i}@example.com" for i in range(size)]
+    birthdays = [
+        f"{i % 28 + 1:02}.{i % 12 + 1:02}.{1950 + i % 50}" for i in range(size)
+    ]
+
+    def per_value():
+        for phone in phones:
+            re.match(validation.PHONE_PATTERN.pattern, phone)
+        for email in emails:
+            re.match(validation.EMAIL_PATTERN.pattern, email)
+        for birthday in birthdays:
+            datetime.strptime(birthday, "%d.%m.%Y").date() >= datetime.now().date()
+
+    def batch():
+        validation.validate_phones(phones)
+        validation.validate_emails(emails)
+        validation.validate_birthdays(birthdays)
+
+    for name, run in (("per value", per_value), ("batch", batch)):
+        start = time.perf_counter()
+        run()
+        spent = time.perf_counter() - start
+        print(f"{name}: {spent:.2f}s, {3 * size / spent:,.0f} values/s")
+
+
+def suggestions(size=500, misses=2000):
+    """Prints time of suggestions for a big command table with difflib and
+    with the index
+    """
+    words = ["add", "find", "show", "change", "remove", "export", "import", "sort"]
+    commands = {
+        f"{words[i % len(words)]} {words[i // len(words) % len(words)]} {i}": None
+        for i in range(size)
+    }
+    names = list(commands)
+    queries = [names[i * 7 % size][:-1] + "x" for i in range(misses)]
+    handler = Handler(commands)
+    handler.get_command_suggestion(queries[0])
+
+    def scan_commands():
+        for query in queries:
+            difflib.get_close_matches(query, commands.keys(), n=1, cutoff=0.6)
+
+    def index():
+        for query in queries:
+            handler.get_command_suggestion(query)
+
+    for name, run in (("difflib", scan_commands), ("index", index)):
+        start = time.perf_counter()
+        run()
+        spent = time.perf_counter() - start
+        print(f"{name}: {spent * 1000 / misses:.3f} ms per typo")
+
+
+def scan_tree(folders=2_000, files_per_folder=50):
+    """Prints time of a serial and a parallel scan of a generated tree"""
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(folders):
+            folder = os.path.join(root, f"{i % 20}", f"{i}")
+            os.makedirs(folder)
+            for j in range(files_per_folder):
+                open(os.path.join(folder, f"{j}.txt"), "w").close()
+        for workers in (None, 4, 16):
+            start = time.perf_counter()
+            count = sum(1 for _ in scan(root, workers))
+            spent = time.perf_counter() - start
+            print(f"workers {workers or 1}: {count} entries in {spent:.2f}s")
+
+
+BENCHMARKS = {
+    "startup": startup,
+    "validation": validation_throughput,
+    "suggestions": suggestions,
+    "scan": scan_tree,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "names", nargs="*", help=f"any of {', '.join(BENCHMARKS)}, all by default"
+    )
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark {unknown[0]}")
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,66 @@
+import argparse
+import sys
+
 import inquirer
 
-from sublayers.addressbook import commands as ab_commands
-from sublayers.notebook import commands as nb_commands
-from sublayers.cleaner import commands as sa_commands
+from sublayers.batch import BatchRunner, print_result, print_totals
 from sublayers.handler import Handler
+from sublayers.registry import SUBLAYERS, load_commands
+from sublayers.writer import flush_all, install_signal_handlers
 
 
 main_menu = [
     inquirer.List(
         "option",
         message="You are in main menu. Please select an option:",
-        choices=["Address Book", "Note Book", "Sorter Assist", "Exit"],
+        choices=[*SUBLAYERS, "Exit"],
     )
 ]
 
 
 def main():
+    install_signal_handlers()
     while True:
         main_choice = inquirer.prompt(main_menu)["option"]
 
-        if main_choice == "Address Book":
-            handler = Handler(ab_commands)
-            handler.run()
-
-        elif main_choice == "Note Book":
-            handler = Handler(nb_commands)
-            handler.run()
-
-        elif main_choice == "Sorter Assist":
-            handler = Handler(sa_commands)
+        if main_choice in SUBLAYERS:
+            handler = Handler(load_commands(main_choice))
             handler.run()
 
         elif main_choice == "Exit":
             print("Exiting program...")
+            flush_all()
             break
 
 
+def batch_main(argv=None):
+    """Runs commands from a file of JSON lines, one command per line:
+    {"sublayer": "address book", "command": "add", "args": ["Bill", "0991234567"]}
+    """
+    parser = argparse.ArgumentParser(
+        prog="helper-batch", description="Runs bot commands from a file"
+    )
+    parser.add_argument(
+        "script", nargs="?", default="-", help="file with commands, - for stdin"
+    )
+    parser.add_argument(
+        "-s", "--sublayer", help="sublayer of commands which do not name one"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="show output of every command"
+    )
+    args = parser.parse_args(argv)
+    runner = BatchRunner(SUBLAYERS, default_sublayer=args.sublayer)
+    stream = sys.stdin if args.script == "-" else open(args.script, encoding="utf-8")
+    with stream:
+        for result in runner.run_script(stream):
+            print_result(result, args.verbose)
+    flush_ms = runner.finish()
+    print_totals(runner.results, flush_ms)
+    return 1 if any(not result["ok"] for result in runner.results) else 0
+
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["batch"]:
+        sys.exit(batch_main(sys.argv[2:]))
     main()
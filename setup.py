@@ -9,5 +9,8 @@ setup(
     license='MIT',
     packages=find_namespace_packages(include=['bot.*', 'bot']),
     install_requires=['inquirer', 'colorama', 'prettytable'],
-    entry_points={'console_scripts': ['helper = bot.interface:main']}
+    entry_points={'console_scripts': [
+        'helper = bot.interface:main',
+        'helper-batch = bot.interface:batch_main',
+    ]}
 )
@@ -1,11 +1,26 @@
 from abc import abstractmethod, ABC
-import pickle
+from array import array
+import itertools
 from collections import UserDict
-from datetime import datetime, timedelta
+from collections.abc import MutableMapping
+from datetime import datetime
 import re
 from colorama import init, Fore, Back, Style
 from prettytable import PrettyTable, ALL
 
+from sublayers.handler import report_error
+from sublayers.indexes import phone_digits
+from sublayers.registry import LazyStore
+from sublayers.storage import MmapStorage, PickleStorage, SQLiteStorage
+from sublayers.writer import (
+    BackgroundWriter,
+    DeferredWriter,
+    locked,
+    register_store,
+    store_lock,
+)
+from sublayers import transfer, validation
+
 init(autoreset=True)
 
 
@@ -20,33 +35,166 @@ class AddressBook(UserDict):
         return cls._instance
 
     file_name = "AddressBook.bin"
+    # "pickle", "sqlite" or "mmap". Other storages are filled from file_name once
+    storage_type = "pickle"
+    db_file_name = "AddressBook.db"
+    mmap_file_name = "AddressBook.dat"
+    # Write changes in a background thread, a burst of changes within
+    # save_debounce seconds is written once
+    background_save = False
+    save_debounce = 0.5
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.storage = self.create_storage()
+        self.pending = []
+        self.writer = None
+        if self.background_save:
+            self.writer = BackgroundWriter(self.write_contacts, self.save_debounce)
+        self.indexes = self.storage.create_indexes(self.data)
         self.load_contacts()
+        register_store(self)
+
+    def create_storage(self):
+        if self.storage_type == "sqlite":
+            return SQLiteStorage(self.db_file_name, migrate_from=self.file_name)
+        if self.storage_type == "mmap":
+            return MmapStorage(self.mmap_file_name, migrate_from=self.file_name)
+        return PickleStorage(self.file_name)
 
     def show_all_records(self):
         return self.data
 
+    @locked
     def add_record(self, record):
         self.data[record.name.value] = record
+        self.indexes.add(record.name.value, record)
+        self.pending.append(("set", record.name.value))
+
+    @locked
+    def update_record(self, record):
+        """Marks the Record as changed after editing it in place"""
+        self.indexes.add(record.name.value, record)
+        self.pending.append(("set", record.name.value))
+
+    @locked
+    def rename_record(self, old_name, new_name):
+        record = self.data.pop(old_name)
+        self.data[new_name] = record
+        self.indexes.remove(old_name)
+        self.indexes.add(new_name, record)
+        self.pending.append(("del", old_name))
+        self.pending.append(("set", new_name))
+
+    @locked
+    def remove_record(self, name):
+        record = self.data.pop(name)
+        self.indexes.remove(name)
+        self.pending.append(("del", name))
+        return record
+
+    @locked
+    def clear_records(self):
+        self.data.clear()
+        self.indexes.clear()
+        self.pending = [("clear", None)]
+
+    def find_by_name(self, prefix):
+        """Returns names of Records which name starts with prefix"""
+        return self.indexes.find_by_name(prefix)
+
+    def find_by_phone(self, prefix):
+        """Returns names of Records with a phone starting with prefix.
+        Only digits are compared, so '+380' and '380' are the same prefix
+        """
+        if not re.fullmatch(r"[\d\s+()-]+", prefix):
+            return set()
+        return self.indexes.find_by_phone(phone_digits(prefix))
 
-    def save_contacts(self):
-        with open(self.file_name, "wb") as f:
-            pickle.dump(self.data, f)
-        print(Style.BRIGHT + Fore.YELLOW + f"Your contact saved!")
+    def upcoming_birthdays(self, days):
+        """Returns names of Records with birthday in the next days, nearest first"""
+        return self.indexes.upcoming_birthdays(days)
+
+    def fuzzy_find(self, query, limit=5):
+        """Returns names of Records with name, email or address similar
+        to the query, the best match first
+        """
+        return self.indexes.fuzzy_find(query, limit)
+
+    def save_contacts(self, verbose=True):
+        if self.writer is None:
+            self.write_contacts()
+        else:
+            self.writer.request()
+        if verbose:
+            print(Style.BRIGHT + Fore.YELLOW + f"Your contact saved!")
+
+    @locked
+    def write_contacts(self):
+        self.storage.save(self.data, self.pending)
+        self.pending = []
+
+    def flush(self):
+        """Writes changes waiting for the background writer"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def defer_saves(self):
+        """Keeps changes until flush() is called, used by batch mode"""
+        self.flush()
+        self.writer = DeferredWriter(self.write_contacts)
+
+    @locked
+    def refresh(self):
+        """Applies Records changed by other processes since the last load.
+        Waits while this process has unsaved changes
+        """
+        if self.pending:
+            return
+        changes = self.storage.changes()
+        if changes is None:
+            self.load_contacts()
+            return
+        for op, key, record in changes:
+            if op == "set":
+                self.data[key] = record
+                self.indexes.add(key, record)
+            elif op == "del" and key in self.data:
+                self.data.pop(key)
+                self.indexes.remove(key)
+            elif op == "clear":
+                self.data.clear()
+                self.indexes.clear()
 
     def load_contacts(self):
         try:
-            with open(self.file_name, "rb") as f:
-                self.data = pickle.load(f)
+            self.data = self.storage.load()
         except:
             return
+        if isinstance(self.data, dict):
+            # No snapshot yet or an old one written as a dict of Records
+            self.data = ContactTable(self.data)
+        self.indexes = self.storage.create_indexes(self.data)
+
+
+def restore_state(obj, state):
+    """Sets pickled attributes to an object with __slots__.
+    Pickles made before __slots__ keep state as a plain __dict__
+    """
+    if isinstance(state, tuple):
+        state = {**(state[0] or {}), **state[1]}
+    for key, value in state.items():
+        setattr(obj, key, value)
 
 
 class Record:
     """Keeps all info about users contact"""
 
+    __slots__ = ("name", "email", "birthday", "phones", "home_address")
+
+    def __setstate__(self, state):
+        restore_state(self, state)
+
     def __init__(self, name, phone=None, email=None, birthday=None, home_address=None):
         self.name = name
         self.email = email
@@ -58,14 +206,15 @@ class Record:
 
     def add_phone(self, phone):
         """Adds new phone to the Record if phones field not empty"""
-        self.phones.append(phone)
+        # Assigned, not appended, so a RecordView writes it to its table
+        self.phones = [*self.phones, phone]
 
     def create_phone(self, record, user_input=None, update=False):
         """Adds phone to the Record due it's initialization"""
         if user_input:
             for i in range(10):
-                phone = Phone(user_input)
-                if phone.validate_phone(user_input):
+                if validation.is_phone(user_input):
+                    phone = Phone(validation.normalize_phone(user_input))
                     if update:
                         record.phones = [phone]
                     else:
@@ -85,9 +234,8 @@ class Record:
         """Adds email to the Record due it's initialization"""
         if user_email:
             for i in range(10):
-                email = Email(user_email)
-                if email.validate_email(user_email):
-                    record.email = email
+                if validation.is_email(user_email):
+                    record.email = Email(user_email)
                     break
                 else:
                     print(
@@ -102,9 +250,9 @@ class Record:
         """Adds birthday date to the Record due it's initialization"""
         if user_birthday:
             for i in range(10):
-                birthday = Birthday(user_birthday)
-                if birthday.validate_birthday(user_birthday):
-                    record.birthday = birthday
+                born = validation.parse_birthday(user_birthday)
+                if born:
+                    record.birthday = Birthday(validation.format_date(born))
                     break
                 else:
                     print(
@@ -159,9 +307,14 @@ class Record:
 
 
 class Field:
+    __slots__ = ("_value",)
+
     def __init__(self, value):
         self._value = value
 
+    def __setstate__(self, state):
+        restore_state(self, state)
+
     @property
     def value(self):
         return self._value
@@ -171,10 +324,12 @@ class Field:
 
 
 class Name(Field):
-    pass
+    __slots__ = ()
 
 
 class Phone(Field):
+    __slots__ = ()
+
     @property
     def value(self):
         return self._value
@@ -187,23 +342,21 @@ class Phone(Field):
             raise ValueError
 
     def validate_phone(self, phone):
-        pattern = (
-            r"^[\+]?3?[\s]?8?[\s]?\(?0\d{2}?\)?" r"[\s]?\d{3}[\s|-]?\d{2}[\s|-]?\d{2}$"
-        )
-        a = re.match(pattern, phone)
-        if a is not None:
+        if validation.is_phone(phone):
             return phone
 
 
 class Email(Field):
+    __slots__ = ()
+
     def validate_email(self, email):
-        pattern = r"^[-\w\.]+@([-\w]+\.)+[-\w]{2,4}$"
-        a = re.match(pattern, email)
-        if a is not None:
+        if validation.is_email(email):
             return email
 
 
 class Birthday(Field):
+    __slots__ = ()
+
     @property
     def value(self):
         return self._value
@@ -216,17 +369,344 @@ class Birthday(Field):
             raise ValueError
 
     def validate_birthday(self, birthday):
-        try:
-            bt_obj = datetime.strptime(birthday, "%d.%m.%Y")
-            if bt_obj.date() >= datetime.now().date():
-                return None
+        if validation.parse_birthday(birthday):
             return birthday
-        except:
-            pass
 
 
 class HomeAddress(Field):
-    pass
+    __slots__ = ()
+
+
+class RecordView(Record):
+    """Record of a ContactTable row. Fields are decoded on every access and
+    written back to the row when they are set. phones is a tuple, a new
+    list must be assigned to change it. Pickled as a plain Record.
+
+    A view must not be kept after its contact is removed from the table,
+    the row may be given to another contact.
+    """
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __reduce__(self):
+        record = self.table.record(self.row)
+        fields = (record.name, None, record.email, record.birthday, record.home_address)
+        return Record, fields, {"phones": record.phones}
+
+    def _set(self, field, value):
+        with store_lock:
+            record = self.table.record(self.row)
+            setattr(record, field, value)
+            self.table.put(self.row, record)
+
+    @property
+    def name(self):
+        return self.table.field(self.row, "name")
+
+    @name.setter
+    def name(self, value):
+        self._set("name", value)
+
+    @property
+    def phones(self):
+        return tuple(self.table.field(self.row, "phones"))
+
+    @phones.setter
+    def phones(self, value):
+        self._set("phones", list(value))
+
+    @property
+    def email(self):
+        return self.table.field(self.row, "email")
+
+    @email.setter
+    def email(self, value):
+        self._set("email", value)
+
+    @property
+    def birthday(self):
+        return self.table.field(self.row, "birthday")
+
+    @birthday.setter
+    def birthday(self, value):
+        self._set("birthday", value)
+
+    @property
+    def home_address(self):
+        return self.table.field(self.row, "home_address")
+
+    @home_address.setter
+    def home_address(self, value):
+        self._set("home_address", value)
+
+
+class ContactTable(MutableMapping):
+    """Records of the AddressBook packed into one utf-8 buffer instead of
+    six Python objects per contact.
+
+    A row holds phones, email, birthday and home address of one contact.
+    Every field is "=" + value or empty when it is None, fields are
+    separated by field_separator and phones by phone_separator. starts and
+    lengths locate the rows in the buffer, names keep the name of every
+    row and rows map the keys to row numbers. Reading a key returns
+    a RecordView of its row.
+
+    Records which don't fit, like fields of other types or values with the
+    separators, are kept as they are in records.
+    """
+
+    field_separator = "\x1e"
+    phone_separator = "\x1f"
+    field_types = {"email": Email, "birthday": Birthday, "home_address": HomeAddress}
+    # Rewrite the buffer when it has more garbage than this
+    compact_threshold = 1024 * 1024
+
+    def __init__(self, records=()):
+        self.rows = {}
+        self.names = []
+        self.starts = array("Q")
+        self.lengths = array("I")
+        self.buffer = bytearray()
+        self.garbage = 0
+        self.free = []
+        self.records = {}
+        self.update(records)
+
+    def copy(self):
+        """Copy of the table for a snapshot"""
+        table = ContactTable()
+        table.rows = dict(self.rows)
+        table.names = list(self.names)
+        table.starts = array("Q", self.starts)
+        table.lengths = array("I", self.lengths)
+        table.buffer = bytearray(self.buffer)
+        table.garbage = self.garbage
+        table.free = list(self.free)
+        table.records = dict(self.records)
+        return table
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __getitem__(self, key):
+        row = self.rows[key]
+        if row in self.records:
+            return self.records[row]
+        return RecordView(self, row)
+
+    def __setitem__(self, key, record):
+        row = self.rows.get(key)
+        if isinstance(record, RecordView) and record.table is self:
+            if record.row == row:
+                # Fields were written to the row when they were set
+                return
+            record = self.record(record.row)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                row = len(self.names)
+                self.names.append(None)
+                self.starts.append(0)
+                self.lengths.append(0)
+            self.rows[key] = row
+        self.put(row, record)
+
+    def __delitem__(self, key):
+        row = self.rows.pop(key)
+        self.records.pop(row, None)
+        self.garbage += self.lengths[row]
+        self.names[row] = None
+        self.lengths[row] = 0
+        self.free.append(row)
+
+    def pop(self, key, *default):
+        """Removes the key and returns its Record, which is not a view"""
+        if key not in self.rows and default:
+            return default[0]
+        record = self.record(self.rows[key])
+        del self[key]
+        return record
+
+    def clear(self):
+        self.__init__()
+
+    def fields(self, row):
+        """Values of the row by field name, None for missing fields"""
+        start = self.starts[row]
+        values = self.buffer[start : start + self.lengths[row]].decode()
+        values = values.split(self.field_separator)
+        return {
+            field: value[1:] if value else None
+            for field, value in zip(("phones", *self.field_types), values)
+        }
+
+    def field(self, row, field):
+        """Field of the row as the Record keeps it"""
+        if row in self.records:
+            return getattr(self.records[row], field, None)
+        if field == "name":
+            return Name(self.names[row])
+        value = self.fields(row)[field]
+        if field == "phones":
+            return self.phones(value)
+        return None if value is None else self.field_types[field](value)
+
+    def phones(self, value):
+        if value is None:
+            return []
+        return [Phone(phone) for phone in value.split(self.phone_separator)]
+
+    def record(self, row):
+        """Record with the fields of the row, not bound to the table"""
+        if row in self.records:
+            return self.records[row]
+        fields = self.fields(row)
+        record = Record(Name(self.names[row]))
+        record.phones = self.phones(fields.pop("phones"))
+        for field, value in fields.items():
+            if value is not None:
+                setattr(record, field, self.field_types[field](value))
+        return record
+
+    def put(self, row, record):
+        """Writes the Record into the row"""
+        self.garbage += self.lengths[row]
+        self.lengths[row] = 0
+        self.names[row] = record.name.value
+        values = self.encode(record)
+        if values is None:
+            self.records[row] = record
+            return
+        self.records.pop(row, None)
+        self.starts[row] = len(self.buffer)
+        self.lengths[row] = len(values)
+        self.buffer += values
+        if (
+            self.garbage > self.compact_threshold
+            and self.garbage > len(self.buffer) // 2
+        ):
+            self.compact()
+
+    def fits(self, value):
+        return (
+            type(value) is str
+            and self.field_separator not in value
+            and self.phone_separator not in value
+        )
+
+    def encode(self, record):
+        """Row of the Record in utf-8, None if the Record doesn't fit a row"""
+        if type(record) not in (Record, RecordView) or type(record.name) is not Name:
+            return None
+        phones = getattr(record, "phones", None) or []
+        if any(
+            type(phone) is not Phone or not self.fits(phone.value) for phone in phones
+        ):
+            return None
+        values = [
+            (
+                self.phone_separator.join(phone.value for phone in phones)
+                if phones
+                else None
+            )
+        ]
+        for field, field_type in self.field_types.items():
+            value = getattr(record, field, None)
+            if value is not None and (
+                type(value) is not field_type or not self.fits(value.value)
+            ):
+                return None
+            values.append(None if value is None else value.value)
+        return self.field_separator.join(
+            "" if value is None else "=" + value for value in values
+        ).encode()
+
+    def compact(self):
+        """Rewrites the buffer without values of changed and removed rows"""
+        buffer = bytearray()
+        for row in self.rows.values():
+            if row in self.records:
+                continue
+            start = self.starts[row]
+            self.starts[row] = len(buffer)
+            buffer += self.buffer[start : start + self.lengths[row]]
+        self.buffer = buffer
+        self.garbage = 0
+
+
+def validate_contacts(contacts):
+    """Checks raw contacts with the same rules as the add command.
+    Fields of all contacts are validated column by column
+
+    Returns:
+        list: (contact with normalized fields, reason of rejection or None)
+    """
+    phones = [phone for contact in contacts for phone in contact["phones"]]
+    emails = [contact["email"] for contact in contacts if contact["email"]]
+    birthdays = [contact["birthday"] for contact in contacts if contact["birthday"]]
+    phone_mask, phone_values = validation.validate_phones(phones)
+    email_mask, email_values = validation.validate_emails(emails)
+    birthday_mask, birthday_values = validation.validate_birthdays(birthdays)
+    phones_at = emails_at = birthdays_at = 0
+    checked = []
+    for contact in contacts:
+        error = None
+        if not contact["name"]:
+            error = "Contact name is required"
+        count = len(contact["phones"])
+        for i in range(phones_at, phones_at + count):
+            if not phone_mask[i] and not error:
+                error = f"Incorrect phone number {phones[i]}"
+        normalized = {**contact, "phones": phone_values[phones_at : phones_at + count]}
+        phones_at += count
+        if contact["email"]:
+            if not email_mask[emails_at] and not error:
+                error = f"Incorrect email {contact['email']}"
+            normalized["email"] = email_values[emails_at]
+            emails_at += 1
+        if contact["birthday"]:
+            if not birthday_mask[birthdays_at] and not error:
+                error = f"Incorrect birthday {contact['birthday']}"
+            normalized["birthday"] = birthday_values[birthdays_at]
+            birthdays_at += 1
+        checked.append((contact if error else normalized, error))
+    return checked
+
+
+def contact_to_record(contact):
+    record = Record(Name(contact["name"]))
+    record.phones = [Phone(phone) for phone in contact["phones"]]
+    if contact["email"]:
+        record.email = Email(contact["email"])
+    if contact["birthday"]:
+        record.birthday = Birthday(contact["birthday"])
+    if contact["home_address"]:
+        record.home_address = HomeAddress(contact["home_address"])
+    return record
+
+
+def record_to_contact(record):
+    email = getattr(record, "email", None)
+    birthday = getattr(record, "birthday", None)
+    home_address = getattr(record, "home_address", None)
+    return {
+        "name": record.name.value,
+        "phones": [phone.value for phone in getattr(record, "phones", [])],
+        "email": email.value if email else "",
+        "birthday": birthday.value if birthday else "",
+        "home_address": home_address.value if home_address else "",
+    }
 
 
 class CommandsHandler:
@@ -234,8 +714,10 @@ class CommandsHandler:
     All methods of this class goes to commands dict in CONFIG
     """
 
-    def __init__(self):
-        self.address_book = AddressBook()
+    # Contacts are saved once per this number of imported rows
+    import_batch_size = 1000
+    # Read from disk by the first command, not when the module is imported
+    address_book = LazyStore(AddressBook)
 
     def get_help(self):
         """Shows all commands for the sublayer"""
@@ -248,7 +730,9 @@ class CommandsHandler:
         """Add new contact"""
         user_name = input(Style.BRIGHT + Fore.BLUE + "Enter contact name: ")
         if not user_name:
-            print("\033[4m\033[31m\033[45m{}\033[0m".format("Contact name is required"))
+            report_error(
+                "\033[4m\033[31m\033[45m{}\033[0m".format("Contact name is required")
+            )
             return
         else:
             name = Name(user_name)
@@ -289,10 +773,31 @@ class CommandsHandler:
     def show_all(self):
         """Shows the entire Address Book"""
         data = self.address_book.data
-        table = AddressBookDataOutput()
-        table.create_header(["Name", "Phones", "Email", "Birthday", "Address"])
-        table.convert_data_to_table(data)
-        print(Fore.GREEN + str(table))
+        columns = ["Name", "Phones", "Email", "Birthday", "Address"]
+        if len(data) <= AddressBookPagedOutput.page_size:
+            table = AddressBookDataOutput()
+            table.create_header(columns)
+            table.convert_data_to_table(data)
+            print(Fore.GREEN + str(table))
+            return
+        sort_by = (
+            input(
+                Style.BRIGHT + Fore.BLUE + f"Sort by column {', '.join(columns)} "
+                "(Enter to skip): "
+            )
+            .strip()
+            .capitalize()
+        )
+        table = AddressBookPagedOutput()
+        table.create_header(columns)
+        table.convert_data_to_table(
+            data, sort_by=columns.index(sort_by) if sort_by in columns else None
+        )
+        for page in table.pages():
+            print(Fore.GREEN + page)
+            more = input(Style.BRIGHT + Fore.BLUE + "Enter - next page, q - stop: ")
+            if more.strip().lower() == "q":
+                break
 
     def find_contacts(self):
         """Find contact in Address Book"""
@@ -303,59 +808,56 @@ class CommandsHandler:
                 "\033[4m\033[31m\033[45m{}\033[0m".format("The address book is empty.")
             )
         else:
-            flag = False
-            for name, record in data.items():
+            by_name = self.address_book.find_by_name(find_user)
+            by_phone = self.address_book.find_by_phone(find_user) - by_name
+            for name in sorted(by_name):
+                record = data[name]
                 rec_data = record.formatting_record(record)
-                if name.startswith(find_user):
-                    flag = True
-                    find_list = (
-                        f"|Name: {name}, Phone: {rec_data['phone']},"
-                        f"Email: {rec_data['email']},"
-                        f"Birthday: {rec_data['birthday']},"
-                        f"Home address: {rec_data['home_address']}|"
-                    )
-                    print("\033[1m\033[35m{}\033[0m".format(find_list))
-                phones = getattr(record, "phones", "")
-
-                if phones:
-                    for phone in phones:
-                        if phone.value.startswith(find_user):
-                            flag = True
-                            print(
-                                f"Name: {name}, Phone: {rec_data['phone']}, "
-                                f"Email: {rec_data['email']}, "
-                                f"Birthday: {rec_data['birthday']}"
-                            )
-            if not flag:
+                find_list = (
+                    f"|Name: {name}, Phone: {rec_data['phone']},"
+                    f"Email: {rec_data['email']},"
+                    f"Birthday: {rec_data['birthday']},"
+                    f"Home address: {rec_data['home_address']}|"
+                )
+                print("\033[1m\033[35m{}\033[0m".format(find_list))
+            for name in sorted(by_phone):
+                record = data[name]
+                rec_data = record.formatting_record(record)
+                print(
+                    f"Name: {name}, Phone: {rec_data['phone']}, "
+                    f"Email: {rec_data['email']}, "
+                    f"Birthday: {rec_data['birthday']}"
+                )
+            if not by_name and not by_phone:
                 print(
                     "\033[4m\033[31m\033[45m{}\033[0m".format(
                         "Contact with this name or phone number was " "not found."
                     )
                 )
+                similar = self.address_book.fuzzy_find(find_user)
+                if similar:
+                    print(Style.BRIGHT + Fore.YELLOW + "Maybe you meant:")
+                for name in similar:
+                    rec_data = data[name].formatting_record(data[name])
+                    print(
+                        f"Name: {name}, Phone: {rec_data['phone']}, "
+                        f"Email: {rec_data['email']}, "
+                        f"Home address: {rec_data['home_address']}"
+                    )
 
     def birthday_contacts(self):
         """Show birthdays"""
         birth_user = int(input(Style.BRIGHT + Fore.BLUE + "Enter a number of days: "))
-        flag = False
-        now = datetime.now().date()
         data = self.address_book.show_all_records()
-        current_date = now + timedelta(days=birth_user)
-        for name, record in data.items():
-            rec_data = record.formatting_record(record)
-            if record.birthday:
-                birth = rec_data["birthday"]
-                new_user_date = datetime.strptime(birth, "%d.%m.%Y").date()
-                new_date = datetime(
-                    day=new_user_date.day, month=new_user_date.month, year=now.year
-                ).date()
-                if new_date >= now and new_date < current_date:
-                    flag = True
-                    print(
-                        f"Name: {name}, Phone: {rec_data['phone']}, "
-                        f"Email: {rec_data['email']}, "
-                        f"Birthday: {rec_data['birthday']}"
-                    )
-        if not flag:
+        found = self.address_book.upcoming_birthdays(birth_user)
+        for name in found:
+            rec_data = data[name].formatting_record(data[name])
+            print(
+                f"Name: {name}, Phone: {rec_data['phone']}, "
+                f"Email: {rec_data['email']}, "
+                f"Birthday: {rec_data['birthday']}"
+            )
+        if not found:
             print(
                 "\033[4m\033[31m\033[45m{}\033[0m".format(
                     "There are no birthdays in this range!"
@@ -367,99 +869,99 @@ class CommandsHandler:
         change_user = input(Style.BRIGHT + Fore.CYAN + "Enter contact name: ")
         data = self.address_book.show_all_records()
         if not data:
-            print(
+            report_error(
                 "\033[4m\033[31m\033[45m{}\033[0m".format("The address book is empty.")
             )
         else:
             flag = False
             update_name_data = {}
-            for name, record in data.items():
-                if name.startswith(change_user):
-                    flag = True
-                    change_commands = PrettyTable()
-                    change_commands.field_names = ["Command entry", "Command value"]
-                    change_commands.add_row(
-                        ["Press 1", "Add a phone number to a contact"]
+            for name in sorted(self.address_book.find_by_name(change_user)):
+                record = data[name]
+                flag = True
+                change_commands = PrettyTable()
+                change_commands.field_names = ["Command entry", "Command value"]
+                change_commands.add_row(["Press 1", "Add a phone number to a contact"])
+                change_commands.add_row(["Press 2", "Change contact email"])
+                change_commands.add_row(["Press 3", "Change contact birthday"])
+                change_commands.add_row(["Press 4", "Change contact name"])
+                change_commands.add_row(["Press 5", "Change contact phone number"])
+                change_commands.add_row(["Press 6", "Change contact home address"])
+                print("\033[1m\033[36m{}\033[0m".format(change_commands))
+                change = input(Style.BRIGHT + Fore.CYAN + "Enter your choice: ")
+                if change == "1":
+                    num = input(Style.BRIGHT + Fore.CYAN + "Enter number: ")
+                    record.create_phone(record=record, user_input=num, update=False)
+                    print(
+                        Style.BRIGHT
+                        + Back.BLUE
+                        + Fore.RED
+                        + f"In contact {name} append "
+                        f"{[phone.value for phone in record.phones]}"
                     )
-                    change_commands.add_row(["Press 2", "Change contact email"])
-                    change_commands.add_row(["Press 3", "Change contact birthday"])
-                    change_commands.add_row(["Press 4", "Change contact name"])
-                    change_commands.add_row(["Press 5", "Change contact phone number"])
-                    change_commands.add_row(["Press 6", "Change contact home address"])
-                    print("\033[1m\033[36m{}\033[0m".format(change_commands))
-                    change = input(Style.BRIGHT + Fore.CYAN + "Enter your choice: ")
-                    if change == "1":
-                        num = input(Style.BRIGHT + Fore.CYAN + "Enter number: ")
-                        record.create_phone(record=record, user_input=num, update=False)
-                        print(
-                            Style.BRIGHT
-                            + Back.BLUE
-                            + Fore.RED
-                            + f"In contact {name} append "
-                            f"{[phone.value for phone in record.phones]}"
-                        )
-                    elif change == "2":
-                        mail = input(Style.BRIGHT + Fore.CYAN + "Enter new email: ")
-                        record.create_email(record=record, user_email=mail)
-                        print(
-                            Back.BLUE
-                            + Fore.RED
-                            + f"In contact {name} change or append email "
-                            f"{record.email.value}"
-                        )
-                    elif change == "3":
-                        birthday = input(Style.BRIGHT + Fore.CYAN + "Enter new date: ")
-                        record.create_birthday(record=record, user_birthday=birthday)
-                        print(
-                            Style.BRIGHT
-                            + Back.BLUE
-                            + Fore.RED
-                            + f"In contact {name} change or append date birthday"
-                            f"{record.birthday.value}"
-                        )
-                    elif change == "4":
-                        new_name = input(Style.BRIGHT + Fore.CYAN + "Enter new name: ")
-                        record.name = Name(new_name)
-                        update_name_data[name] = new_name
-                        print(
-                            "\033[3m\033[33m\033[41m{}\033[0m".format(
-                                "Contact name changed to:"
-                            ),
-                            Style.BRIGHT + Fore.LIGHTGREEN_EX + record.name.value,
-                        )
-                    elif change == "5":
-                        num = input(Style.BRIGHT + Fore.CYAN + "Enter number: ")
-                        record.create_phone(record=record, user_input=num, update=True)
-                        print(
-                            Style.BRIGHT
-                            + Back.BLUE
-                            + Fore.RED
-                            + f"In contact {name} update "
-                            f"{[phone.value for phone in record.phones]}"
-                        )
-                    elif change == "6":
-                        new_address = input(
-                            Style.BRIGHT + Fore.CYAN + "Enter new address: "
-                        )
-                        record.home_address_create(
-                            record=record, user_address=new_address
-                        )
-                        print(
-                            Style.BRIGHT
-                            + Back.BLUE
-                            + Fore.RED
-                            + f"In contact {name} change or append home address"
-                            f" {record.home_address.value}"
-                        )
-                    else:
-                        print(Style.BRIGHT + Fore.RED + f"{change} invalid choice")
-                        return
+                elif change == "2":
+                    mail = input(Style.BRIGHT + Fore.CYAN + "Enter new email: ")
+                    record.create_email(record=record, user_email=mail)
+                    print(
+                        Back.BLUE
+                        + Fore.RED
+                        + f"In contact {name} change or append email "
+                        f"{record.email.value}"
+                    )
+                elif change == "3":
+                    birthday = input(Style.BRIGHT + Fore.CYAN + "Enter new date: ")
+                    record.create_birthday(record=record, user_birthday=birthday)
+                    print(
+                        Style.BRIGHT
+                        + Back.BLUE
+                        + Fore.RED
+                        + f"In contact {name} change or append date birthday"
+                        f"{record.birthday.value}"
+                    )
+                elif change == "4":
+                    new_name = input(Style.BRIGHT + Fore.CYAN + "Enter new name: ")
+                    record.name = Name(new_name)
+                    update_name_data[name] = new_name
+                    print(
+                        "\033[3m\033[33m\033[41m{}\033[0m".format(
+                            "Contact name changed to:"
+                        ),
+                        Style.BRIGHT + Fore.LIGHTGREEN_EX + record.name.value,
+                    )
+                elif change == "5":
+                    num = input(Style.BRIGHT + Fore.CYAN + "Enter number: ")
+                    record.create_phone(record=record, user_input=num, update=True)
+                    print(
+                        Style.BRIGHT
+                        + Back.BLUE
+                        + Fore.RED
+                        + f"In contact {name} update "
+                        f"{[phone.value for phone in record.phones]}"
+                    )
+                elif change == "6":
+                    new_address = input(
+                        Style.BRIGHT + Fore.CYAN + "Enter new address: "
+                    )
+                    record.home_address_create(record=record, user_address=new_address)
+                    print(
+                        Style.BRIGHT
+                        + Back.BLUE
+                        + Fore.RED
+                        + f"In contact {name} change or append home address"
+                        f" {record.home_address.value}"
+                    )
+                else:
+                    # Contacts changed before are still renamed and saved
+                    report_error(Style.BRIGHT + Fore.RED + f"{change} invalid choice")
+                    continue
+                self.address_book.update_record(record)
             for name, new_name in update_name_data.items():
-                self.address_book.data[new_name] = self.address_book.data.pop(name)
+                self.address_book.rename_record(name, new_name)
             if flag:
                 self.address_book.save_contacts()
             else:
-                print("\033[4m\033[31m\033[45m{}\033[0m".format("User not fount"))
+                report_error(
+                    "\033[4m\033[31m\033[45m{}\033[0m".format("User not fount")
+                )
 
     def remove_contacts(self):
         """Delete contact from address book"""
@@ -474,7 +976,7 @@ class CommandsHandler:
                 Style.BRIGHT + Fore.YELLOW + "Enter the name of the contact "
                 "to be deleted: "
             )
-            self.address_book.data.pop(remove_user)
+            self.address_book.remove_record(remove_user)
             print(Style.BRIGHT + Fore.RED + f"Contact {remove_user} deleted.")
             self.address_book.save_contacts()
         elif remove_date == "del all":
@@ -486,14 +988,58 @@ class CommandsHandler:
             if question == "n":
                 return
             elif question == "y":
-                self.address_book.data.clear()
+                self.address_book.clear_records()
             self.address_book.save_contacts()
         else:
-            print(Style.BRIGHT + Fore.RED + f"Invalid command")
+            report_error(Style.BRIGHT + Fore.RED + f"Invalid command")
+
+    def import_contacts(self):
+        """Import contacts from csv or vCard file"""
+        path = input(Style.BRIGHT + Fore.BLUE + "Enter path to .csv or .vcf file: ")
+        error_path = path + ".errors.csv"
+        try:
+            contacts = transfer.readers[transfer.file_format(path)](path)
+            imported = rejected = 0
+            for chunk in transfer.chunks(contacts, self.import_batch_size):
+                rejects = []
+                for contact, error in validate_contacts(chunk):
+                    if error:
+                        rejects.append({**contact, "error": error})
+                        continue
+                    self.address_book.add_record(contact_to_record(contact))
+                    imported += 1
+                self.address_book.save_contacts(verbose=False)
+                if rejects:
+                    rejected += transfer.write_csv(
+                        error_path, rejects, ["error"], append=rejected > 0
+                    )
+        except (OSError, UnicodeDecodeError) as error:
+            report_error(Style.BRIGHT + Fore.RED + f"Can't read {path}: {error}")
+            return
+        print(Style.BRIGHT + Fore.YELLOW + f"Imported {imported} contacts.")
+        if rejected:
+            print(
+                Style.BRIGHT
+                + Fore.RED
+                + f"{rejected} contacts rejected, see {error_path}"
+            )
+
+    def export_contacts(self):
+        """Export contacts to csv or vCard file"""
+        path = input(Style.BRIGHT + Fore.BLUE + "Enter path to .csv or .vcf file: ")
+        contacts = (
+            record_to_contact(record) for record in self.address_book.data.values()
+        )
+        try:
+            count = transfer.writers[transfer.file_format(path)](path, contacts)
+        except OSError as error:
+            report_error(Style.BRIGHT + Fore.RED + f"Can't write {path}: {error}")
+            return
+        print(Style.BRIGHT + Fore.YELLOW + f"Exported {count} contacts to {path}")
 
     def get_back(self):
         """Back to main menu"""
-        pass
+        self.address_book.flush()
 
 
 class TableOutput(ABC):
@@ -524,6 +1070,75 @@ class AddressBookDataOutput(TableOutput):
         return f"{self.table}"
 
 
+class AddressBookPagedOutput(TableOutput):
+    """Table for big books which is rendered page by page.
+    Column widths are taken from the first sample_size rows, longer values
+    are cut, so the first page is ready before the rest is read
+    """
+
+    page_size = 50
+    sample_size = 500
+    max_width = 40
+
+    def create_header(self, column_names: list):
+        self.columns = column_names
+
+    def convert_data_to_table(self, data, sort_by=None):
+        records = data.values()
+        if sort_by is not None:
+            records = sorted(records, key=self.sort_key(sort_by))
+        self.rows = (self.to_row(record) for record in records)
+        self.sample = list(itertools.islice(self.rows, self.sample_size))
+        self.widths = [
+            min(
+                max([len(column)] + [len(row[i]) for row in self.sample]),
+                self.max_width,
+            )
+            for i, column in enumerate(self.columns)
+        ]
+
+    @staticmethod
+    def to_row(record):
+        fields = [record.name, ", ".join(map(str, record.phones))]
+        fields += [record.email, record.birthday, record.home_address]
+        return ["" if field is None else str(field) for field in fields]
+
+    def sort_key(self, column):
+        """Key for sorting Records by the column number"""
+
+        def key(record):
+            row = self.to_row(record)
+            if column == 3:
+                born = validation.parse_date(row[3]) if row[3] else None
+                return (born is None, born or datetime.min.date())
+            return (not row[column], row[column].lower())
+
+        return key
+
+    def format_row(self, row):
+        cells = []
+        for value, width in zip(row, self.widths):
+            if len(value) > width:
+                value = value[: width - 3] + "..."
+            cells.append(f" {value:<{width}} ")
+        return "|" + "|".join(cells) + "|"
+
+    def pages(self):
+        """Yields the table as strings of page_size rows with the header"""
+        border = "+" + "+".join("-" * (width + 2) for width in self.widths) + "+"
+        header = "\n".join([border, self.format_row(self.columns), border])
+        rows = itertools.chain(self.sample, self.rows)
+        while True:
+            page = list(itertools.islice(rows, self.page_size))
+            if not page:
+                return
+            lines = [header] + [self.format_row(row) for row in page] + [border]
+            yield "\n".join(lines)
+
+    def __str__(self):
+        return "\n".join(self.pages())
+
+
 class HelpOutput(TableOutput):
     def create_header(self, welcome_string):
         self.table = [welcome_string]
@@ -546,6 +1161,8 @@ help = (
     "|get bith - Show birthdays\n"
     "|change - Change contact\n"
     "|del - Delete contact from address book\n"
+    "|import - Import contacts from csv or vCard file\n"
+    "|export - Export contacts to csv or vCard file\n"
     "|back - Closing the sublayer\n"
 )
 
@@ -557,6 +1174,8 @@ commands = {
     "get bith": CommandsHandler().birthday_contacts,
     "change": CommandsHandler().change_contacts,
     "del": CommandsHandler().remove_contacts,
+    "import": CommandsHandler().import_contacts,
+    "export": CommandsHandler().export_contacts,
     "back": CommandsHandler().get_back,
 }
 
@@ -0,0 +1,152 @@
+import io
+import json
+import re
+import sys
+import time
+from contextlib import redirect_stdout
+
+from sublayers.handler import Handler, reported_errors
+from sublayers.registry import load_commands
+from sublayers.writer import defer_all, flush_all
+
+ANSI_CODES = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def sublayer_key(name):
+    """'Address Book', 'address book' and 'addressbook' are the same sublayer"""
+    return name.lower().replace(" ", "").replace("_", "")
+
+
+def read_script(stream):
+    """Yields (line number, command dict or error text) from JSON lines.
+    Empty lines and lines starting with # are skipped
+
+    A command looks like
+    {"sublayer": "address book", "command": "add", "args": ["Bill", "0991234567"]}
+    where args are answers to the questions the command asks
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as error:
+            yield number, f"invalid JSON: {error}"
+            continue
+        if not isinstance(item, dict) or "command" not in item:
+            yield number, "expected an object with sublayer, command and args"
+            continue
+        yield number, item
+
+
+class BatchRunner:
+    """Runs commands of the sublayers without a user at the keyboard.
+
+    Answers to the questions of a command are fed to its input() calls,
+    everything it prints is kept for the report. A command which reported
+    an error with report_error() is failed. Saves are put off and
+    written once by finish().
+    """
+
+    def __init__(self, sublayers, default_sublayer=None):
+        # Sublayers are loaded by their first command
+        self.sublayers = {sublayer_key(name): name for name in sublayers}
+        self.handlers = {}
+        self.default_sublayer = default_sublayer
+        self.results = []
+        defer_all()
+
+    def run(self, number, item):
+        """Runs one command
+
+        Returns:
+            dict: line, sublayer, command, ok, message, output and time in ms
+        """
+        result = {"line": number, "sublayer": "", "command": "", "output": ""}
+        if isinstance(item, str):
+            return self._done(result, False, item, 0)
+        sublayer = str(item.get("sublayer") or self.default_sublayer or "")
+        command = str(item["command"])
+        args = item.get("args", [])
+        if not isinstance(args, list):
+            args = [args]
+        result.update(sublayer=sublayer, command=command)
+        handler = self.handler(sublayer)
+        if handler is None:
+            return self._done(result, False, f"unknown sublayer '{sublayer}'", 0)
+        if command not in handler.commands:
+            message = f"unknown command '{command}'"
+            suggestion = handler.get_command_suggestion(command)
+            if suggestion:
+                message += f", did you mean '{suggestion[0]}'?"
+            return self._done(result, False, message, 0)
+
+        answers = io.StringIO("".join(f"{arg}\n" for arg in args))
+        output = io.StringIO()
+        stdin = sys.stdin
+        sys.stdin = answers
+        start = time.perf_counter()
+        try:
+            with redirect_stdout(output):
+                handler.execute_command(command)
+            if reported_errors:
+                ok, message = False, ANSI_CODES.sub("", reported_errors[-1]).strip()
+            else:
+                ok, message = True, "ok"
+        except EOFError:
+            ok, message = False, "not enough args"
+        except Exception as error:
+            ok, message = False, f"{type(error).__name__}: {error}"
+        finally:
+            sys.stdin = stdin
+        spent = (time.perf_counter() - start) * 1000
+        unused = len(answers.readlines())
+        if ok and unused:
+            message = f"ok, {unused} args not used"
+        result["output"] = ANSI_CODES.sub("", output.getvalue())
+        return self._done(result, ok, message, spent)
+
+    def handler(self, sublayer):
+        key = sublayer_key(sublayer)
+        if key not in self.handlers and key in self.sublayers:
+            self.handlers[key] = Handler(load_commands(self.sublayers[key]))
+        return self.handlers.get(key)
+
+    def run_script(self, stream):
+        for number, item in read_script(stream):
+            yield self.run(number, item)
+
+    def finish(self):
+        """Writes all changes at once
+
+        Returns:
+            float: time of the write in ms
+        """
+        start = time.perf_counter()
+        flush_all()
+        return (time.perf_counter() - start) * 1000
+
+    def _done(self, result, ok, message, spent):
+        result.update(ok=ok, message=message, ms=spent)
+        self.results.append(result)
+        return result
+
+
+def print_result(result, verbose=False):
+    status = "ok" if result["ok"] else "FAILED"
+    name = f"{result['sublayer']} {result['command']}".strip() or "-"
+    print(f"{result['line']:>5} {name}: {status} ({result['ms']:.1f} ms)", end="")
+    print("" if result["message"] == "ok" else f" - {result['message']}")
+    if verbose and result["output"]:
+        for line in result["output"].rstrip().splitlines():
+            print(f"      | {line}")
+
+
+def print_totals(results, flush_ms):
+    failed = sum(1 for result in results if not result["ok"])
+    spent = sum(result["ms"] for result in results)
+    print(
+        f"{len(results)} commands: {len(results) - failed} ok, {failed} failed, "
+        f"{spent:.1f} ms in commands, {flush_ms:.1f} ms to save"
+    )
@@ -0,0 +1,135 @@
+import os
+import time
+import zlib
+
+from sublayers.locks import FileLock
+
+RAW = b"r"
+COMPRESSED = b"z"
+
+
+class BlobStore:
+    """Append-only files of zlib compressed texts.
+
+    A text is addressed by a (generation, offset, length) reference. Blobs
+    are never changed in place, an edited text is appended again and the old
+    bytes become garbage until compact() copies live blobs into a file of
+    the next generation.
+
+    Processes sharing the files append under a file lock. Files of old
+    generations may still be read by other processes, so they are deleted
+    only after keep_seconds without changes.
+    """
+
+    level = 6
+    keep_seconds = 3600
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.file_lock = FileLock(prefix + ".lock")
+        self.generation = 0
+        self._readers = {}
+        self._writer = None
+
+    def file_of(self, generation):
+        return f"{self.prefix}.{generation}"
+
+    def generations(self):
+        """Generations of blob files lying on disk"""
+        folder, base = os.path.split(self.prefix)
+        found = []
+        for file_name in os.listdir(folder or "."):
+            stem, _, suffix = file_name.rpartition(".")
+            if stem == base and suffix.isdigit():
+                found.append(int(suffix))
+        return found
+
+    def open(self, generation):
+        """Starts appending to the file of the generation"""
+        self.close()
+        self.generation = generation
+        self._writer = open(self.file_of(generation), "ab")
+
+    def put(self, text):
+        """Appends text to the current file
+
+        Returns:
+            tuple: (generation, offset, length) reference of the blob
+        """
+        if self._writer is None:
+            self.open(self.generation)
+        raw = text.encode()
+        packed = zlib.compress(raw, self.level)
+        blob = COMPRESSED + packed if len(packed) < len(raw) else RAW + raw
+        with self.file_lock.hold():
+            offset = self._writer.seek(0, os.SEEK_END)
+            self._writer.write(blob)
+            self._writer.flush()
+        return self.generation, offset, len(blob)
+
+    def get(self, ref):
+        blob = self._read_blob(ref)
+        if blob[:1] == COMPRESSED:
+            return zlib.decompress(blob[1:]).decode()
+        return blob[1:].decode()
+
+    def flush(self):
+        """Makes appended blobs durable before records pointing to them are saved"""
+        if self._writer is not None:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+
+    def size(self):
+        try:
+            return os.path.getsize(self.file_of(self.generation))
+        except OSError:
+            return 0
+
+    def compact(self, refs):
+        """Copies live blobs into a file of the next generation
+
+        Args:
+            refs: references of all live blobs
+
+        Returns:
+            dict: old reference -> new reference
+        """
+        with self.file_lock.hold():
+            generation = max([self.generation, *self.generations()]) + 1
+            moved = {}
+            with open(self.file_of(generation), "wb") as f:
+                for ref in refs:
+                    moved[ref] = generation, f.tell(), ref[2]
+                    f.write(self._read_blob(ref))
+                f.flush()
+                os.fsync(f.fileno())
+        self.open(generation)
+        return moved
+
+    def remove_unused(self, used):
+        """Deletes old blob files of generations no reference points to"""
+        for generation in self.generations():
+            if generation in used or generation >= self.generation:
+                continue
+            file_name = self.file_of(generation)
+            if time.time() - os.path.getmtime(file_name) < self.keep_seconds:
+                continue
+            reader = self._readers.pop(generation, None)
+            if reader is not None:
+                reader.close()
+            os.remove(file_name)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _read_blob(self, ref):
+        generation, offset, length = ref
+        if self._writer is not None and generation == self.generation:
+            self._writer.flush()
+        reader = self._readers.get(generation)
+        if reader is None:
+            reader = self._readers[generation] = open(self.file_of(generation), "rb")
+        reader.seek(offset)
+        return reader.read(length)
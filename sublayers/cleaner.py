@@ -1,9 +1,15 @@
+import argparse
 import os
-import shutil
 from pathlib import Path
 from colorama import init, Fore
 
 from sublayers.addressbook import HelpOutput
+from sublayers.dedup import find_duplicates, remove_duplicates
+from sublayers.extractor import extract_all
+from sublayers.handler import report_error
+from sublayers.mover import MoveExecutor
+from sublayers.scanner import is_folder, scan
+from sublayers.sortplan import SortPlan
 
 init(autoreset=True)
 
@@ -15,6 +21,25 @@ extensions = {
     "documents": ["pdf", "txt", "doc", "docx", "xlsx", "pptx", "odt"],
     "others": [],
 }
+# extension -> category folder
+categories = {
+    extension: category
+    for category, category_extensions in extensions.items()
+    for extension in category_extensions
+}
+# Threads moving files to another disk
+move_workers = 4
+# Archives unpacked at the same time, each in its own process
+extract_workers = 2
+# Limits for one archive with all archives inside it
+archive_max_size = 1024**3
+archive_max_members = 100_000
+archive_max_depth = 2
+# None keeps duplicates, "remove" deletes files with the same content as
+# another file, "link" replaces them with hard links to it
+dedup_mode = None
+# Threads hashing files for dedup
+hash_workers = 4
 
 CYRILLIC_SYMBOLS = "абвгдеёжзийклмнопрстуфхцчшщъыьэюяєіїґ#$%&()^+-:;<=>?@[\]{|`~}!"
 TRANSLATION = (
@@ -120,104 +145,216 @@ def create_folders_from_list(folder_path, folder_names):
             pass
 
 
-file_paths = []
-subfolder_paths = []
+# Threads reading folders of the tree, 1 reads them one by one. More threads
+# help on network and slow disks, where reading a folder waits for the disk
+scan_workers = 1
 
 
-def paths(path, level=1):
-    """finds the path to attached files and folders
+def paths(path, workers=None):
+    """Streams paths of attached files and collects subfolders on the way
 
     Args:
         path: the path to the folder being sorted
-        level: level of nesting (int)
+        workers: threads reading folders, see scan_workers
 
     Returns:
-        list: lists of paths to files and subfolders
+        tuple: generator of file paths and list of subfolder paths, which is
+        complete when the generator is exhausted
     """
-    names_dir = os.listdir(path)
+    subfolder_paths = []
 
-    file_paths.extend([f.path for f in os.scandir(path) if not f.is_dir()])
+    def file_paths():
+        for entry in scan(path, workers):
+            if is_folder(entry):
+                subfolder_paths.append(entry.path)
+            else:
+                yield entry.path
 
-    subfolder_paths.extend([f.path for f in os.scandir(path) if f.is_dir()])
-    for elem in names_dir:
-        if os.path.isdir(path + "/" + elem):
-            paths(path + "/" + elem, level + 1)
-    return file_paths, subfolder_paths
+    return file_paths(), subfolder_paths
 
 
-def sort_files(path):
+def sort_files(path, plan):
     """sorts and arranges in folders
 
     Args:
         path: the path to the folder being sorted
+        plan: SortPlan with moves of the files
+
+    Returns:
+        tuple: MoveExecutor with numbers of moved files per category and
+        failed moves, list of results of unpacked archives
     """
-    ext_list = list(extensions.items())
+    mover = MoveExecutor(move_workers)
+    plan.execute(mover)
 
-    for file_path in file_paths:
-        file_path = str(file_path)
-        extension = file_path.split(".")[-1]
+    if not os.path.isdir(path + "/" + "archives"):
+        return mover, []
+    extracted = extract_all(
+        path + "/" + "archives",
+        extract_workers,
+        archive_max_size,
+        archive_max_members,
+        archive_max_depth,
+    )
+    return mover, extracted
 
-        file_name = file_path.split("/")[-1]
 
-        for dict_key_int in range(len(ext_list)):
-            if extension in ext_list[dict_key_int][1]:
-                shutil.move(
-                    file_path,
-                    f"{path}/{ext_list[dict_key_int][0]}/{normalize(file_name)}",
-                )
+def remove_empty_folders(subfolder_paths):
+    """deleted empty subfolders, the deepest first so folders holding only
+    empty folders are deleted too
 
-    for ar_file in os.listdir(path + "/" + "archives"):
+    Args:
+        subfolder_paths: paths of subfolders of the folder being sorted
+    """
+    for p in sorted(subfolder_paths, key=lambda p: p.count(os.sep), reverse=True):
         try:
-            shutil.unpack_archive(
-                path + "/" + "archives" + "/" + ar_file, path + "/" + "archives"
-            )
-            os.remove(path + "/" + "archives" + "/" + ar_file)
-
-        except shutil.ReadError:
+            os.rmdir(p)
+        except OSError:
             pass
 
-    names_file = [
-        name for name in os.listdir(path) if os.path.isfile(os.path.join(path, name))
-    ]
-    for unkn_file in names_file:
-        shutil.move(
-            path + "/" + unkn_file, path + "/" + "others" + "/" + normalize(unkn_file)
-        )
-
 
-def remove_empty_folders(main_path, level=1):
-    """deleted empty subfolders
+def remove_duplicate_files(file_paths, dry_run=False):
+    """Runs dedup_mode on the files
 
-    Args:
-        main_path: the path to the folder being sorted
-        level: level of nesting (int)
+    Returns:
+        list: paths of files left
     """
-    for p in subfolder_paths:
-        p = str(p)
-        if not os.listdir(p):
-            try:
-                os.rmdir(p)
-                remove_empty_folders(main_path + "/" + p, level + 1)
-            except FileNotFoundError:
-                pass
+    groups = find_duplicates(file_paths, hash_workers)
+    if dry_run:
+        copies = sum(len(group) - 1 for group in groups)
+        print(Fore.MAGENTA + f"Duplicates: {copies} files, nothing was changed")
+        return file_paths
+    done, saved, failed = remove_duplicates(groups, dedup_mode)
+    print(Fore.MAGENTA + f"Duplicates: {len(done)} files, {saved} bytes saved")
+    for path, error in failed:
+        report_error(Fore.LIGHTRED_EX + f"Can't {dedup_mode} {path}: {error}")
+    if dedup_mode == "link":
+        return file_paths
+    removed = set(done)
+    return [path for path in file_paths if path not in removed]
+
+
+def plan_sort(main_path, dry_run=False):
+    """Scans the folder and plans moves of its files, nothing is moved yet
 
-
-def sort():
-    """Sorting the folder"""
+    Returns:
+        tuple: SortPlan and list of subfolder paths
+    """
+    if not os.path.isdir(main_path):
+        raise FileNotFoundError(main_path)
+    plan = SortPlan(main_path)
+    file_paths, subfolder_paths = paths(main_path, scan_workers)
+    file_paths = [path for path in file_paths if not plan.is_journal_file(path)]
+    if dedup_mode:
+        file_paths = remove_duplicate_files(file_paths, dry_run)
+    plan.build(file_paths, categories, normalize)
+    return plan, subfolder_paths
+
+
+def sort_folder(main_path):
+    """Sorts the folder by a plan written to a journal first. A sort which
+    was interrupted is resumed from its journal
+    """
     try:
-        main_path = input(Fore.MAGENTA + "Enter path for folder: ")
-        create_folders_from_list(main_path, extensions)
-        paths(main_path)
-        sort_files(main_path)
-        remove_empty_folders(main_path)
+        if not os.path.isdir(main_path):
+            raise FileNotFoundError(main_path)
+        plan = SortPlan(main_path)
+        if plan.load() and plan.status == "running":
+            print(
+                Fore.MAGENTA
+                + f"Resuming the interrupted sort, {len(plan.done)} of "
+                + f"{len(plan.moves)} files are moved"
+            )
+        else:
+            create_folders_from_list(main_path, extensions)
+            plan, subfolder_paths = plan_sort(main_path)
+            plan.start(subfolder_paths)
+        mover, extracted = sort_files(main_path, plan)
+        remove_empty_folders(plan.folders)
+        plan.finish()
         print(Fore.MAGENTA + "Your files are sorted.\n" + "Deleting empty folders")
-        for name_dir in os.listdir(main_path):
-            print(Fore.MAGENTA + f"{name_dir.capitalize()}: ")
+        for source, error in mover.failed:
+            report_error(Fore.LIGHTRED_EX + f"Can't move {source}: {error}")
+        for result in extracted:
+            if result["ok"]:
+                print(
+                    Fore.CYAN
+                    + f"Unpacked {result['name']}: {result['members']} files, "
+                    + f"{result['bytes']} bytes in {result['ms']:.0f} ms"
+                )
+            else:
+                report_error(
+                    Fore.LIGHTRED_EX
+                    + f"Can't unpack {result['name']}: {result['error']}"
+                )
+        for name_dir in sorted(os.listdir(main_path)):
+            if name_dir.startswith(".") or not os.path.isdir(
+                os.path.join(main_path, name_dir)
+            ):
+                continue
+            moved = mover.moved.get(name_dir)
+            print(
+                Fore.MAGENTA
+                + f"{name_dir.capitalize()}: "
+                + (f"{moved} moved" if moved else "")
+            )
             for name_fale in os.listdir(main_path + "/" + name_dir):
                 print(Fore.CYAN + f"    - {name_fale}")
 
     except FileNotFoundError:
-        print(Fore.LIGHTRED_EX + "The path was wroning. Try again")
+        report_error(Fore.LIGHTRED_EX + "The path was wroning. Try again")
+
+
+def dry_run(main_path):
+    """Prints moves the sort of the folder would do"""
+    try:
+        plan, _ = plan_sort(main_path, dry_run=True)
+    except FileNotFoundError:
+        report_error(Fore.LIGHTRED_EX + "The path was wroning. Try again")
+        return
+    counts = {}
+    for source, target, category in plan.moves:
+        counts[category] = counts.get(category, 0) + 1
+        print(
+            Fore.CYAN
+            + f"{os.path.relpath(source, plan.root)} -> "
+            + f"{os.path.relpath(target, plan.root)}"
+        )
+    for category, count in sorted(counts.items()):
+        print(Fore.MAGENTA + f"{category.capitalize()}: {count} files")
+    print(Fore.MAGENTA + f"{len(plan.moves)} files would be moved, nothing was changed")
+
+
+def undo_folder(main_path):
+    """Moves files of the last sort of the folder back"""
+    plan = SortPlan(main_path)
+    if not os.path.isdir(main_path) or not plan.load() or not plan.done:
+        report_error(Fore.LIGHTRED_EX + "There is no sort of this folder to undo")
+        return
+    restored, failed = plan.undo()
+    remove_empty_folders(os.path.join(main_path, category) for category in extensions)
+    for path, error in failed:
+        report_error(Fore.LIGHTRED_EX + f"Can't move {path} back: {error}")
+    print(
+        Fore.MAGENTA
+        + f"{restored} files are moved back. Unpacked archives and removed "
+        + "duplicates are not restored"
+    )
+
+
+def sort():
+    """Sorting the folder"""
+    sort_folder(input(Fore.MAGENTA + "Enter path for folder: "))
+
+
+def show_plan():
+    """Shows what sort would do without moving files"""
+    dry_run(input(Fore.MAGENTA + "Enter path for folder: "))
+
+
+def undo_sort():
+    """Moves files of the last sort back"""
+    undo_folder(input(Fore.MAGENTA + "Enter path for folder: "))
 
 
 def get_help():
@@ -238,14 +375,37 @@ def get_back():
 help = (
     "|You can use following commands:\n"
     "|sort - Sorting the folder\n"
+    "|plan - Shows what sort would do without moving files\n"
+    "|undo - Moves files of the last sort back\n"
     "|back - Closing the sublayer\n"
 )
 
-commands = {"sort": sort, "help": get_help, "back": get_back}
+commands = {
+    "sort": sort,
+    "plan": show_plan,
+    "undo": undo_sort,
+    "help": get_help,
+    "back": get_back,
+}
 
 
 CONFIG = {"help": help, "commands": commands}
 
 
 if __name__ == "__main__":
-    sort()
+    parser = argparse.ArgumentParser(description="Sorts files of the folder")
+    parser.add_argument("path", nargs="?", help="folder to sort, asked if missing")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the plan without moving files"
+    )
+    parser.add_argument(
+        "--undo", action="store_true", help="move files of the last sort back"
+    )
+    args = parser.parse_args()
+    path = args.path or input(Fore.MAGENTA + "Enter path for folder: ")
+    if args.dry_run:
+        dry_run(path)
+    elif args.undo:
+        undo_folder(path)
+    else:
+        sort_folder(path)
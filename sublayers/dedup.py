@@ -0,0 +1,110 @@
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_SIZE = 64 * 1024
+
+
+def partial_hash(path, size):
+    """Hash of the first and the last blocks of the file, for files up to two
+    blocks it is the hash of the whole file
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(BLOCK_SIZE))
+        if size > BLOCK_SIZE:
+            f.seek(max(BLOCK_SIZE, size - BLOCK_SIZE))
+            digest.update(f.read(BLOCK_SIZE))
+    return digest.digest()
+
+
+def full_hash(path, size=None):
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def regroup(groups, key, pool):
+    """Splits every group of (path, size) by key(path, size) computed on the
+    pool, groups left with one file are dropped
+    """
+    items = [item for group in groups for item in group]
+    keys = pool.map(lambda item: safe_key(key, *item), items)
+    split = defaultdict(list)
+    for item, value in zip(items, keys):
+        if value is not None:
+            split[(item[1], value)].append(item)
+    return [group for group in split.values() if len(group) > 1]
+
+
+def safe_key(key, path, size):
+    try:
+        return key(path, size)
+    except OSError:
+        return None
+
+
+def find_duplicates(paths, workers=4):
+    """Finds files with the same content.
+
+    Files are grouped by size first, only files sharing a size get their
+    first and last blocks hashed, and only files sharing those are read
+    as a whole.
+
+    Returns:
+        list: groups of paths with the same content, sorted, each group
+        holds at least two files
+    """
+    by_size = defaultdict(list)
+    for path in paths:
+        try:
+            size = os.stat(path, follow_symlinks=False).st_size
+        except OSError:
+            continue
+        if size:
+            by_size[size].append((path, size))
+    groups = [group for group in by_size.values() if len(group) > 1]
+    with ThreadPoolExecutor(workers) as pool:
+        groups = regroup(groups, partial_hash, pool)
+        small = [group for group in groups if group[0][1] <= 2 * BLOCK_SIZE]
+        big = [group for group in groups if group[0][1] > 2 * BLOCK_SIZE]
+        groups = small + regroup(big, full_hash, pool)
+    return sorted(sorted(path for path, _ in group) for group in groups)
+
+
+def remove_duplicates(groups, mode="remove"):
+    """Keeps the first file of every group, the others are deleted or, in
+    "link" mode, replaced by hard links to it
+
+    Returns:
+        tuple: list of removed or linked paths, bytes saved, list of
+        (path, error) for files left as they were
+    """
+    done = []
+    saved = 0
+    failed = []
+    for keeper, *copies in groups:
+        for path in copies:
+            try:
+                if os.path.samefile(keeper, path):
+                    continue
+                size = os.path.getsize(path)
+                if mode == "link":
+                    tmp_path = f"{path}.{os.getpid()}.link"
+                    os.link(keeper, tmp_path)
+                    try:
+                        os.replace(tmp_path, path)
+                    except OSError:
+                        os.remove(tmp_path)
+                        raise
+                else:
+                    os.remove(path)
+            except OSError as error:
+                failed.append((path, error))
+                continue
+            done.append(path)
+            saved += size
+    return done, saved, failed
@@ -0,0 +1,179 @@
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 1024 * 1024
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".gz")
+
+
+class LimitError(Exception):
+    """The archive unpacks to more bytes or members than allowed"""
+
+
+def is_archive(name):
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def archive_folder(path):
+    """Folder the archive is unpacked to, its name without the suffixes"""
+    name = os.path.basename(path)
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    return os.path.join(os.path.dirname(path), name or "archive")
+
+
+def member_path(folder, name):
+    """Path of the member inside the folder, None for names like
+    /etc/passwd or ../x which would be written outside of it
+    """
+    parts = [
+        part for part in name.replace("\\", "/").split("/") if part not in ("", ".")
+    ]
+    if not parts or ".." in parts or os.path.isabs(name) or ":" in parts[0]:
+        return None
+    return os.path.join(folder, *parts)
+
+
+class Budget:
+    """Bytes and members an archive, with the nested ones, may unpack to"""
+
+    def __init__(self, max_size, max_members):
+        self.size = max_size
+        self.members = max_members
+        self.written = 0
+        self.count = 0
+
+    def add_member(self):
+        self.count += 1
+        if self.count > self.members:
+            raise LimitError(f"more than {self.members} members")
+
+    def copy(self, source, target_path):
+        """Writes the member to disk chunk by chunk"""
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        with open(target_path, "wb") as target:
+            while chunk := source.read(CHUNK_SIZE):
+                self.written += len(chunk)
+                if self.written > self.size:
+                    raise LimitError(f"more than {self.size} bytes")
+                target.write(chunk)
+
+
+def unpack_zip(path, folder, budget):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            budget.add_member()
+            target_path = member_path(folder, info.filename)
+            if target_path is None:
+                continue
+            if info.is_dir():
+                os.makedirs(target_path, exist_ok=True)
+                continue
+            with archive.open(info) as source:
+                budget.copy(source, target_path)
+
+
+def unpack_tar(path, folder, budget):
+    # Stream mode reads the archive once from start to end, so a compressed
+    # tar is never held in memory or seeked in
+    with tarfile.open(path, "r|*") as archive:
+        for info in archive:
+            budget.add_member()
+            target_path = member_path(folder, info.name)
+            if target_path is None:
+                continue
+            if info.isdir():
+                os.makedirs(target_path, exist_ok=True)
+            elif info.isfile():
+                budget.copy(archive.extractfile(info), target_path)
+            # Links and devices are skipped, they may point outside the folder
+
+
+def unpack(path, folder, budget):
+    if zipfile.is_zipfile(path):
+        unpack_zip(path, folder, budget)
+    else:
+        unpack_tar(path, folder, budget)
+
+
+def extract_archive(path, max_size, max_members, max_depth):
+    """Unpacks the archive next to it into a folder with its name and
+    removes it. Archives inside are unpacked the same way up to max_depth
+    levels. If anything fails, the folder is removed and the archive is kept
+
+    Returns:
+        dict: name, ok, error, members, bytes and time in ms
+    """
+    start = time.perf_counter()
+    budget = Budget(max_size, max_members)
+    folder = archive_folder(path)
+    result = {"name": os.path.basename(path), "ok": True, "error": ""}
+    if os.path.exists(folder):
+        result.update(ok=False, error=f"{folder} already exists")
+    else:
+        try:
+            unpack_nested(path, folder, budget, max_depth)
+            os.remove(path)
+        except (
+            OSError,
+            LimitError,
+            EOFError,
+            zipfile.BadZipFile,
+            tarfile.TarError,
+        ) as error:
+            result.update(ok=False, error=str(error) or type(error).__name__)
+            shutil.rmtree(folder, ignore_errors=True)
+    result.update(
+        members=budget.count,
+        bytes=budget.written,
+        ms=(time.perf_counter() - start) * 1000,
+    )
+    return result
+
+
+def unpack_nested(path, folder, budget, max_depth):
+    pending = [(path, folder, 1)]
+    while pending:
+        archive, target, depth = pending.pop()
+        try:
+            unpack(archive, target, budget)
+        except (EOFError, zipfile.BadZipFile, tarfile.TarError):
+            if archive == path:
+                raise
+            # A broken archive inside is kept as a file
+            shutil.rmtree(target, ignore_errors=True)
+            continue
+        if archive != path:
+            os.remove(archive)
+        if depth >= max_depth:
+            continue
+        for root, _, names in os.walk(target):
+            for name in names:
+                nested = os.path.join(root, name)
+                if is_archive(name) and not os.path.exists(archive_folder(nested)):
+                    pending.append((nested, archive_folder(nested), depth + 1))
+
+
+def extract_all(folder, workers=2, max_size=1 << 30, max_members=100_000, max_depth=2):
+    """Unpacks every archive in the folder, workers archives at a time in
+    separate processes
+
+    Returns:
+        list: results of extract_archive() in the order of names
+    """
+    paths = [
+        os.path.join(folder, name)
+        for name in sorted(os.listdir(folder))
+        if is_archive(name) and os.path.isfile(os.path.join(folder, name))
+    ]
+    limits = (max_size, max_members, max_depth)
+    if workers <= 1 or len(paths) <= 1:
+        return [extract_archive(path, *limits) for path in paths]
+    with ProcessPoolExecutor(min(workers, len(paths))) as pool:
+        futures = [pool.submit(extract_archive, path, *limits) for path in paths]
+        return [future.result() for future in futures]
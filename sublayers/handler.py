@@ -1,4 +1,14 @@
-import difflib
+from sublayers.indexes import CommandIndex
+from sublayers.writer import refresh_all, store_lock
+
+# Errors reported by the running command, batch mode marks it failed
+reported_errors = []
+
+
+def report_error(message):
+    """Prints an error of a command, the message keeps its colors"""
+    reported_errors.append(message)
+    print(message)
 
 
 class Handler:
@@ -6,20 +16,43 @@ class Handler:
     Run commands, check user typos.
     """
 
+    # Command names -> their CommandIndex. Built on the first typo and shared
+    # by all Handlers with the same commands, changed commands get a new one
+    suggestion_indexes = {}
+
     def __init__(self, commands):
         self.commands = commands
 
-    def get_command_suggestion(self, query):
-        return difflib.get_close_matches(query, self.commands.keys(), n=1, cutoff=0.6)
+    def suggestion_index(self):
+        """Returns the index of the current command names"""
+        names = tuple(self.commands)
+        index = self.suggestion_indexes.get(names)
+        if index is None:
+            index = self.suggestion_indexes[names] = CommandIndex(names)
+        return index
+
+    def get_command_suggestion(self, query, limit=1):
+        """Returns up to limit commands similar to the query, best first"""
+        return self.suggestion_index().suggest(query, limit)
+
+    def complete_command(self, prefix, limit=None):
+        return self.suggestion_index().complete(prefix, limit)
 
     def execute_command(self, query):
-        self.commands[query]()
+        command = self.commands[query]
+        # Stores lock themselves around changes and saves, a background write
+        # may run while the command waits for input
+        with store_lock:
+            refresh_all()
+        reported_errors.clear()
+        command()
 
     def run(self):
         self.execute_command("help")
         while True:
             query = input("> ")
             if query == "back":
+                self.execute_command("back")
                 break
             try:
                 self.execute_command(query)
@@ -0,0 +1,124 @@
+from datetime import datetime
+from difflib import SequenceMatcher
+
+from sublayers.shards import ShardStore
+
+# Middle parts of texts longer than this (old * new length) are replaced as
+# a whole instead of being compared, SequenceMatcher is quadratic there
+MAX_DIFF_WORK = 250_000
+
+
+def text_delta(old, new):
+    """Changes turning old text into new one
+
+    Returns:
+        list: (start, end, replacement) tuples, positions are in old text
+    """
+    limit = min(len(old), len(new))
+    head = 0
+    while head < limit and old[head] == new[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+    old_middle = old[head : len(old) - tail]
+    new_middle = new[head : len(new) - tail]
+    if not old_middle and not new_middle:
+        return []
+    if len(old_middle) * len(new_middle) > MAX_DIFF_WORK:
+        return [(head, len(old) - tail, new_middle)]
+    matcher = SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+    return [
+        (head + i1, head + i2, new_middle[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_delta(old, delta):
+    parts = []
+    position = 0
+    for start, end, replacement in delta:
+        parts.append(old[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(old[position:])
+    return "".join(parts)
+
+
+class History:
+    """Revisions of notes kept as text deltas against the previous revision.
+
+    Every keyframe_interval-th revision of a note is a keyframe with the full
+    text, so any revision is rebuilt from at most keyframe_interval deltas.
+    A state of the note is a (title, text, tags) tuple.
+    """
+
+    keyframe_interval = 10
+
+    def __init__(self, folder):
+        self.store = ShardStore(folder)
+        self.store.load_manifest()
+        self.store.remove_leftovers()
+
+    def revisions(self, key):
+        """Returns list of (number, time, title, tags) of the note revisions"""
+        return [
+            (number, revision[0], revision[2], revision[4])
+            for number, revision in enumerate(self.store.get(key, []))
+        ]
+
+    def version(self, key, number):
+        """Rebuilds state of the note at the revision
+
+        Returns:
+            tuple: (title, text, tags) or None if there is no such revision
+        """
+        revisions = self.store.get(key, [])
+        if not 0 <= number < len(revisions):
+            return None
+        start = number - number % self.keyframe_interval
+        _, _, title, text, tags = revisions[start]
+        for _, _, title, delta, tags in revisions[start + 1 : number + 1]:
+            text = apply_delta(text, delta)
+        return title, text, tags
+
+    def append(self, key, state):
+        """Adds the state as a new revision if it differs from the last one
+
+        Returns:
+            bool: True if a revision was added
+        """
+        revisions = list(self.store.get(key, []))
+        last = self.version(key, len(revisions) - 1) if revisions else None
+        if state == last:
+            return False
+        title, text, tags = state
+        if len(revisions) % self.keyframe_interval == 0:
+            revision = (datetime.now(), "full", title, text, tags)
+        else:
+            revision = (datetime.now(), "delta", title, text_delta(last[1], text), tags)
+        revisions.append(revision)
+        self.store.put(key, revisions)
+        return True
+
+    def rename(self, old_key, new_key):
+        revisions = self.store.get(old_key)
+        if revisions is None:
+            return
+        self.store.delete(old_key)
+        self.store.put(new_key, revisions)
+
+    def delete(self, key):
+        self.store.delete(key)
+
+    def clear(self):
+        self.store.clear()
+
+    def refresh(self):
+        """Forgets shards other processes have replaced"""
+        if not self.store.dirty and self.store.changes() is None:
+            self.store.load_manifest()
+
+    def save(self):
+        self.store.save()
@@ -0,0 +1,571 @@
+import bisect
+import calendar
+import gc
+import heapq
+import math
+import re
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from sublayers.validation import parse_date
+
+
+@contextmanager
+def paused_gc():
+    """Turns the garbage collector off while indexes are built.
+
+    Indexes are millions of small sets, dicts and lists, and the collector
+    would scan them again and again while they grow.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def phone_digits(phone):
+    """Leaves only digits of the phone, so '+38 (099)' and '38099' match"""
+    return re.sub(r"\D", "", phone)
+
+
+class TrieNode:
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children = {}
+        # Most nodes are in the middle of words, their set is made on demand
+        self.keys = None
+
+
+class PrefixIndex:
+    """Trie from words to the keys of Records that contain them.
+
+    Lookup walks the prefix and then collects the subtree under it, so it does
+    not depend on the size of the whole book.
+    """
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.words_by_key = {}
+
+    def __len__(self):
+        return len(self.words_by_key)
+
+    def add(self, word, key):
+        node = self.root
+        for char in word:
+            node = node.children.setdefault(char, TrieNode())
+        if node.keys is None:
+            node.keys = set()
+        node.keys.add(key)
+        self.words_by_key.setdefault(key, []).append(word)
+
+    def remove(self, key):
+        """Removes all words of the key from the trie"""
+        for word in self.words_by_key.pop(key, []):
+            path = [self.root]
+            for char in word:
+                node = path[-1].children.get(char)
+                if node is None:
+                    break
+                path.append(node)
+            else:
+                if path[-1].keys:
+                    path[-1].keys.discard(key)
+                # Drop the branch if nothing else lives under it
+                for i in range(len(word), 0, -1):
+                    if path[i].keys or path[i].children:
+                        break
+                    del path[i - 1].children[word[i - 1]]
+
+    def find(self, prefix):
+        """Finds keys with any word starting with prefix
+
+        Returns:
+            set: keys of matched Records
+        """
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        found = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.keys:
+                found.update(node.keys)
+            stack.extend(node.children.values())
+        return found
+
+    def clear(self):
+        self.root = TrieNode()
+        self.words_by_key = {}
+
+
+def trigrams(text):
+    """Set of 3-letter parts of the lowercased text, padded with spaces
+    so the beginning of words weighs more
+    """
+    padded = f"  {text.lower()} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Inverted index from trigrams to keys for typo tolerant search.
+
+    Score of a key is the number of query trigrams found in its texts. A key
+    with at least cutoff share of the query trigrams must have one of the
+    rarest ones, so only their postings are read to collect candidates.
+    """
+
+    def __init__(self):
+        self.keys_by_gram = {}
+        self.grams_by_key = {}
+
+    def __len__(self):
+        return len(self.grams_by_key)
+
+    def add(self, text, key):
+        """Adds text of the key, a key can have several texts"""
+        known = self.grams_by_key.setdefault(key, set())
+        grams = trigrams(text) - known
+        known.update(grams)
+        index = self.keys_by_gram
+        for gram in grams:
+            keys = index.get(gram)
+            if keys is None:
+                index[gram] = {key}
+            else:
+                keys.add(key)
+
+    def remove(self, key):
+        for gram in self.grams_by_key.pop(key, ()):
+            keys = self.keys_by_gram[gram]
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_gram[gram]
+
+    def find(self, query, limit=5, cutoff=0.5):
+        """Finds keys with texts similar to the query
+
+        Returns:
+            list: up to limit keys, the best match first
+        """
+        grams = sorted(
+            trigrams(query), key=lambda gram: len(self.keys_by_gram.get(gram, ()))
+        )
+        need = max(math.ceil(cutoff * len(grams)), 1)
+        rare = len(grams) - need + 1
+        hits = Counter()
+        for gram in grams[:rare]:
+            hits.update(self.keys_by_gram.get(gram, ()))
+        for gram in grams[rare:]:
+            hits.update(hits.keys() & self.keys_by_gram.get(gram, set()))
+        best = heapq.nsmallest(
+            limit, ((-count, key) for key, count in hits.items() if count >= need)
+        )
+        return [key for _, key in best]
+
+    def clear(self):
+        self.keys_by_gram = {}
+        self.grams_by_key = {}
+
+
+def edit_distance(a, b, limit=None):
+    """Number of inserted, deleted or replaced chars and swapped neighbour
+    chars turning a into b, "hlep" is one swap from "help".
+    With a limit, returns limit + 1 as soon as the distance is known to be
+    bigger than the limit
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            distance = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            )
+            if before and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if limit is not None and min(current) > limit:
+            if before is None or min(previous) > limit:
+                return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def qgrams(text):
+    """Set of 2-letter parts of the text with its start and end marked"""
+    padded = f"\x00{text}\x01"
+    return {padded[i : i + 2] for i in range(len(padded) - 1)}
+
+
+class CommandIndex:
+    """Suggestions for mistyped commands.
+
+    One typo changes at most three 2-grams of a word (a swap of neighbour
+    chars does), so a command within k typos of the query shares at least
+    len(qgrams(query)) - 3 * k of them. Only commands passing that count
+    are compared with the query char by char. Commands starting with the
+    query come from a trie.
+    """
+
+    # Shorter queries are a typo away from too many commands
+    min_length = 2
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.postings = {}
+        for number, name in enumerate(self.names):
+            for gram in qgrams(name):
+                self.postings.setdefault(gram, []).append(number)
+        self.prefixes = PrefixIndex()
+        for name in self.names:
+            self.prefixes.add(name, name)
+
+    def complete(self, prefix, limit=None):
+        """Returns commands starting with prefix in alphabetical order"""
+        return sorted(self.prefixes.find(prefix))[:limit]
+
+    def similar(self, query, max_distance, limit=None):
+        """Returns up to limit (distance, command) pairs not further than
+        max_distance, the nearest first
+        """
+        grams = qgrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        # Commands sharing more 2-grams are closer as a rule, once limit
+        # matches are found the rest must beat the worst of them
+        found = []
+        for number, count in shared.most_common():
+            if count < len(grams) - 3 * max_distance:
+                break
+            name = self.names[number]
+            distance = edit_distance(query, name, max_distance)
+            if distance > max_distance:
+                continue
+            found.append((distance, name))
+            if limit and len(found) >= limit:
+                found = heapq.nsmallest(limit, found)
+                max_distance = found[-1][0]
+        if len(grams) <= 3 * max_distance:
+            # Short query, commands sharing no 2-grams with it may still match
+            for name in self.names:
+                if all(name != known for _, known in found):
+                    distance = edit_distance(query, name, max_distance)
+                    if distance <= max_distance:
+                        found.append((distance, name))
+        return sorted(found)[:limit]
+
+    def suggest(self, query, limit=1):
+        """Returns up to limit commands the query may be meant as, best first"""
+        if len(query) < self.min_length:
+            return []
+        max_distance = max(1, len(query) // 2)
+        found = [name for _, name in self.similar(query, max_distance, limit)]
+        if len(found) < limit:
+            found += [name for name in self.complete(query) if name not in found]
+        return found[:limit]
+
+
+def leap_day_of_year(day, month):
+    """Day number in a leap year, so 29.02 always has its own place"""
+    return date(2000, month, day).timetuple().tm_yday
+
+
+def celebration_day(day, year):
+    """Maps a date of the year to leap_day_of_year.
+    In a common year 29.02 birthdays are celebrated on 01.03
+    """
+    doy = leap_day_of_year(day.day, day.month)
+    if not calendar.isleap(year) and (day.month, day.day) == (3, 1):
+        doy -= 1
+    return doy
+
+
+def birthday_ranges(days, today=None):
+    """Splits the next days from today into ranges of leap_day_of_year
+
+    Returns:
+        list: one (start, end) range, or two when it goes over the New Year
+    """
+    today = today or date.today()
+    if days <= 0:
+        return []
+    last = today + timedelta(days=days)
+    start = celebration_day(today, today.year)
+    if days >= 366:
+        end = start
+    elif last.year == today.year:
+        return [(start, celebration_day(last, last.year))]
+    else:
+        end = min(celebration_day(last, last.year), start)
+    return [(start, 367), (1, end)]
+
+
+class BirthdayIndex:
+    """Sorted list of (day of year, key) for birthday range queries.
+
+    Birthdays are parsed once when a Record is indexed, a query takes one or
+    two bisect slices of the list.
+    """
+
+    def __init__(self):
+        self.days = []
+        self.day_by_key = {}
+
+    def __len__(self):
+        return len(self.days)
+
+    @staticmethod
+    def day_of(birthday):
+        born = parse_date(birthday)
+        return leap_day_of_year(born.day, born.month) if born else None
+
+    def add(self, birthday, key):
+        """Adds birthday in 'day.month.year' format, invalid dates are skipped"""
+        self.remove(key)
+        doy = self.day_of(birthday)
+        if doy is None:
+            return
+        self.day_by_key[key] = doy
+        bisect.insort(self.days, (doy, key))
+
+    def build(self, birthdays):
+        """Fills the index from (birthday, key) pairs with one sort"""
+        self.clear()
+        for birthday, key in birthdays:
+            doy = self.day_of(birthday)
+            if doy is not None:
+                self.day_by_key[key] = doy
+        self.days = sorted((doy, key) for key, doy in self.day_by_key.items())
+
+    def remove(self, key):
+        doy = self.day_by_key.pop(key, None)
+        if doy is None:
+            return
+        i = bisect.bisect_left(self.days, (doy, key))
+        if i < len(self.days) and self.days[i] == (doy, key):
+            del self.days[i]
+
+    def _slice(self, start, end):
+        """Keys with day of year in [start, end)"""
+        lo = bisect.bisect_left(self.days, (start,))
+        hi = bisect.bisect_left(self.days, (end,))
+        return [key for _, key in self.days[lo:hi]]
+
+    def upcoming(self, days, today=None):
+        """Finds birthdays from today till today + days (not including)
+
+        Returns:
+            list: keys ordered by the next birthday date
+        """
+        found = []
+        for start, end in birthday_ranges(days, today):
+            found.extend(self._slice(start, end))
+        return found
+
+    def clear(self):
+        self.days = []
+        self.day_by_key = {}
+
+
+def fuzzy_texts(key, record):
+    """Texts of the Record used by fuzzy search"""
+    texts = [key]
+    for field in ("email", "home_address"):
+        value = getattr(record, field, None)
+        if value:
+            texts.append(value.value)
+    return texts
+
+
+def contact_terms(key, record):
+    """Values of the Record the indexes are built from
+
+    Returns:
+        tuple: phone digits, birthday or None, texts for fuzzy search
+    """
+    phones = tuple(phone_digits(phone.value) for phone in getattr(record, "phones", []))
+    birthday = getattr(record, "birthday", None)
+    return (
+        phones,
+        birthday.value if birthday else None,
+        tuple(fuzzy_texts(key, record)),
+    )
+
+
+class ContactIndexes:
+    """All in-memory indexes of the AddressBook"""
+
+    def __init__(self):
+        self.names = PrefixIndex()
+        self.phones = PrefixIndex()
+        self.birthdays = BirthdayIndex()
+        self.texts = TrigramIndex()
+
+    def add(self, key, record):
+        self.add_terms(key, contact_terms(key, record))
+
+    def add_terms(self, key, terms, with_birthday=True):
+        """Indexes the Record by its contact_terms()"""
+        phones, birthday, texts = terms
+        self.remove(key)
+        self.names.add(key, key)
+        for text in texts:
+            self.texts.add(text, key)
+        for digits in phones:
+            self.phones.add(digits, key)
+        if birthday and with_birthday:
+            self.birthdays.add(birthday, key)
+
+    def build(self, data):
+        """Fills all indexes from the mapping of Records"""
+        self.build_terms(
+            (key, contact_terms(key, record)) for key, record in data.items()
+        )
+
+    def build_terms(self, items):
+        """Fills all indexes from (key, contact_terms()) pairs"""
+        self.clear()
+        birthdays = []
+        for key, terms in items:
+            self.add_terms(key, terms, with_birthday=False)
+            if terms[1]:
+                birthdays.append((terms[1], key))
+        self.birthdays.build(birthdays)
+
+    def remove(self, key):
+        self.names.remove(key)
+        self.phones.remove(key)
+        self.birthdays.remove(key)
+        self.texts.remove(key)
+
+    def clear(self):
+        self.names.clear()
+        self.phones.clear()
+        self.birthdays.clear()
+        self.texts.clear()
+
+    def find_by_name(self, prefix):
+        return self.names.find(prefix)
+
+    def find_by_phone(self, digits):
+        return self.phones.find(digits)
+
+    def upcoming_birthdays(self, days):
+        return self.birthdays.upcoming(days)
+
+    def fuzzy_find(self, query, limit):
+        return self.texts.find(query, limit)
+
+
+class LazyIndexes:
+    """ContactIndexes which are built from data on the first query.
+    Used by storages that do not read all Records at start. A storage which
+    keeps contact_terms() apart from Records gives terms, a function
+    yielding (key, terms) pairs, so no Record is decoded for the build
+    """
+
+    def __init__(self, data, terms=None):
+        self.data = data
+        self.terms = terms
+        self.indexes = None
+
+    def built(self):
+        if self.indexes is None:
+            indexes = ContactIndexes()
+            with paused_gc():
+                if self.terms is None:
+                    indexes.build(self.data)
+                else:
+                    indexes.build_terms(self.terms())
+            self.indexes = indexes
+        return self.indexes
+
+    def add(self, key, record):
+        if self.indexes is not None:
+            self.indexes.add(key, record)
+
+    def remove(self, key):
+        if self.indexes is not None:
+            self.indexes.remove(key)
+
+    def clear(self):
+        if self.indexes is not None:
+            self.indexes.clear()
+
+    def find_by_name(self, prefix):
+        return self.built().find_by_name(prefix)
+
+    def find_by_phone(self, digits):
+        return self.built().find_by_phone(digits)
+
+    def upcoming_birthdays(self, days):
+        return self.built().upcoming_birthdays(days)
+
+    def fuzzy_find(self, query, limit):
+        return self.built().fuzzy_find(query, limit)
+
+
+class NoteIndexes:
+    """Indexes of the Notebook: title and tag tries from words to note titles
+    and buckets of titles by the number of tags
+    """
+
+    def __init__(self):
+        self.titles = PrefixIndex()
+        self.tags = PrefixIndex()
+        self.buckets = {}
+        self.count_by_title = {}
+
+    def add(self, title, record):
+        self.remove(title)
+        self.titles.add(title, title)
+        tags = {tag.value for tag in getattr(record, "tags", [])}
+        for tag in tags:
+            self.tags.add(tag, title)
+        count = len(getattr(record, "tags", []))
+        self.count_by_title[title] = count
+        # dict keeps titles in the order they were added
+        self.buckets.setdefault(count, {})[title] = None
+
+    def remove(self, title):
+        self.titles.remove(title)
+        self.tags.remove(title)
+        count = self.count_by_title.pop(title, None)
+        if count is not None:
+            bucket = self.buckets[count]
+            del bucket[title]
+            if not bucket:
+                del self.buckets[count]
+
+    def clear(self):
+        self.titles.clear()
+        self.tags.clear()
+        self.buckets = {}
+        self.count_by_title = {}
+
+    def find_by_title(self, prefix):
+        return self.titles.find(prefix)
+
+    def find_by_tag(self, prefix):
+        return self.tags.find(prefix)
+
+    def by_tag_count(self):
+        """Yields titles from notes with most tags to notes without tags"""
+        for count in sorted(self.buckets, reverse=True):
+            yield from self.buckets[count]
@@ -0,0 +1,235 @@
+import os
+import pickle
+import threading
+
+from sublayers.locks import FileLock
+
+
+def file_id(file_name):
+    """Inode and modification time of the file, None if there is no file"""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class Journal:
+    """Append-only log of changes over a pickled snapshot.
+
+    Every entry is a full state of one key, so replaying the log over any
+    older snapshot always gives the latest data. When the log grows over
+    compact_threshold bytes, a new snapshot is written in a background thread
+    and the replayed part of the log is cut off.
+
+    Several processes may share the files. Writes hold an exclusive file
+    lock, and offset remembers how much of the log this process has read,
+    so entries written by others are read with changes() without loading
+    everything again.
+    """
+
+    compact_threshold = 1024 * 1024
+
+    def __init__(self, snapshot_file, log_file=None):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file or os.path.splitext(snapshot_file)[0] + ".log"
+        self.file_lock = FileLock(os.path.splitext(snapshot_file)[0] + ".lock")
+        self.offset = 0
+        self.version = None
+        self._lock = threading.Lock()
+        self._compactor = None
+
+    def exists(self):
+        return os.path.exists(self.snapshot_file) or os.path.exists(self.log_file)
+
+    def load(self):
+        """Reads the snapshot and replays the log over it
+
+        Returns:
+            dict: restored data, empty if there are no files yet
+        """
+        data = {}
+        with self.file_lock.hold(shared=True):
+            try:
+                with open(self.snapshot_file, "rb") as f:
+                    data = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+            for entry in self.entries():
+                self.apply(data, entry)
+            self.version = self.files_version()
+        return data
+
+    def changes(self):
+        """Reads entries written by other processes since the last read
+
+        Returns:
+            list: new entries, or None if the files were rewritten by
+            a compaction and everything must be loaded again
+        """
+        with self.file_lock.hold(shared=True):
+            if self.files_version() != self.version:
+                return None
+            if self.log_size() <= self.offset:
+                return []
+            return list(self.entries(self.offset))
+
+    def files_version(self):
+        """Changes when the snapshot is replaced or the log is rewritten"""
+        log_id = file_id(self.log_file)
+        return file_id(self.snapshot_file), log_id and log_id[0]
+
+    def entries(self, start=0):
+        """Yields log entries after start byte, a torn last entry after
+        a crash is skipped. offset is moved past every read entry
+        """
+        self.offset = start
+        try:
+            f = open(self.log_file, "rb")
+        except OSError:
+            return
+        with f:
+            f.seek(start)
+            while True:
+                try:
+                    entry = pickle.load(f)
+                except Exception:
+                    # A torn entry fails with EOFError, but with entries
+                    # appended after it by older versions anything may fail
+                    return
+                self.offset = f.tell()
+                yield entry
+
+    def readable_end(self, start):
+        """Position after the last entry which can be read from start"""
+        end = start
+        try:
+            f = open(self.log_file, "rb")
+        except OSError:
+            return end
+        with f:
+            f.seek(start)
+            while True:
+                try:
+                    pickle.load(f)
+                except Exception:
+                    return end
+                end = f.tell()
+
+    @staticmethod
+    def apply(data, entry):
+        op, key, value = entry
+        if op == "set":
+            data[key] = value
+        elif op == "del":
+            data.pop(key, None)
+        elif op == "clear":
+            data.clear()
+
+    def append(self, entries):
+        """Writes entries to the end of the log
+
+        Args:
+            entries: list of (op, key, value) tuples
+        """
+        if not entries:
+            return
+        chunk = b"".join(pickle.dumps(entry) for entry in entries)
+        with self.file_lock.hold(), self._lock:
+            # Entries of other processes before ours are left for changes()
+            current = self.files_version() == self.version
+            size = self.log_size()
+            read_all = current and size == self.offset
+            if current and size > self.offset:
+                end = self.readable_end(self.offset)
+                if end < size:
+                    # Entries written after an entry torn by a crash could
+                    # never be read
+                    os.truncate(self.log_file, end)
+                    read_all = end == self.offset
+            with open(self.log_file, "ab") as f:
+                f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            if read_all:
+                self.offset = self.log_size()
+                self.version = self.files_version()
+
+    def log_size(self):
+        try:
+            return os.path.getsize(self.log_file)
+        except OSError:
+            return 0
+
+    def need_compaction(self):
+        return self.log_size() > self.compact_threshold
+
+    def write_snapshot(self, data):
+        """Rewrites the snapshot and empties the log"""
+        self.wait()
+        with self.file_lock.hold(), self._lock:
+            # Keep the whole log if another process has rewritten it
+            if self.files_version() != self.version:
+                self.offset = 0
+            self._dump(data.copy())
+            self._cut_log(self.offset)
+
+    def compact(self, data, background=True):
+        """Writes a new snapshot and removes the part of the log it covers
+
+        Args:
+            data: current data, copied with its copy() method before the
+                snapshot is written
+            background: run the work in a daemon thread
+        """
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        with self._lock:
+            snapshot = data.copy()
+            cut = self.offset
+            version = self.version
+        if background:
+            self._compactor = threading.Thread(
+                target=self._compact, args=(snapshot, cut, version), daemon=True
+            )
+            self._compactor.start()
+        else:
+            self._compact(snapshot, cut, version)
+
+    def wait(self):
+        """Blocks until a running compaction is finished"""
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+
+    def _compact(self, snapshot, cut, version):
+        with self.file_lock.hold(), self._lock:
+            # Another process compacted the files after the snapshot was taken
+            if self.files_version() != version:
+                return
+            self._dump(snapshot)
+            self._cut_log(cut)
+
+    def _dump(self, data):
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+    def _cut_log(self, cut):
+        """Keeps only entries written after the first cut bytes of the log"""
+        try:
+            with open(self.log_file, "rb") as f:
+                f.seek(cut)
+                tail = f.read()
+        except OSError:
+            self.version = self.files_version()
+            return
+        tmp_file = self.log_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(tail)
+        os.replace(tmp_file, self.log_file)
+        self.offset -= cut
+        self.version = self.files_version()
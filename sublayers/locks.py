@@ -0,0 +1,50 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows, only one process may use the files there
+    fcntl = None
+
+
+class FileLock:
+    """Advisory lock shared by all processes using the same files.
+
+    Nested holds in one process are counted, only the outer one locks the
+    file. A shared hold inside an exclusive one keeps the exclusive lock.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = None
+        self._depth = 0
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def hold(self, shared=False):
+        with self._lock:
+            if self._depth == 0:
+                self._acquire(shared)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._release()
+
+    def _acquire(self, shared):
+        if fcntl is None:
+            return
+        folder = os.path.dirname(self.file_name)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._file = open(self.file_name, "a")
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    def _release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
@@ -0,0 +1,112 @@
+import os
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MoveExecutor:
+    """Moves files into category folders.
+
+    A move within one filesystem is a single os.rename done right away.
+    Moves to another filesystem copy the data, they are collected per
+    destination folder and run in batches on a pool of workers threads.
+    finish() waits for all of them.
+    """
+
+    batch_size = 64
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.pool = None
+        self.devices = {}
+        self.batches = {}
+        self.futures = []
+        self.moved = Counter()
+        self.renamed = 0
+        self.copied = 0
+        self.failed = []
+        # targets of finished moves, see take_completed()
+        self.completed = []
+        self._lock = threading.Lock()
+
+    def move(self, source, folder, name, category):
+        """Moves source to folder/name, category is counted in moved
+
+        Args:
+            source: path of the file
+            folder: destination folder, must exist
+            name: new name of the file
+            category: name for the summary, e.g. "images"
+        """
+        target = os.path.join(folder, name)
+        if os.path.abspath(source) == os.path.abspath(target):
+            return
+        if self.device(os.path.dirname(source) or ".") == self.device(folder):
+            try:
+                os.rename(source, target)
+            except OSError:
+                # Taken name on Windows, busy file and so on, shutil knows more
+                pass
+            else:
+                with self._lock:
+                    self.renamed += 1
+                    self.moved[category] += 1
+                    self.completed.append(target)
+                return
+        batch = self.batches.setdefault(folder, [])
+        batch.append((source, target, category))
+        if len(batch) >= self.batch_size:
+            self._submit(self.batches.pop(folder))
+
+    def take_completed(self):
+        """Returns targets of moves finished since the last call"""
+        with self._lock:
+            completed, self.completed = self.completed, []
+        return completed
+
+    def device(self, folder):
+        """Returns id of the filesystem of the folder, cached per folder"""
+        device = self.devices.get(folder)
+        if device is None:
+            try:
+                device = os.stat(folder).st_dev
+            except OSError:
+                device = -1
+            self.devices[folder] = device
+        return device
+
+    def finish(self):
+        """Runs moves left in batches and waits for all of them
+
+        Returns:
+            Counter: number of moved files per category
+        """
+        for batch in self.batches.values():
+            self._submit(batch)
+        self.batches = {}
+        for future in self.futures:
+            future.result()
+        self.futures = []
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        return self.moved
+
+    def _submit(self, batch):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.workers)
+        self.futures.append(self.pool.submit(self._copy, batch))
+
+    def _copy(self, batch):
+        for source, target, category in batch:
+            try:
+                shutil.move(source, target)
+            except OSError as error:
+                with self._lock:
+                    self.failed.append((source, error))
+                continue
+            with self._lock:
+                self.copied += 1
+                self.moved[category] += 1
+                self.completed.append(target)
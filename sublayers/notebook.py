@@ -1,9 +1,19 @@
+import os
 import pickle
+import shutil
 from collections import UserDict
 from colorama import Fore, Style, init
 from prettytable import PrettyTable
 
 from sublayers.addressbook import TableOutput, HelpOutput
+from sublayers.blobs import BlobStore
+from sublayers.handler import report_error
+from sublayers.history import History
+from sublayers.indexes import NoteIndexes, paused_gc
+from sublayers.registry import LazyStore
+from sublayers.search import SearchIndex
+from sublayers.shards import ShardStore, shard_of
+from sublayers.writer import BackgroundWriter, DeferredWriter, locked, register_store
 
 init(autoreset=True)
 
@@ -19,28 +29,318 @@ class Notebook(UserDict):
         return cls._instance
 
     file_name = "Notebook.bin"
+    shards_folder = "Notebook.d"
+    texts_prefix = "Notebook.texts"
+    history_folder = "Notebook.history"
+    search_folder = "Notebook.index.d"
+    # Search indexes of older versions, removed on load
+    old_search_files = (
+        "Notebook.search",
+        "Notebook.search.d",
+        "Notebook.search.d.lock",
+    )
+    compact_threshold = 64 * 1024
+    # Write changes in a background thread, a burst of changes within
+    # save_debounce seconds is written once
+    background_save = False
+    save_debounce = 0.5
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.store = ShardStore(self.shards_folder)
+        self.blobs = BlobStore(self.texts_prefix)
+        LazyText.blobs = self.blobs
+        self.history = History(self.history_folder)
+        self.text_sizes = {}
+        self.live_size = 0
+        self.indexes = NoteIndexes()
+        self.search_index = SearchIndex(self.search_folder)
+        self.writer = None
+        if self.background_save:
+            self.writer = BackgroundWriter(self.write_notes, self.save_debounce)
         self.load_notes()
+        register_store(self)
 
     def show_all_records(self):
         return self.data
 
+    @locked
     def add_record(self, record):
         self.data[record.title.value] = record
+        self.index_record(record.title.value, record)
+        self.store_text(record.title.value, record)
+        self.store.put(record.title.value, record)
+        self.keep_revision(record)
+
+    @locked
+    def update_record(self, record):
+        """Updates indexes and marks the note changed after it is edited in place"""
+        self.index_record(record.title.value, record)
+        self.store_text(record.title.value, record)
+        self.store.put(record.title.value, record)
+        self.keep_revision(record)
+
+    @locked
+    def rename_record(self, old_title, new_title):
+        record = self.data.pop(old_title)
+        self.data[new_title] = record
+        self.store.delete(old_title)
+        self.store.put(new_title, record)
+        if old_title in self.text_sizes:
+            self.text_sizes[new_title] = self.text_sizes.pop(old_title)
+        self.unindex_record(old_title)
+        self.index_record(new_title, record)
+        self.history.rename(old_title, new_title)
+        self.keep_revision(record)
+
+    @locked
+    def remove_record(self, title):
+        record = self.data.pop(title)
+        self.store.delete(title)
+        self.unindex_record(title)
+        self.live_size -= self.text_sizes.pop(title, 0)
+        self.history.delete(title)
+        return record
+
+    @locked
+    def clear_records(self):
+        self.data.clear()
+        self.store.clear()
+        self.text_sizes.clear()
+        self.live_size = 0
+        self.history.clear()
+        self.indexes.clear()
+        self.search_index.clear()
+
+    def store_text(self, title, record):
+        """Moves a new or changed text of the note into the compressed blobs"""
+        text = getattr(record, "text", None)
+        if text is None or isinstance(text, LazyText):
+            return
+        record.text = LazyText(self.blobs.put(text.value))
+        self.live_size += record.text.ref[2] - self.text_sizes.get(title, 0)
+        self.text_sizes[title] = record.text.ref[2]
+
+    def keep_revision(self, record):
+        """Adds the current state of the note to its history. A note whose
+        title is changed but not renamed yet is skipped, rename_record
+        keeps it under the new title"""
+        title = record.title.value
+        if self.data.get(title) is not record:
+            return
+        text = getattr(record, "text", None)
+        tags = tuple(tag.value for tag in record.tags)
+        self.history.append(title, (title, text.value if text else "", tags))
+
+    def revisions(self, title):
+        return self.history.revisions(title)
+
+    @locked
+    def restore_revision(self, title, number):
+        """Brings the note back to the revision, the restore is a new revision
+
+        Returns:
+            Record: restored note or None if there is no such revision
+        """
+        state = self.history.version(title, number)
+        if state is None:
+            return None
+        old_title, text, tags = state
+        record = self.data[title]
+        record.text = Text(text)
+        record.tags = [Tag(tag) for tag in tags]
+        if old_title != title and old_title not in self.data:
+            record.title = Title(old_title)
+            # The text size moves with the note before the new text is stored
+            self.rename_record(title, old_title)
+        self.update_record(record)
+        return record
+
+    def index_record(self, title, record):
+        self.indexes.add(title, record)
+        text = getattr(record, "text", None)
+        self.search_index.add(title, text.value if text else "")
+
+    def unindex_record(self, title):
+        self.indexes.remove(title)
+        self.search_index.remove(title)
+
+    def search(self, query, limit=10):
+        """Full text search over titles and texts, returns (title, score) pairs"""
+        return self.search_index.search(query, limit)
+
+    def find_by_title(self, prefix):
+        return self.indexes.find_by_title(prefix)
+
+    def find_by_tag(self, prefix):
+        return self.indexes.find_by_tag(prefix)
+
+    def by_tag_count(self):
+        """Yields notes from the one with most tags to notes without tags"""
+        for title in self.indexes.by_tag_count():
+            yield self.data[title]
 
     def save_notes(self):
-        with open(self.file_name, "wb") as file:
-            pickle.dump(self.data, file)
+        if self.writer is None:
+            self.write_notes()
+        else:
+            self.writer.request()
         print(Style.BRIGHT + Fore.YELLOW + f"Your notes are saved!")
 
+    def flush(self):
+        """Writes changes waiting for the background writer"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def defer_saves(self):
+        """Keeps changes until flush() is called, used by batch mode"""
+        self.flush()
+        self.writer = DeferredWriter(self.write_notes)
+
+    @locked
+    def write_notes(self):
+        """Writes only shards with changed notes"""
+        self.blobs.flush()
+        self.history.save()
+        size = self.blobs.size()
+        compact = size > self.compact_threshold and size > 2 * self.live_size
+        if compact:
+            self.compact_texts()
+        self.apply_changes(self.store.save())
+        if compact:
+            self.blobs.remove_unused({self.blobs.generation})
+        self.search_index.save(self.store.files)
+
+    @locked
+    def refresh(self):
+        """Applies notes changed by other processes since the last load.
+        Waits while this process has unsaved changes"""
+        if self.store.dirty:
+            return
+        self.history.refresh()
+        changes = self.store.changes()
+        if changes is None:
+            self.reload_notes()
+        else:
+            self.apply_changes(changes)
+
+    def apply_changes(self, changes):
+        """Puts notes changed by other processes into data and indexes
+
+        Args:
+            changes: dict of titles to new Records, None for removed notes
+        """
+        for title, record in changes.items():
+            if title in self.data:
+                self.data.pop(title)
+                self.unindex_record(title)
+                self.live_size -= self.text_sizes.pop(title, 0)
+            if record is None:
+                continue
+            self.data[title] = record
+            self.index_record(title, record)
+            text = getattr(record, "text", None)
+            if isinstance(text, LazyText):
+                self.text_sizes[title] = text.ref[2]
+                self.live_size += text.ref[2]
+                if text.ref[0] > self.blobs.generation:
+                    self.blobs.open(text.ref[0])
+
+    def reload_notes(self):
+        self.data = {}
+        self.indexes = NoteIndexes()
+        self.search_index = SearchIndex(self.search_folder)
+        self.text_sizes = {}
+        self.live_size = 0
+        self.load_notes()
+
     def load_notes(self):
+        if not self.store.exists():
+            self.migrate()
+        self.data = self.store.load()
+        self.store.remove_leftovers()
+        if not self.data:
+            return
+        self.indexes.clear()
+        for title, record in self.data.items():
+            self.indexes.add(title, record)
+        self.load_texts()
+        self.load_search()
+
+    def load_search(self):
+        """Reads the manifest of the search index, notes of shards changed
+        since the index was saved are indexed again"""
+        for name in self.old_search_files:
+            if os.path.isdir(name):
+                shutil.rmtree(name)
+            elif os.path.exists(name):
+                os.remove(name)
+        stale = self.search_index.load(self.store.files)
+        self.search_index.remove_leftovers()
+        if not stale:
+            return
+        count = self.store.shard_count
+        with paused_gc():
+            for title in self.search_index.titles():
+                if shard_of(title, count) in stale:
+                    self.search_index.remove(title)
+            for title, record in self.data.items():
+                if shard_of(title, count) in stale:
+                    text = getattr(record, "text", None)
+                    self.search_index.add(title, text.value if text else "")
+        self.search_index.save(self.store.files)
+
+    def load_texts(self):
+        """Points the blob store to the files referenced by loaded notes,
+        old notes with texts kept inline are moved into the blobs"""
+        used = set()
+        inline = []
+        for title, record in self.data.items():
+            text = getattr(record, "text", None)
+            if isinstance(text, LazyText):
+                used.add(text.ref[0])
+                self.text_sizes[title] = text.ref[2]
+                self.live_size += text.ref[2]
+            elif text is not None:
+                inline.append((title, record))
+        self.blobs.generation = max(used | set(self.blobs.generations()), default=0)
+        self.blobs.remove_unused(used)
+        if inline:
+            for title, record in inline:
+                self.store_text(title, record)
+                self.store.put(title, record)
+            self.blobs.flush()
+            self.store.save()
+
+    def compact_texts(self):
+        """Rewrites blobs without garbage left by changed and removed texts"""
+        refs = [
+            record.text.ref
+            for record in self.data.values()
+            if isinstance(getattr(record, "text", None), LazyText)
+        ]
+        moved = self.blobs.compact(refs)
+        for title, record in self.data.items():
+            if isinstance(getattr(record, "text", None), LazyText):
+                record.text.ref = moved[record.text.ref]
+                self.store.put(title, record)
+
+    def migrate(self):
+        """Moves notes from the old single Notebook.bin file into shards
+
+        Returns:
+            bool: True if there were notes to move
+        """
         try:
             with open(self.file_name, "rb") as file:
-                self.data = pickle.load(file)
-        except:
-            return
+                notes = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        for title, record in notes.items():
+            self.store.put(title, record)
+        self.store.save()
+        os.replace(self.file_name, self.file_name + ".migrated")
+        return True
 
 
 class Record:
@@ -106,6 +406,23 @@ class Field:
         return f"{self._value}"
 
 
+class LazyText(Field):
+    """Text of the note kept compressed in the blob store, it is read and
+    unpacked on every access to value"""
+
+    blobs = None
+
+    def __init__(self, ref):
+        self.ref = ref
+
+    @property
+    def value(self):
+        return self.blobs.get(self.ref)
+
+    def __str__(self):
+        return self.value
+
+
 class Title(Field):
     @property
     def value(self):
@@ -140,7 +457,8 @@ class Tag(Field):
 
 
 class CommandsHandler:
-    notebook = Notebook()
+    # Read from disk by the first command, not when the module is imported
+    notebook = LazyStore(Notebook)
 
     def add_note(self):
         """add a new note in Notebook"""
@@ -176,50 +494,49 @@ class CommandsHandler:
         if not data:
             print("\033[4m\033[31m{}\033[0m".format("The notebook is empty."))
         else:
-            flag = False
-            for title, record in data.items():
+            found = self.notebook.find_by_title(find_user)
+            found |= self.notebook.find_by_tag(find_user)
+            for title in sorted(found):
+                record = data[title]
                 rec_data = record.formatting_record(record)
-                if title.startswith(find_user):
-                    flag = True
-                    print(
-                        "\033[3m\033[35m{}\033[0m".format(
-                            f"|Title: {title}\n"
-                            f"|Text: {rec_data['text']}\n"
-                            f"|Tag: {rec_data['#tag']}\n"
-                        )
+                print(
+                    "\033[3m\033[35m{}\033[0m".format(
+                        f"|Title: {title}\n"
+                        f"|Text: {rec_data['text']}\n"
+                        f"|Tag: {rec_data['#tag']}\n"
                     )
-                tags = getattr(record, "tags", "")
-                if tags:
-                    for tag in tags:
-                        if tag.value.startswith(find_user):
-                            flag = True
-                            print(
-                                "\033[3m\033[35m{}\033[0m".format(
-                                    f"|Title: {title}\n"
-                                    f"|Text: {rec_data['text']}\n"
-                                    f"|Tag: {rec_data['#tag']}\n"
-                                )
-                            )
-            if not flag:
+                )
+            if not found:
                 print(
                     Style.BRIGHT
                     + Fore.RED
                     + "Note with this title or #tag was not found."
                 )
 
+    def search_notes(self):
+        """search words in titles and texts of notes"""
+        query = input(
+            Style.BRIGHT + Fore.BLUE + 'Enter words or "exact phrase" to search: '
+        )
+        found = self.notebook.search(query)
+        for title, score in found:
+            rec_data = self.notebook.data[title].formatting_record(
+                self.notebook.data[title]
+            )
+            print(
+                "\033[3m\033[35m{}\033[0m".format(
+                    f"|Title: {title} ({score:.2f})\n"
+                    f"|Text: {rec_data['text']}\n"
+                    f"|Tag: {rec_data['#tag']}\n"
+                )
+            )
+        if not found:
+            print(Style.BRIGHT + Fore.RED + "Nothing was found.")
+
     def sort_notes_by_tag(self):
         """sorts notes by tags in Notebook"""
-        notes_tag = []
-        notes_without_tag = []
-        for name, record in self.notebook.items():
-            if getattr(record, "tags", ""):
-                notes_tag.append(record)
-            else:
-                notes_without_tag.append(record)
-        sortedDictWithTag = sorted(notes_tag, key=lambda x: len(x.tags), reverse=True)
-        sortedDictWithTag.extend(notes_without_tag)
-        for res in sortedDictWithTag:
-            rec_data = record.formatting_record(res)
+        for record in self.notebook.by_tag_count():
+            rec_data = record.formatting_record(record)
             print(
                 Fore.GREEN + f"|Title: {rec_data['title']}\n"
                 f"|Text: {rec_data['text']}\n"
@@ -231,71 +548,70 @@ class CommandsHandler:
         change_user = input(Style.BRIGHT + Fore.CYAN + "Enter title of note: ")
         data = self.notebook.show_all_records()
         if not data:
-            print("\033[4m\033[31m{}\033[0m".format("The Notebook is empty."))
+            report_error("\033[4m\033[31m{}\033[0m".format("The Notebook is empty."))
         else:
             flag = False
             update_title_data = {}
-            for title, record in data.items():
-                if title.startswith(change_user):
-                    flag = True
-                    change_commands = PrettyTable()
-                    change_commands.field_names = [
-                        Style.BRIGHT + Fore.CYAN + "Command entry",
-                        "Command value",
-                    ]
-                    change_commands.add_row(
-                        [Style.BRIGHT + Fore.CYAN + "Press 1", "Add tag"]
-                    )
-                    change_commands.add_row(
-                        [Style.BRIGHT + Fore.CYAN + "Press 2", "Change title of note"]
+            for title in sorted(self.notebook.find_by_title(change_user)):
+                record = data[title]
+                flag = True
+                change_commands = PrettyTable()
+                change_commands.field_names = [
+                    Style.BRIGHT + Fore.CYAN + "Command entry",
+                    "Command value",
+                ]
+                change_commands.add_row(
+                    [Style.BRIGHT + Fore.CYAN + "Press 1", "Add tag"]
+                )
+                change_commands.add_row(
+                    [Style.BRIGHT + Fore.CYAN + "Press 2", "Change title of note"]
+                )
+                change_commands.add_row(
+                    [Style.BRIGHT + Fore.CYAN + "Press 3", "Change text"]
+                )
+                change_commands.add_row(
+                    [Style.BRIGHT + Fore.CYAN + "Press 4", "Change tags"]
+                )
+                print(change_commands)
+                change = int(input(Style.BRIGHT + Fore.CYAN + "Enter your choice: "))
+                if change not in (1, 2, 3, 4):
+                    report_error(Style.BRIGHT + Fore.RED + f"{change} invalid choice")
+                    continue
+                self.notebook.keep_revision(record)
+                if change == 1:
+                    tag_add = input(Style.BRIGHT + Fore.CYAN + "Enter a tag: ")
+                    record.create_tag(record=record, user_tag=tag_add, update=False)
+                    print(
+                        Style.BRIGHT + Fore.YELLOW + f"In note {title} append "
+                        f"{[tag.value for tag in record.tags]}"
                     )
-                    change_commands.add_row(
-                        [Style.BRIGHT + Fore.CYAN + "Press 3", "Change text"]
+                elif change == 2:
+                    new_title = input(Style.BRIGHT + Fore.CYAN + "Enter a new title: ")
+                    record.title = Title(new_title)
+                    update_title_data[title] = new_title
+                    print(
+                        Style.BRIGHT
+                        + Fore.YELLOW
+                        + f"In note title {title} was changed to "
+                        f"{record.title.value}"
                     )
-                    change_commands.add_row(
-                        [Style.BRIGHT + Fore.CYAN + "Press 4", "Change tags"]
+                elif change == 3:
+                    text = input(Style.BRIGHT + Fore.CYAN + "Enter a new text: ")
+                    record.create_text(record=record, user_text=text)
+                    print(
+                        Style.BRIGHT + Fore.YELLOW + f"In note {title} change text "
+                        f"{record.text.value}"
                     )
-                    print(change_commands)
-                    change = int(
-                        input(Style.BRIGHT + Fore.CYAN + "Enter your choice: ")
+                elif change == 4:
+                    tag_add = input(Style.BRIGHT + Fore.CYAN + "Enter a tag: ")
+                    record.create_tag(record=record, user_tag=tag_add, update=True)
+                    print(
+                        Style.BRIGHT + Fore.YELLOW + f"In note {title} update "
+                        f"{[tag.value for tag in record.tags]}"
                     )
-                    if change == 1:
-                        tag_add = input(Style.BRIGHT + Fore.CYAN + "Enter a tag: ")
-                        record.create_tag(record=record, user_tag=tag_add, update=False)
-                        print(
-                            Style.BRIGHT + Fore.YELLOW + f"In note {title} append "
-                            f"{[tag.value for tag in record.tags]}"
-                        )
-                    elif change == 2:
-                        new_title = input(
-                            Style.BRIGHT + Fore.CYAN + "Enter a new title: "
-                        )
-                        record.title = Title(new_title)
-                        update_title_data[title] = new_title
-                        print(
-                            Style.BRIGHT
-                            + Fore.YELLOW
-                            + f"In note title {title} was changed to "
-                            f"{record.title.value}"
-                        )
-                    elif change == 3:
-                        text = input(Style.BRIGHT + Fore.CYAN + "Enter a new text: ")
-                        record.create_text(record=record, user_text=text)
-                        print(
-                            Style.BRIGHT + Fore.YELLOW + f"In note {title} change text "
-                            f"{record.text.value}"
-                        )
-                    elif change == 4:
-                        tag_add = input(Style.BRIGHT + Fore.CYAN + "Enter a tag: ")
-                        record.create_tag(record=record, user_tag=tag_add, update=True)
-                        print(
-                            Style.BRIGHT + Fore.YELLOW + f"In note {title} update "
-                            f"{[tag.value for tag in record.tags]}"
-                        )
-                    else:
-                        print(Style.BRIGHT + Fore.RED + f"{change} invalid choice")
+                self.notebook.update_record(record)
             for title, new_title in update_title_data.items():
-                self.notebook.data[new_title] = self.notebook.data.pop(title)
+                self.notebook.rename_record(title, new_title)
             if flag:
                 self.notebook.save_notes()
 
@@ -311,7 +627,10 @@ class CommandsHandler:
             remove_note = input(
                 Style.BRIGHT + Fore.YELLOW + "Enter a title of the note to be deleted: "
             )
-            self.notebook.data.pop(remove_note)
+            if remove_note not in self.notebook:
+                report_error(Style.BRIGHT + Fore.RED + f"Note {remove_note} not found.")
+                return
+            self.notebook.remove_record(remove_note)
             print(Style.BRIGHT + Fore.RED + f"Note {remove_note} deleted.")
         elif remove_date == "del all":
             print(
@@ -320,15 +639,53 @@ class CommandsHandler:
                 + f"Are you sure you want to clear the Notebook?"
             )
             question = input(Style.BRIGHT + Fore.RED + "Y or N: ").lower().strip()
-            if question == "n":
+            if question != "y":
                 return
-            elif question == "y":
-                self.notebook.data.clear()
+            self.notebook.clear_records()
+        else:
+            report_error(Style.BRIGHT + Fore.RED + "Invalid command")
+            return
+        self.notebook.save_notes()
+
+    def show_history(self):
+        """shows revisions of a note"""
+        title = input(Style.BRIGHT + Fore.BLUE + "Enter title of note: ")
+        revisions = self.notebook.revisions(title)
+        if not revisions:
+            report_error(Style.BRIGHT + Fore.RED + f"Note {title} has no history.")
+            return
+        table = PrettyTable(["Revision", "Date", "Title", "Tags"])
+        for number, changed, old_title, tags in revisions:
+            table.add_row(
+                [number, changed.strftime("%d.%m.%Y %H:%M"), old_title, " ".join(tags)]
+            )
+        print(table)
+
+    def restore_note(self):
+        """restores a note to one of its revisions"""
+        title = input(Style.BRIGHT + Fore.BLUE + "Enter title of note: ")
+        if title not in self.notebook:
+            report_error(Style.BRIGHT + Fore.RED + f"Note {title} not found.")
+            return
+        number = input(Style.BRIGHT + Fore.BLUE + "Enter revision number: ")
+        record = None
+        if number.isdigit():
+            record = self.notebook.restore_revision(title, int(number))
+        if record is None:
+            report_error(
+                Style.BRIGHT + Fore.RED + f"Note {title} has no revision {number}."
+            )
+            return
+        print(
+            Style.BRIGHT
+            + Fore.YELLOW
+            + f"Note {record.title.value} restored to revision {number}."
+        )
         self.notebook.save_notes()
 
     def get_back(self):
         """Back to main menu"""
-        pass
+        self.notebook.flush()
 
 
 class NoteBookDataOutput(TableOutput):
@@ -351,7 +708,10 @@ help = (
     "|del - delete a note from Notebook\n"
     "|change - change a note in Notebook\n"
     "|find - find note in Notebook\n"
+    "|search - search words in titles and texts of notes\n"
     "|tag sort - sorts notes by tags in Notebook\n"
+    "|history - shows revisions of a note\n"
+    "|restore - restores a note to one of its revisions\n"
     "|show all - shows the entire Notebook\n"
     "|back - Closing the sublayer\n"
 )
@@ -362,7 +722,10 @@ commands = {
     "del": CommandsHandler().remove_note,
     "change": CommandsHandler().change_note,
     "find": CommandsHandler().find_note,
+    "search": CommandsHandler().search_notes,
     "tag sort": CommandsHandler().sort_notes_by_tag,
+    "history": CommandsHandler().show_history,
+    "restore": CommandsHandler().restore_note,
     "show all": CommandsHandler().show_all,
     "back": CommandsHandler().get_back,
 }
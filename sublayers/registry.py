@@ -0,0 +1,35 @@
+import importlib
+
+# Menu name -> module with the commands dict of the sublayer. Modules are
+# imported on the first selection, so the menu appears without reading any data
+SUBLAYERS = {
+    "Address Book": "sublayers.addressbook",
+    "Note Book": "sublayers.notebook",
+    "Sorter Assist": "sublayers.cleaner",
+}
+
+
+def load_commands(name):
+    """Imports the sublayer on first use
+
+    Returns:
+        dict: commands of the sublayer
+    """
+    return importlib.import_module(SUBLAYERS[name]).commands
+
+
+class LazyStore:
+    """Class attribute which creates the store on first use.
+
+    All instances of the class share one store, nothing is read from disk
+    while the commands dict is built.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.store = None
+
+    def __get__(self, obj, owner=None):
+        if self.store is None:
+            self.store = self.factory()
+        return self.store
@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def is_link(entry):
+    try:
+        return entry.is_symlink()
+    except OSError:
+        return False
+
+
+def list_dir(path):
+    """Reads entries of one folder with a single scandir call.
+    Folders which can't be read are skipped, so are symlinks: a link to
+    a folder could make a loop and moving or deduplicating a link would
+    change the file it points to
+
+    Returns:
+        list: os.DirEntry of the folder
+    """
+    try:
+        with os.scandir(path) as entries:
+            return [entry for entry in entries if not is_link(entry)]
+    except (PermissionError, FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def is_folder(entry):
+    """Uses the type scandir has already read"""
+    try:
+        return entry.is_dir(follow_symlinks=False)
+    except OSError:
+        return False
+
+
+def walk(path):
+    """Yields os.DirEntry of every file and folder under path.
+
+    The walk keeps a stack of folders instead of recursion, so deep trees
+    don't hit the recursion limit
+    """
+    stack = [path]
+    while stack:
+        entries = list_dir(stack.pop())
+        stack.extend(entry.path for entry in entries if is_folder(entry))
+        yield from entries
+
+
+def walk_parallel(path, workers=8):
+    """Same entries as walk(), sibling folders are read by a pool of threads.
+
+    Entries of a folder are yielded as soon as it is read, so the order
+    differs from run to run
+    """
+    with ThreadPoolExecutor(workers) as pool:
+        pending = {pool.submit(list_dir, path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries = future.result()
+                for entry in entries:
+                    if is_folder(entry):
+                        pending.add(pool.submit(list_dir, entry.path))
+                yield from entries
+
+
+def scan(path, workers=None):
+    """Yields os.DirEntry of every file and folder under path, folders are
+    read by workers threads if workers is more than 1
+    """
+    if workers and workers > 1:
+        return walk_parallel(path, workers)
+    return walk(path)
@@ -0,0 +1,176 @@
+import heapq
+import math
+import re
+
+from sublayers.shards import ShardStore
+
+WORD = re.compile(r"\w+")
+PHRASE = re.compile(r'"([^"]*)"')
+
+
+def tokenize(text):
+    return WORD.findall(text.lower())
+
+
+class SearchIndex:
+    """Inverted index over note titles and texts with BM25 ranking.
+
+    The index is kept in a ShardStore split by term:
+    "term:<term>" -> {title: (length of the note, [positions of the term])}
+    A shard is read on the first query with one of its terms, a start reads
+    only the manifest. Positions let "quoted phrases" match only words
+    standing together.
+
+    "note:<title>" -> (length of the note, its terms) tells which postings
+    to change when the note is removed. Both kinds of keys are in one store,
+    so a save switches them together.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, folder):
+        self.store = ShardStore(folder)
+        self.count = 0
+        self.total_length = 0
+
+    def __len__(self):
+        return self.count
+
+    def posting(self, term):
+        """{title: (length of the note, positions of the term)}"""
+        return self.store.get("term:" + term, {})
+
+    def add(self, title, text):
+        self.add_terms(title, tokenize(title) + tokenize(text or ""))
+
+    def add_terms(self, title, terms):
+        self.remove(title)
+        positions = {}
+        for position, term in enumerate(terms):
+            positions.setdefault(term, []).append(position)
+        length = len(terms)
+        for term, term_positions in positions.items():
+            docs = self.posting(term)
+            docs[title] = (length, term_positions)
+            self.store.put("term:" + term, docs)
+        self.store.put("note:" + title, (length, tuple(positions)))
+        self.count += 1
+        self.total_length += length
+
+    def remove(self, title):
+        note = self.store.get("note:" + title)
+        if note is None:
+            return
+        length, terms = note
+        for term in terms:
+            docs = self.posting(term)
+            docs.pop(title, None)
+            if docs:
+                self.store.put("term:" + term, docs)
+            else:
+                self.store.delete("term:" + term)
+        self.store.delete("note:" + title)
+        self.count -= 1
+        self.total_length -= length
+
+    def clear(self):
+        self.store.clear()
+        self.count = 0
+        self.total_length = 0
+
+    def titles(self):
+        """Titles of all indexed notes, reads the whole index"""
+        return [key[5:] for key in self.store.load() if key.startswith("note:")]
+
+    @staticmethod
+    def has_phrase(postings, title, terms):
+        """Checks that terms stand one after another in the note"""
+        starts = set(postings[terms[0]][title][1])
+        for shift, term in enumerate(terms[1:], 1):
+            positions = postings[term][title][1]
+            starts &= {position - shift for position in positions}
+            if not starts:
+                return False
+        return True
+
+    def search(self, query, limit=10):
+        """Finds notes matching any query word, "quoted phrases" must match
+        as a whole
+
+        Returns:
+            list: (title, score) pairs, the best match first
+        """
+        phrases = [tokenize(phrase) for phrase in PHRASE.findall(query)]
+        phrases = [phrase for phrase in phrases if phrase]
+        terms = set(tokenize(PHRASE.sub(" ", query)))
+        for phrase in phrases:
+            terms.update(phrase)
+        postings = {term: self.posting(term) for term in terms}
+        postings = {term: docs for term, docs in postings.items() if docs}
+        if not postings or not self.count:
+            return []
+        allowed = None
+        for phrase in phrases:
+            if any(term not in postings for term in phrase):
+                return []
+            rarest = min(phrase, key=lambda term: len(postings[term]))
+            candidates = postings[rarest].keys()
+            if allowed is not None:
+                candidates = allowed & candidates
+            allowed = {
+                title
+                for title in candidates
+                if all(title in postings[term] for term in phrase)
+                and self.has_phrase(postings, title, phrase)
+            }
+        average = self.total_length / self.count
+        scores = {}
+        for docs in postings.values():
+            idf = math.log(1 + (self.count - len(docs) + 0.5) / (len(docs) + 0.5))
+            if allowed is not None:
+                docs = {title: docs[title] for title in allowed if title in docs}
+            for title, (length, positions) in docs.items():
+                frequency = len(positions)
+                norm = self.k1 * (1 - self.b + self.b * length / average)
+                scores[title] = scores.get(title, 0) + idf * frequency * (
+                    self.k1 + 1
+                ) / (frequency + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def save(self, notes_files):
+        """Writes shards of terms and notes changed since the last save
+
+        Args:
+            notes_files: shard files of the notes the index is built from,
+                kept in the manifest to find outdated shards on load
+        """
+        self.store.set_meta(
+            {
+                "notes": dict(notes_files),
+                "count": self.count,
+                "total_length": self.total_length,
+            }
+        )
+        self.store.save()
+
+    def load(self, notes_files):
+        """Reads the manifest of the index, postings are read when queried
+
+        Returns:
+            set: shard numbers of the notes whose index was saved for other
+            shard files and must be built again
+        """
+        self.store.load_manifest()
+        meta = self.store.meta
+        self.count = meta.get("count", 0)
+        self.total_length = meta.get("total_length", 0)
+        saved = meta.get("notes", {})
+        return {
+            number
+            for number in set(saved) | set(notes_files)
+            if saved.get(number) != notes_files.get(number)
+        }
+
+    def remove_leftovers(self):
+        self.store.remove_leftovers()
@@ -0,0 +1,258 @@
+import hashlib
+import os
+import pickle
+
+from sublayers.journal import file_id
+from sublayers.locks import FileLock
+
+
+def shard_of(key, shard_count):
+    """Stable shard number of the key, the same in every process"""
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shard_count
+
+
+class ShardStore:
+    """Keeps a dict split into shard_count pickled files in a folder.
+
+    manifest.bin maps shard numbers to the file names of their current
+    versions. A save writes new files only for changed shards and then
+    replaces the manifest, so a crash leaves either the old or the new
+    version of the data, never a half-written one. The manifest also keeps
+    meta, a small dict set by the owner of the store.
+
+    Several processes may share the folder. A save holds an exclusive file
+    lock and first reads shards other processes have replaced, keys changed
+    here since the last save are put over them.
+    """
+
+    shard_count = 256
+    manifest_name = "manifest.bin"
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifest_file = os.path.join(folder, self.manifest_name)
+        self.file_lock = FileLock(folder + ".lock")
+        self.generation = 0
+        self.files = {}
+        self.shards = {}
+        self.dirty = set()
+        # shard number -> changed keys, None when the shard was cleared
+        self.dirty_keys = {}
+        self.meta = {}
+        self.meta_changed = False
+        self.stamp = None
+        self.stale = False
+        # All shards are kept in memory after load(), otherwise they are read
+        # when a key in them is used
+        self.loaded_all = False
+
+    def exists(self):
+        return os.path.exists(self.manifest_file)
+
+    def load_manifest(self):
+        """Reads the manifest only, shards are read when a key in them is used
+
+        Returns:
+            bool: True if the manifest was read
+        """
+        with self.file_lock.hold(shared=True):
+            manifest = self._read_manifest()
+            if manifest is None:
+                return False
+            self.shard_count = manifest["shard_count"]
+            self.generation = manifest["generation"]
+            self.files = manifest["files"]
+            self.meta = manifest.get("meta", {})
+            self.meta_changed = False
+            self.shards = {}
+            self.stamp = file_id(self.manifest_file)
+            self.stale = False
+        return True
+
+    def load(self):
+        """Reads all shards listed in the manifest
+
+        Returns:
+            dict: all keys and values of the store
+        """
+        self.loaded_all = True
+        with self.file_lock.hold(shared=True):
+            if not self.load_manifest():
+                return {}
+            data = {}
+            for number in self.files:
+                data.update(self._shard(number))
+        return data
+
+    def changes(self):
+        """Reads shards replaced by other processes since the last read
+
+        Returns:
+            dict: changed keys with new values, None for deleted keys, or
+            None if everything must be loaded again
+        """
+        with self.file_lock.hold(shared=True):
+            if self.stale:
+                return None
+            return self._sync()
+
+    def get(self, key, default=None):
+        return self._shard(shard_of(key, self.shard_count)).get(key, default)
+
+    def put(self, key, value):
+        number = shard_of(key, self.shard_count)
+        self._shard(number)[key] = value
+        self._touch(number, key)
+
+    def delete(self, key):
+        number = shard_of(key, self.shard_count)
+        self._shard(number).pop(key, None)
+        self._touch(number, key)
+
+    def set_meta(self, meta):
+        """Sets the dict written to the manifest by the next save"""
+        if meta != self.meta:
+            self.meta = meta
+            self.meta_changed = True
+
+    def clear(self):
+        self.dirty.update(self.shards)
+        self.dirty.update(self.files)
+        self.shards = {number: {} for number in self.dirty}
+        self.dirty_keys = {number: None for number in self.dirty}
+
+    def save(self):
+        """Writes changed shards and switches the manifest to them
+
+        Returns:
+            dict: changes of other processes merged into the written shards,
+            in the same form as changes() returns
+        """
+        if not self.dirty and not self.meta_changed:
+            return {}
+        with self.file_lock.hold():
+            merged = self._sync()
+            if merged is None:
+                self.stale = True
+                merged = {}
+            os.makedirs(self.folder, exist_ok=True)
+            self.generation += 1
+            files = dict(self.files)
+            for number in self.dirty:
+                shard = self.shards.get(number)
+                if not shard:
+                    files.pop(number, None)
+                    continue
+                file_name = f"shard-{number:04}.{self.generation}.bin"
+                with open(os.path.join(self.folder, file_name), "wb") as f:
+                    pickle.dump(shard, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                files[number] = file_name
+            manifest = {
+                "shard_count": self.shard_count,
+                "generation": self.generation,
+                "files": files,
+                "meta": self.meta,
+            }
+            tmp_file = self.manifest_file + ".tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(manifest, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.manifest_file)
+            for number, file_name in self.files.items():
+                if files.get(number) != file_name:
+                    os.remove(os.path.join(self.folder, file_name))
+            self.files = files
+            self.dirty = set()
+            self.dirty_keys = {}
+            self.meta_changed = False
+            self.stamp = file_id(self.manifest_file)
+        return merged
+
+    def remove_leftovers(self):
+        """Deletes shard files not listed in the manifest after a crash"""
+        with self.file_lock.hold():
+            if not os.path.isdir(self.folder):
+                return
+            manifest = self._read_manifest()
+            current = {self.manifest_name}
+            if manifest is not None:
+                current.update(manifest["files"].values())
+            for file_name in os.listdir(self.folder):
+                if file_name not in current:
+                    os.remove(os.path.join(self.folder, file_name))
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_file, "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _sync(self):
+        """Reads shards whose files in the manifest differ from known ones.
+        Must be called under the file lock
+        """
+        if file_id(self.manifest_file) == self.stamp:
+            return {}
+        manifest = self._read_manifest()
+        if manifest is None or manifest["shard_count"] != self.shard_count:
+            return None if manifest is not None or self.files else {}
+        changes = {}
+        files = manifest["files"]
+        for number in set(files) | set(self.files):
+            if files.get(number) == self.files.get(number):
+                continue
+            if number in files:
+                self.files[number] = files[number]
+            else:
+                del self.files[number]
+            old = self.shards.get(number)
+            if old is None and not self.loaded_all:
+                continue
+            old = old or {}
+            mine = self.dirty_keys.get(number, set())
+            if mine is None:
+                continue
+            self.shards.pop(number, None)
+            new = self._shard(number)
+            for key in mine:
+                if key in old:
+                    new[key] = old[key]
+                else:
+                    new.pop(key, None)
+            for key in old.keys() | new.keys():
+                if key not in mine:
+                    changes[key] = new.get(key)
+        self.generation = max(self.generation, manifest["generation"])
+        self.stamp = file_id(self.manifest_file)
+        return changes
+
+    def _touch(self, number, key):
+        self.dirty.add(number)
+        keys = self.dirty_keys.setdefault(number, set())
+        if keys is not None:
+            keys.add(key)
+
+    def _shard(self, number):
+        shard = self.shards.get(number)
+        if shard is None:
+            shard = {}
+            if number in self.files:
+                with self.file_lock.hold(shared=True):
+                    try:
+                        shard = self._read_shard(self.files[number])
+                    except FileNotFoundError:
+                        # Replaced by another process after the manifest was read
+                        self._sync()
+                        if number in self.files:
+                            shard = self._read_shard(self.files[number])
+            self.shards[number] = shard
+        return shard
+
+    def _read_shard(self, file_name):
+        with open(os.path.join(self.folder, file_name), "rb") as f:
+            return pickle.load(f)
@@ -0,0 +1,186 @@
+import os
+import shutil
+
+from sublayers.journal import Journal
+
+
+class SortPlan:
+    """Moves of one sort written to a journal in the sorted folder before
+    any file is touched.
+
+    The journal keeps every move as (source, target, category, state) under
+    its number. state is True once the move is done, undo_failed if undo()
+    couldn't revert it and False otherwise.
+    Moves are marked done in batches of checkpoint_every, so an interrupted
+    sort is resumed from the last checkpoint, and a move done after it is
+    recognized by its source missing and its target existing. The same
+    records let undo() put the files back.
+    """
+
+    # Snapshot name of the journal, which is never written: the plan goes to
+    # .sort-plan.log next to it and .sort-plan.lock guards it
+    file_name = ".sort-plan.bin"
+    checkpoint_every = 100
+    # State of a done move undo() could not revert
+    undo_failed = "undo failed"
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        self.journal = Journal(os.path.join(self.root, self.file_name))
+        self.moves = []
+        self.done = set()
+        self.failed = set()
+        self.folders = []
+        self.status = None
+
+    def is_journal_file(self, path):
+        stem = os.path.splitext(self.file_name)[0]
+        return os.path.basename(path).startswith(stem)
+
+    def load(self):
+        """Reads the plan of the last sort of the folder
+
+        Returns:
+            bool: True if there is a plan
+        """
+        data = self.journal.load()
+        self.status = data.pop("status", None)
+        self.folders = data.pop("folders", [])
+        self.moves = [data[number][:3] for number in range(len(data))]
+        self.done = {number for number, move in data.items() if move[3] is True}
+        self.failed = {
+            number for number, move in data.items() if move[3] == self.undo_failed
+        }
+        return self.status is not None
+
+    def build(self, file_paths, categories, normalize):
+        """Plans moves of files into category folders.
+
+        A file with a known extension goes to the folder of its category,
+        a file with an unknown one in the sorted folder itself goes to
+        others. Names are normalized, a name taken by another file gets
+        _1, _2 and so on before the extension.
+
+        Args:
+            file_paths: paths of files in the sorted folder
+            categories: dict of extension -> category folder
+            normalize: function making the new name of a file
+        """
+        taken = set()
+        for category in set(categories.values()) | {"others"}:
+            folder = os.path.join(self.root, category)
+            if os.path.isdir(folder):
+                taken.update(os.path.join(folder, name) for name in os.listdir(folder))
+        self.moves = []
+        for source in sorted(os.path.normpath(path) for path in file_paths):
+            if self.is_journal_file(source):
+                continue
+            category = categories.get(source.split(".")[-1])
+            if category is None and os.path.dirname(source) == self.root:
+                category = "others"
+            if category is None:
+                continue
+            target = os.path.join(self.root, category, normalize(source))
+            if target == source:
+                continue
+            stem, extension = os.path.splitext(target)
+            number = 0
+            while target in taken:
+                number += 1
+                target = f"{stem}_{number}{extension}"
+            taken.add(target)
+            self.moves.append((source, target, category))
+        self.done = set()
+        self.failed = set()
+
+    def start(self, folders):
+        """Writes the plan to a new journal, the journal of the previous sort
+        of the folder is removed
+
+        Args:
+            folders: subfolders to delete after the sort if they are empty
+        """
+        for file_name in (self.journal.snapshot_file, self.journal.log_file):
+            try:
+                os.remove(file_name)
+            except FileNotFoundError:
+                pass
+        self.journal = Journal(self.journal.snapshot_file)
+        self.folders = list(folders)
+        entries = [
+            ("set", number, (*move, False)) for number, move in enumerate(self.moves)
+        ]
+        entries.append(("set", "folders", self.folders))
+        entries.append(("set", "status", "running"))
+        self.journal.append(entries)
+        self.status = "running"
+
+    def execute(self, mover):
+        """Runs moves which are not done yet with the MoveExecutor"""
+        numbers = {move[1]: number for number, move in enumerate(self.moves)}
+        moved_before = []
+        for number, (source, target, category) in enumerate(self.moves):
+            if number in self.done:
+                continue
+            if not os.path.exists(source) and os.path.exists(target):
+                # Moved after the last checkpoint
+                moved_before.append(target)
+                continue
+            folder, name = os.path.split(target)
+            mover.move(source, folder, name, category)
+            if len(mover.completed) >= self.checkpoint_every:
+                self.checkpoint(mover.take_completed(), numbers)
+        mover.finish()
+        self.checkpoint(moved_before + mover.take_completed(), numbers)
+
+    def checkpoint(self, targets, numbers):
+        """Marks moves to the targets as done"""
+        entries = []
+        for target in targets:
+            number = numbers[target]
+            self.done.add(number)
+            entries.append(("set", number, (*self.moves[number], True)))
+        self.journal.append(entries)
+
+    def finish(self):
+        self.journal.append([("set", "status", "finished")])
+        self.status = "finished"
+
+    def undo(self):
+        """Moves files of the done moves back, the latest first. A file which
+        can't be moved back is marked undo_failed and left to the user, the
+        next undo doesn't try it again
+
+        Returns:
+            tuple: number of files moved back, list of (path, error) for
+            files left where they are
+        """
+        restored = 0
+        failed = []
+        entries = []
+        for number in sorted(self.done, reverse=True):
+            source, target, category = self.moves[number]
+            if os.path.exists(source) and not os.path.exists(target):
+                # Moved back by an undo which was interrupted
+                pass
+            else:
+                try:
+                    if os.path.exists(source):
+                        raise FileExistsError(f"{source} already exists")
+                    os.makedirs(os.path.dirname(source), exist_ok=True)
+                    shutil.move(target, source)
+                except OSError as error:
+                    failed.append((target, error))
+                    self.done.discard(number)
+                    self.failed.add(number)
+                    entries.append(
+                        ("set", number, (source, target, category, self.undo_failed))
+                    )
+                    continue
+            restored += 1
+            self.done.discard(number)
+            entries.append(("set", number, (source, target, category, False)))
+        entries.append(("set", "status", "undone"))
+        self.journal.append(entries)
+        self.status = "undone"
+        return restored, failed
@@ -0,0 +1,705 @@
+from abc import abstractmethod, ABC
+import hashlib
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+from collections.abc import Mapping
+
+from sublayers.indexes import (
+    LazyIndexes,
+    birthday_ranges,
+    contact_terms,
+    fuzzy_texts,
+    leap_day_of_year,
+    phone_digits,
+    trigrams,
+)
+from sublayers.journal import Journal, file_id
+from sublayers.locks import FileLock
+from sublayers.validation import parse_date
+
+
+class Storage(ABC):
+    """Keeps Records of the AddressBook on disk"""
+
+    @abstractmethod
+    def load(self):
+        """Returns mapping of names to Records"""
+        pass
+
+    @abstractmethod
+    def create_indexes(self, data):
+        """Returns object with add, remove, clear, find_by_name,
+        find_by_phone, upcoming_birthdays and fuzzy_find methods
+        """
+        pass
+
+    @abstractmethod
+    def save(self, data, pending):
+        """Writes changes listed in pending as (op, key) tuples"""
+        pass
+
+    @abstractmethod
+    def changes(self):
+        """Returns list of (op, key, Record) changes written by other
+        processes since the last call, or None if data must be loaded again
+        """
+        pass
+
+
+class PickleStorage(Storage):
+    """Pickled dict plus a log of changes, indexes are built in memory
+    on the first query
+    """
+
+    # Append changes to the log instead of rewriting the whole file
+    journaled = True
+
+    def __init__(self, file_name):
+        self.journal = Journal(file_name)
+
+    def load(self):
+        return self.journal.load()
+
+    def create_indexes(self, data):
+        return LazyIndexes(data)
+
+    def save(self, data, pending):
+        if self.journaled:
+            entries = [
+                (op, key, data.get(key))
+                for op, key in pending
+                if op != "set" or key in data
+            ]
+            self.journal.append(entries)
+            if self.journal.need_compaction():
+                self.journal.compact(data)
+        else:
+            self.journal.write_snapshot(data)
+
+    def changes(self):
+        return self.journal.changes()
+
+
+def prefix_bounds(prefix):
+    """Range of strings starting with prefix, so sqlite can use an index"""
+    return prefix, prefix + "\U0010ffff"
+
+
+class SQLiteStorage(Storage):
+    """Records in a sqlite database with indexes on names, phones, emails
+    and birthdays. Records are read only when they are needed.
+    Every change is written and committed at once, or rolled back if it
+    fails, so no write transaction is left open between commands.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS contacts (
+            name TEXT PRIMARY KEY,
+            email TEXT,
+            birthday_day INTEGER,
+            record BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS phones (
+            name TEXT NOT NULL,
+            digits TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS contacts_email ON contacts (email);
+        CREATE INDEX IF NOT EXISTS contacts_birthday ON contacts (birthday_day);
+        CREATE INDEX IF NOT EXISTS phones_digits ON phones (digits);
+        CREATE INDEX IF NOT EXISTS phones_name ON phones (name);
+        CREATE TABLE IF NOT EXISTS trigrams (
+            gram TEXT NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (gram, name)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS trigrams_name ON trigrams (name);
+    """
+
+    def __init__(self, file_name, migrate_from=None):
+        self.file_name = file_name
+        self.migrate_from = migrate_from
+        self.connection = sqlite3.connect(file_name)
+        self.connection.executescript(self.schema)
+        self.records = None
+        self.data_version = None
+
+    def load(self):
+        if self.migrate_from and not len(self):
+            self.migrate(self.migrate_from)
+        self.records = SQLiteRecords(self)
+        self.data_version = self.read_data_version()
+        return self.records
+
+    def read_data_version(self):
+        """Number which changes when another connection commits"""
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def changes(self):
+        # Indexes live in the database, only cached Records may be outdated
+        version = self.read_data_version()
+        if version != self.data_version:
+            self.data_version = version
+            if self.records is not None:
+                self.records.cache.clear()
+        return []
+
+    def migrate(self, pickle_file):
+        """Copies all Records from the pickled AddressBook once.
+        Old files are renamed to *.migrated afterwards
+        """
+        journal = Journal(pickle_file)
+        if not journal.exists():
+            return
+        with self.connection:
+            for key, record in journal.load().items():
+                self._add(key, record)
+        for file_name in (journal.snapshot_file, journal.log_file):
+            if os.path.exists(file_name):
+                os.replace(file_name, file_name + ".migrated")
+
+    def create_indexes(self, data):
+        return self
+
+    def save(self, data, pending):
+        # Changes are committed as they are made. The connection belongs to
+        # the thread that opened it, so the background writer must not use it
+        pass
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT record FROM contacts WHERE name = ?", (key,)
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def keys(self):
+        for (name,) in self.connection.execute("SELECT name FROM contacts"):
+            yield name
+
+    def items(self):
+        for name, blob in self.connection.execute("SELECT name, record FROM contacts"):
+            yield name, pickle.loads(blob)
+
+    def add(self, key, record):
+        with self.connection:
+            self._add(key, record)
+
+    def _add(self, key, record):
+        self._remove(key)
+        email = getattr(record, "email", None)
+        birthday = getattr(record, "birthday", None)
+        birthday_day = None
+        born = parse_date(birthday.value) if birthday else None
+        if born:
+            birthday_day = leap_day_of_year(born.day, born.month)
+        self.connection.execute(
+            "INSERT INTO contacts (name, email, birthday_day, record) "
+            "VALUES (?, ?, ?, ?)",
+            (key, email.value if email else None, birthday_day, pickle.dumps(record)),
+        )
+        self.connection.executemany(
+            "INSERT INTO phones (name, digits) VALUES (?, ?)",
+            [(key, phone_digits(p.value)) for p in getattr(record, "phones", [])],
+        )
+        grams = set()
+        for text in fuzzy_texts(key, record):
+            grams.update(trigrams(text))
+        self.connection.executemany(
+            "INSERT INTO trigrams (gram, name) VALUES (?, ?)",
+            [(gram, key) for gram in grams],
+        )
+
+    def remove(self, key):
+        with self.connection:
+            self._remove(key)
+
+    def _remove(self, key):
+        self.connection.execute("DELETE FROM contacts WHERE name = ?", (key,))
+        self.connection.execute("DELETE FROM phones WHERE name = ?", (key,))
+        self.connection.execute("DELETE FROM trigrams WHERE name = ?", (key,))
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM contacts")
+            self.connection.execute("DELETE FROM phones")
+            self.connection.execute("DELETE FROM trigrams")
+
+    def find_by_name(self, prefix):
+        rows = self.connection.execute(
+            "SELECT name FROM contacts WHERE name >= ? AND name < ?",
+            prefix_bounds(prefix),
+        )
+        return {name for (name,) in rows}
+
+    def find_by_phone(self, digits):
+        rows = self.connection.execute(
+            "SELECT name FROM phones WHERE digits >= ? AND digits < ?",
+            prefix_bounds(digits),
+        )
+        return {name for (name,) in rows}
+
+    def upcoming_birthdays(self, days):
+        found = []
+        for start, end in birthday_ranges(days):
+            rows = self.connection.execute(
+                "SELECT name FROM contacts "
+                "WHERE birthday_day >= ? AND birthday_day < ? "
+                "ORDER BY birthday_day, name",
+                (start, end),
+            )
+            found.extend(name for (name,) in rows)
+        return found
+
+    def fuzzy_find(self, query, limit, cutoff=0.5):
+        grams = list(trigrams(query))
+        rows = self.connection.execute(
+            "SELECT name FROM trigrams "
+            f"WHERE gram IN ({', '.join('?' * len(grams))}) "
+            "GROUP BY name HAVING COUNT(*) >= ? "
+            "ORDER BY COUNT(*) DESC, name LIMIT ?",
+            (*grams, cutoff * len(grams), limit),
+        )
+        return [name for (name,) in rows]
+
+
+class SQLiteRecords(Mapping):
+    """Read view of SQLiteStorage used as AddressBook.data.
+    Loaded Records are cached, so changes made in place are kept until the
+    AddressBook writes them with add_record or update_record
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.cache = {}
+
+    def __getitem__(self, key):
+        if key not in self.cache:
+            record = self.storage.get(key)
+            if record is None:
+                raise KeyError(key)
+            self.cache[key] = record
+        return self.cache[key]
+
+    def __setitem__(self, key, record):
+        self.cache[key] = record
+
+    def pop(self, key, *default):
+        try:
+            record = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        self.cache.pop(key, None)
+        return record
+
+    def clear(self):
+        self.cache.clear()
+
+    def __iter__(self):
+        return iter(self.storage.keys())
+
+    def __len__(self):
+        return len(self.storage)
+
+    def items(self):
+        for key, record in self.storage.items():
+            yield key, self.cache.get(key, record)
+
+    def values(self):
+        for _, record in self.items():
+            yield record
+
+
+def key_hash(key):
+    """Stable 64-bit hash of the key, the same in every process"""
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), "little"
+    )
+
+
+class MmapStorage(Storage):
+    """Records in an append-only data file plus a sorted index of
+    (key hash, offset, length) entries. The index is mmap-ed at start and
+    Records are unpickled only when a command touches them.
+
+    Data entry: key length (4 bytes), key in utf-8, terms length (4 bytes),
+    pickled contact_terms() of the Record, pickled Record. Indexes are built
+    from the terms without decoding Records.
+    """
+
+    magic = b"GTTDIDX2"
+    # Files of this format have no terms in data entries
+    old_magic = b"GTTDIDX1"
+    entry = struct.Struct("<QQI")
+    key_length = struct.Struct("<I")
+    # Rewrite the data file when it has more garbage than this
+    compact_threshold = 1024 * 1024
+
+    def __init__(self, file_name, migrate_from=None):
+        self.data_file = file_name
+        self.index_file = os.path.splitext(file_name)[0] + ".idx"
+        self.migrate_from = migrate_from
+        self.file_lock = FileLock(os.path.splitext(file_name)[0] + ".lock")
+        self.index_version = None
+        self.index = b""
+        self.blob = b""
+        self._files = []
+
+    def load(self):
+        if self.migrate_from and not os.path.exists(self.index_file):
+            self.migrate(self.migrate_from)
+        self.open()
+        if self.index[: len(self.old_magic)] == self.old_magic:
+            self.upgrade()
+        return MmapRecords(self)
+
+    def upgrade(self):
+        """Rewrites files of the old format with terms in every data entry"""
+        with self.file_lock.hold():
+            self.open()
+            if self.index[: len(self.old_magic)] != self.old_magic:
+                # Upgraded by another process
+                return
+            data = {}
+            for _, offset, length in self.entries():
+                key = self._key_at(offset)
+                start = offset + self.key_length.size + len(key.encode())
+                data[key] = pickle.loads(self.blob[start : offset + length])
+            self.close()
+            os.remove(self.data_file)
+            self.write(data, [("set", key) for key in data], live=[])
+
+    def migrate(self, pickle_file):
+        """Copies all Records from the pickled AddressBook once.
+        Old files are renamed to *.migrated afterwards
+        """
+        journal = Journal(pickle_file)
+        if not journal.exists():
+            return
+        data = journal.load()
+        self.write(data, [("set", key) for key in data], live=[])
+        for file_name in (journal.snapshot_file, journal.log_file):
+            if os.path.exists(file_name):
+                os.replace(file_name, file_name + ".migrated")
+
+    def open(self):
+        self.close()
+        with self.file_lock.hold(shared=True):
+            self.index_version = file_id(self.index_file)
+            self.index = self._map(self.index_file)
+            self.blob = self._map(self.data_file)
+
+    def changes(self):
+        # Records of other processes may be anywhere in the files, so the
+        # index is mapped again and Records are decoded anew
+        if file_id(self.index_file) != self.index_version:
+            return None
+        return []
+
+    def _map(self, file_name):
+        try:
+            f = open(file_name, "rb")
+        except FileNotFoundError:
+            return b""
+        if os.fstat(f.fileno()).st_size == 0:
+            f.close()
+            return b""
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._files.append((f, mapped))
+        return mapped
+
+    def close(self):
+        self.index = self.blob = b""
+        for f, mapped in self._files:
+            mapped.close()
+            f.close()
+        self._files = []
+
+    def __len__(self):
+        return max(len(self.index) - len(self.magic), 0) // self.entry.size
+
+    def entries(self):
+        """Yields (hash, offset, length) of all index entries"""
+        for i in range(len(self)):
+            yield self._entry_at(i)
+
+    def _entry_at(self, i):
+        return self.entry.unpack_from(self.index, len(self.magic) + i * self.entry.size)
+
+    def _key_at(self, offset):
+        (size,) = self.key_length.unpack_from(self.blob, offset)
+        start = offset + self.key_length.size
+        return self.blob[start : start + size].decode()
+
+    def lookup(self, key):
+        """Binary search of the key in the index
+
+        Returns:
+            tuple: (offset, length) or None if there is no such key
+        """
+        wanted = key_hash(key)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry_at(mid)[0] < wanted:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < len(self):
+            hash_, offset, length = self._entry_at(lo)
+            if hash_ != wanted:
+                break
+            if self._key_at(offset) == key:
+                return offset, length
+            lo += 1
+        return None
+
+    def _terms_at(self, offset):
+        """Returns start of the terms in the data entry and their length"""
+        (size,) = self.key_length.unpack_from(self.blob, offset)
+        start = offset + self.key_length.size + size
+        (terms_size,) = self.key_length.unpack_from(self.blob, start)
+        return start + self.key_length.size, terms_size
+
+    def read(self, offset, length):
+        """Decodes the data entry
+
+        Returns:
+            tuple: (key, Record)
+        """
+        start, terms_size = self._terms_at(offset)
+        record = pickle.loads(self.blob[start + terms_size : offset + length])
+        return self._key_at(offset), record
+
+    def read_terms(self, offset):
+        """Decodes only contact_terms() of the data entry"""
+        start, terms_size = self._terms_at(offset)
+        return pickle.loads(self.blob[start : start + terms_size])
+
+    def chunk(self, key, record):
+        """Encodes the data entry"""
+        encoded = key.encode()
+        terms = pickle.dumps(contact_terms(key, record))
+        return (
+            self.key_length.pack(len(encoded))
+            + encoded
+            + self.key_length.pack(len(terms))
+            + terms
+            + pickle.dumps(record)
+        )
+
+    def get(self, key):
+        found = self.lookup(key)
+        return self.read(*found)[1] if found else None
+
+    def keys(self):
+        for _, offset, _ in self.entries():
+            yield self._key_at(offset)
+
+    def items(self):
+        for _, offset, length in self.entries():
+            yield self.read(offset, length)
+
+    def create_indexes(self, data):
+        if isinstance(data, MmapRecords):
+            return LazyIndexes(data, data.terms)
+        return LazyIndexes(data)
+
+    def save(self, data, pending):
+        if not pending:
+            return
+        with self.file_lock.hold():
+            # Keep Records written by other processes since the index was mapped
+            foreign = file_id(self.index_file) != self.index_version
+            if foreign:
+                self.open()
+            cleared = any(op == "clear" for op, _ in pending)
+            touched = {key for _, key in pending if key is not None}
+            live = []
+            if not cleared:
+                touched_hashes = {key_hash(key) for key in touched}
+                for hash_, offset, length in self.entries():
+                    if hash_ in touched_hashes and self._key_at(offset) in touched:
+                        continue
+                    live.append((hash_, offset, length))
+            self.write(data, pending, live)
+            if foreign:
+                self.index_version = None
+        data.saved()
+
+    def write(self, data, pending, live):
+        """Appends changed Records to the data file and rewrites the index
+
+        Args:
+            data: mapping with current Records
+            pending: list of (op, key) changes
+            live: index entries which are kept as they are
+        """
+        written = set()
+        chunks = []
+        try:
+            offset = os.path.getsize(self.data_file)
+        except OSError:
+            offset = 0
+        for op, key in pending:
+            if op != "set" or key in written or key not in data:
+                continue
+            written.add(key)
+            chunk = self.chunk(key, data[key])
+            live.append((key_hash(key), offset, len(chunk)))
+            chunks.append(chunk)
+            offset += len(chunk)
+        garbage = offset - sum(length for _, _, length in live)
+        if garbage > self.compact_threshold and garbage > offset // 2:
+            live = self._rewrite_data(live, chunks)
+        else:
+            self.close()
+            with open(self.data_file, "ab") as f:
+                f.write(b"".join(chunks))
+                f.flush()
+                os.fsync(f.fileno())
+        live.sort()
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(self.magic)
+            for entry in live:
+                f.write(self.entry.pack(*entry))
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(tmp_file, self.index_file)
+        self.open()
+
+    def _rewrite_data(self, live, chunks):
+        """Copies only live entries to a new data file
+
+        Returns:
+            list: index entries with new offsets
+        """
+        appended = b"".join(chunks)
+        old_size = len(self.blob)
+        moved = []
+        offset = 0
+        tmp_file = self.data_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            for hash_, old_offset, length in live:
+                if old_offset < old_size:
+                    f.write(self.blob[old_offset : old_offset + length])
+                else:
+                    start = old_offset - old_size
+                    f.write(appended[start : start + length])
+                moved.append((hash_, offset, length))
+                offset += length
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(tmp_file, self.data_file)
+        return moved
+
+
+class MmapRecords(Mapping):
+    """View of MmapStorage used as AddressBook.data.
+    Records are decoded on first access and cached. Changes stay here until
+    MmapStorage.save writes them.
+
+    added holds keys which are not in the mapped files, deleted holds keys
+    of the files which were removed, so the size is known without looking
+    keys up in the index
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.cache = {}
+        self.added = set()
+        self.deleted = set()
+        self.cleared = False
+
+    def _on_disk(self, key):
+        return not self.cleared and key not in self.deleted
+
+    def __getitem__(self, key):
+        if key not in self.cache:
+            record = self.storage.get(key) if self._on_disk(key) else None
+            if record is None:
+                raise KeyError(key)
+            self.cache[key] = record
+        return self.cache[key]
+
+    def __contains__(self, key):
+        if key in self.cache:
+            return True
+        return self._on_disk(key) and self.storage.lookup(key) is not None
+
+    def __setitem__(self, key, record):
+        if key in self.deleted:
+            self.deleted.discard(key)
+        elif key not in self.cache and key not in self:
+            self.added.add(key)
+        self.cache[key] = record
+
+    def pop(self, key, *default):
+        try:
+            record = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        self.cache.pop(key)
+        if key in self.added:
+            self.added.discard(key)
+        else:
+            self.deleted.add(key)
+        return record
+
+    def clear(self):
+        self.cache.clear()
+        self.added.clear()
+        self.deleted.clear()
+        self.cleared = True
+
+    def saved(self):
+        """Called by the storage after changes are written"""
+        self.added.clear()
+        self.deleted.clear()
+        self.cleared = False
+
+    def __iter__(self):
+        if not self.cleared:
+            for key in self.storage.keys():
+                if key not in self.deleted:
+                    yield key
+        yield from self.added
+
+    def __len__(self):
+        on_disk = 0 if self.cleared else len(self.storage) - len(self.deleted)
+        return on_disk + len(self.added)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+    def values(self):
+        for key in self:
+            yield self[key]
+
+    def terms(self):
+        """Yields (key, contact_terms()) of all Records, cached Records may be
+        changed in place, so their terms are taken from them
+        """
+        if not self.cleared:
+            for _, offset, _ in self.storage.entries():
+                key = self.storage._key_at(offset)
+                if key in self.deleted:
+                    continue
+                if key in self.cache:
+                    yield key, contact_terms(key, self.cache[key])
+                else:
+                    yield key, self.storage.read_terms(offset)
+        for key in self.added:
+            yield key, contact_terms(key, self.cache[key])
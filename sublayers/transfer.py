@@ -0,0 +1,187 @@
+import csv
+import re
+from datetime import datetime
+from itertools import islice
+
+CSV_FIELDS = ["name", "phones", "email", "birthday", "home_address"]
+VCARD_ESCAPES = {"n": "\n", "N": "\n", ",": ",", ";": ";", "\\": "\\"}
+VCARD_ESCAPE = re.compile(r"\\(.)")
+
+
+def chunks(rows, size):
+    """Splits a stream of rows into lists of size rows"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def file_format(path):
+    """Returns 'vcard' for .vcf/.vcard files and 'csv' for anything else"""
+    if path.lower().endswith((".vcf", ".vcard")):
+        return "vcard"
+    return "csv"
+
+
+def read_csv(path):
+    """Yields contacts from csv file one by one
+
+    Args:
+        path: csv file with CSV_FIELDS columns, phones are separated by ';'
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            phones = row.get("phones") or ""
+            yield {
+                "name": (row.get("name") or "").strip(),
+                "phones": [p.strip() for p in phones.split(";") if p.strip()],
+                "email": (row.get("email") or "").strip(),
+                "birthday": (row.get("birthday") or "").strip(),
+                "home_address": (row.get("home_address") or "").strip(),
+            }
+
+
+def write_csv(path, contacts, extra_fields=(), append=False):
+    """Writes contacts to csv file as they come
+
+    Args:
+        append: add rows to the end of existing file without a header
+
+    Returns:
+        int: number of written contacts
+    """
+    count = 0
+    with open(path, "a" if append else "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS + list(extra_fields))
+        if not append:
+            writer.writeheader()
+        for contact in contacts:
+            writer.writerow({**contact, "phones": ";".join(contact["phones"])})
+            count += 1
+    return count
+
+
+def vcard_escape(value):
+    return (
+        value.replace("\\", "\\\\")
+        .replace(",", "\\,")
+        .replace(";", "\\;")
+        .replace("\n", "\\n")
+    )
+
+
+def vcard_unescape(value):
+    """Undoes vcard_escape in one pass, so an escaped backslash before n
+    stays a backslash. Unknown escapes are kept as they are
+    """
+    return VCARD_ESCAPE.sub(
+        lambda match: VCARD_ESCAPES.get(match.group(1), match.group(0)), value
+    )
+
+
+def vcard_split(value):
+    """Splits a structured value on ; which are not escaped"""
+    parts = [""]
+    for token in re.split(r"(\\.|;)", value):
+        if token == ";":
+            parts.append("")
+        else:
+            parts[-1] += token
+    return parts
+
+
+def vcard_lines(f):
+    """Yields logical lines of vCard, folded lines are joined"""
+    line = None
+    for raw in f:
+        raw = raw.rstrip("\r\n")
+        if raw[:1] in (" ", "\t") and line is not None:
+            line += raw[1:]
+            continue
+        if line is not None:
+            yield line
+        line = raw
+    if line is not None:
+        yield line
+
+
+def read_vcard(path):
+    """Yields contacts from vCard file one by one"""
+    with open(path, encoding="utf-8") as f:
+        contact = None
+        for line in vcard_lines(f):
+            prop, _, value = line.partition(":")
+            prop = prop.split(";")[0].upper()
+            if prop == "BEGIN":
+                contact = {
+                    "name": "",
+                    "phones": [],
+                    "email": "",
+                    "birthday": "",
+                    "home_address": "",
+                }
+            elif contact is None:
+                continue
+            elif prop == "END":
+                yield contact
+                contact = None
+            elif prop == "FN":
+                contact["name"] = vcard_unescape(value).strip()
+            elif prop == "TEL":
+                contact["phones"].append(value.strip())
+            elif prop == "EMAIL":
+                contact["email"] = value.strip()
+            elif prop == "BDAY":
+                contact["birthday"] = from_vcard_date(value.strip())
+            elif prop == "ADR":
+                parts = [vcard_unescape(p) for p in vcard_split(value)]
+                contact["home_address"] = ", ".join(p for p in parts if p).strip()
+
+
+def write_vcard(path, contacts):
+    """Writes contacts to vCard file as they come
+
+    Returns:
+        int: number of written contacts
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for contact in contacts:
+            lines = ["BEGIN:VCARD", "VERSION:3.0"]
+            lines.append(f"FN:{vcard_escape(contact['name'])}")
+            for phone in contact["phones"]:
+                lines.append(f"TEL:{phone}")
+            if contact["email"]:
+                lines.append(f"EMAIL:{contact['email']}")
+            if contact["birthday"]:
+                lines.append(f"BDAY:{to_vcard_date(contact['birthday'])}")
+            if contact["home_address"]:
+                lines.append(f"ADR:;;{vcard_escape(contact['home_address'])};;;;")
+            lines.append("END:VCARD")
+            f.write("\r\n".join(lines) + "\r\n")
+            count += 1
+    return count
+
+
+def to_vcard_date(birthday):
+    """'day.month.year' -> 'year-month-day'"""
+    try:
+        return datetime.strptime(birthday, "%d.%m.%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return birthday
+
+
+def from_vcard_date(bday):
+    """'year-month-day' or 'yearmonthday' -> 'day.month.year'"""
+    for pattern in ("%Y-%m-%d", "%Y%m%d"):
+        try:
+            return datetime.strptime(bday[:10], pattern).strftime("%d.%m.%Y")
+        except ValueError:
+            pass
+    return bday
+
+
+readers = {"csv": read_csv, "vcard": read_vcard}
+writers = {"csv": write_csv, "vcard": write_vcard}
@@ -0,0 +1,98 @@
+import re
+from datetime import date, datetime
+
+PHONE_PATTERN = re.compile(
+    r"^[\+]?3?[\s]?8?[\s]?\(?0\d{2}?\)?" r"[\s]?\d{3}[\s|-]?\d{2}[\s|-]?\d{2}$"
+)
+EMAIL_PATTERN = re.compile(r"^[-\w\.]+@([-\w]+\.)+[-\w]{2,4}$")
+PHONE_JUNK = re.compile(r"[\s()-]")
+
+DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+DIGITS = frozenset("0123456789")
+
+
+def normalize_phone(phone):
+    """Removes spaces, brackets and dashes: '+38 (099) 112-23-33' -> '+380991122333'"""
+    return PHONE_JUNK.sub("", phone)
+
+
+def is_phone(phone):
+    return PHONE_PATTERN.match(phone) is not None
+
+
+def is_email(email):
+    return EMAIL_PATTERN.match(email) is not None
+
+
+def parse_date(value):
+    """Fast parser of 'day.month.year' dates
+
+    Returns:
+        date: parsed date or None if the value is not a valid date
+    """
+    if (
+        len(value) == 10
+        and value[2] == "."
+        and value[5] == "."
+        and DIGITS.issuperset(value[:2] + value[3:5] + value[6:])
+    ):
+        day, month, year = int(value[:2]), int(value[3:5]), int(value[6:])
+        if not 1 <= month <= 12 or not 1 <= day <= DAYS_IN_MONTH[month] or not year:
+            return None
+        if (
+            month == 2
+            and day == 29
+            and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0))
+        ):
+            return None
+        return date(year, month, day)
+    # Short forms like '1.2.1990' are rare, let strptime deal with them
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def format_date(day):
+    return f"{day.day:02}.{day.month:02}.{day.year:04}"
+
+
+def parse_birthday(birthday, today=None):
+    """Parses birthday which must be in the past
+
+    Returns:
+        date: parsed birthday or None if it is invalid
+    """
+    born = parse_date(birthday)
+    if born is None or born >= (today or date.today()):
+        return None
+    return born
+
+
+def validate_phones(phones):
+    """Returns (mask, normalized phones) for a column of raw phones"""
+    match = PHONE_PATTERN.match
+    mask = [match(phone) is not None for phone in phones]
+    normalized = [
+        normalize_phone(phone) if ok else None for phone, ok in zip(phones, mask)
+    ]
+    return mask, normalized
+
+
+def validate_emails(emails):
+    """Returns (mask, normalized emails) for a column of raw emails"""
+    match = EMAIL_PATTERN.match
+    mask = [match(email) is not None for email in emails]
+    normalized = [email if ok else None for email, ok in zip(emails, mask)]
+    return mask, normalized
+
+
+def validate_birthdays(birthdays, today=None):
+    """Returns (mask, normalized 'dd.mm.yyyy' birthdays) for a column"""
+    today = today or date.today()
+    normalized = []
+    for birthday in birthdays:
+        born = parse_birthday(birthday, today)
+        normalized.append(format_date(born) if born else None)
+    mask = [value is not None for value in normalized]
+    return mask, normalized
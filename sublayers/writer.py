@@ -0,0 +1,171 @@
+import atexit
+import functools
+import signal
+import threading
+import time
+
+# Stores are changed and saved while holding this lock, so a background
+# write never sees half-applied changes. Commands don't hold it while they
+# wait for input
+store_lock = threading.RLock()
+# AddressBook and Notebook, each has refresh, flush and defer_saves methods
+stores = []
+
+
+def locked(method):
+    """Runs the method of a store holding store_lock"""
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with store_lock:
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+class DeferredWriter:
+    """Collects save requests and writes once when flush() is called.
+
+    Every request() marks the store dirty, a flush of a clean store does
+    nothing, so a series of changes costs one write.
+    """
+
+    def __init__(self, save):
+        self.save = save
+        self.requests = 0
+        self.writes = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        self._dirty = False
+        self._first_request = 0.0
+        self._last_request = 0.0
+        self._condition = threading.Condition()
+
+    def request(self):
+        """Marks the store dirty, the write happens later"""
+        with self._condition:
+            now = time.monotonic()
+            if not self._dirty:
+                self._first_request = now
+            self._dirty = True
+            self._last_request = now
+            self.requests += 1
+            self._condition.notify()
+
+    def flush(self):
+        """Writes pending changes right now in the calling thread"""
+        self._write()
+
+    def stats(self):
+        """Returns counters of the writer, latencies are in milliseconds"""
+        return {
+            "requests": self.requests,
+            "writes": self.writes,
+            "writes saved": self.requests - self.writes - self._dirty,
+            "failures": self.failures,
+            "last flush ms": self.last_latency * 1000,
+            "max flush ms": self.max_latency * 1000,
+            "average flush ms": self.total_latency * 1000 / (self.writes or 1),
+        }
+
+    def _write(self):
+        with store_lock:
+            with self._condition:
+                if not self._dirty:
+                    return
+                self._dirty = False
+            start = time.perf_counter()
+            try:
+                self.save()
+            except Exception as error:
+                self.failures += 1
+                self.last_error = error
+                with self._condition:
+                    self._dirty = True
+                    self._first_request = self._last_request = time.monotonic()
+                return
+            latency = time.perf_counter() - start
+            self.writes += 1
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+
+
+class BackgroundWriter(DeferredWriter):
+    """Runs save in a daemon thread after the store stops changing.
+
+    The write starts when there were no new requests for debounce seconds,
+    but no later than max_delay seconds after the first unsaved request,
+    so a burst of changes costs one write.
+    """
+
+    max_delay = 5.0
+
+    def __init__(self, save, debounce=0.5):
+        super().__init__(save)
+        self.debounce = debounce
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._dirty:
+                    self._condition.wait()
+                while self._dirty:
+                    now = time.monotonic()
+                    deadline = min(
+                        self._last_request + self.debounce,
+                        self._first_request + self.max_delay,
+                    )
+                    if now >= deadline:
+                        break
+                    self._condition.wait(deadline - now)
+            self._write()
+
+
+# Set by defer_all(), stores created later keep changes until flush_all() too
+deferred = False
+
+
+def register_store(store):
+    if all(known is not store for known in stores):
+        stores.append(store)
+        if deferred:
+            store.defer_saves()
+
+
+def refresh_all():
+    """Applies changes other processes wrote to the shared files"""
+    for store in stores:
+        store.refresh()
+
+
+def flush_all():
+    """Writes pending changes of all stores"""
+    for store in stores:
+        store.flush()
+
+
+def defer_all():
+    """Makes all stores keep changes until flush_all()"""
+    global deferred
+    deferred = True
+    for store in stores:
+        store.defer_saves()
+
+
+def exit_on_signal(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def install_signal_handlers():
+    """Makes SIGTERM and SIGHUP exit normally, so pending changes are
+    flushed at exit like after Ctrl+C"""
+    atexit.register(flush_all)
+    for name in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), exit_on_signal)
@@ -0,0 +1,131 @@
+import pickle
+
+from sublayers import addressbook, writer
+from sublayers.addressbook import (
+    AddressBook,
+    ContactTable,
+    Email,
+    HomeAddress,
+    Name,
+    Phone,
+    Record,
+    RecordView,
+)
+
+
+def contact(name, *phones, email=None):
+    record = Record(Name(name))
+    for phone in phones:
+        record.add_phone(Phone(phone))
+    if email:
+        record.email = Email(email)
+    return record
+
+
+def old_pickle(monkeypatch, records):
+    """Pickles a dict of Records as versions before __slots__ did, when
+    Records and Fields kept their attributes in __dict__"""
+
+    def __init__(self, value):
+        self._value = value
+
+    with monkeypatch.context() as patch:
+        classes = {}
+        for name in ("Record", "Name", "Phone", "Email"):
+            attributes = {"__module__": addressbook.__name__}
+            if name != "Record":
+                attributes["__init__"] = __init__
+            classes[name] = type(name, (), attributes)
+            patch.setattr(addressbook, name, classes[name])
+        old = {}
+        for key, (phones, email) in records.items():
+            record = classes["Record"]()
+            record.name = classes["Name"](key)
+            record.phones = [classes["Phone"](phone) for phone in phones]
+            record.email = classes["Email"](email) if email else None
+            record.birthday = None
+            old[key] = record
+        return pickle.dumps(old)
+
+
+def test_old_pickle_is_loaded_into_a_table(tmp_path, monkeypatch):
+    data = old_pickle(
+        monkeypatch,
+        {"Anna": (["0991112233"], "anna@gmail.com"), "Bob": (["067", "050"], None)},
+    )
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(writer, "stores", [])
+    monkeypatch.setattr(AddressBook, "_instance", None)
+    (tmp_path / AddressBook.file_name).write_bytes(data)
+
+    book = AddressBook()
+
+    assert isinstance(book.data, ContactTable)
+    assert not book.data.records
+    assert book.data["Anna"].email.value == "anna@gmail.com"
+    assert [phone.value for phone in book.data["Bob"].phones] == ["067", "050"]
+    assert book.data["Bob"].home_address is None
+    assert book.find_by_phone("050") == {"Bob"}
+
+
+def test_view_writes_fields_into_its_row():
+    table = ContactTable({"Anna": contact("Anna", "0991112233")})
+    view = table["Anna"]
+
+    view.email = Email("anna@gmail.com")
+    view.phones = [*view.phones, Phone("0671234567")]
+
+    assert isinstance(view, RecordView)
+    record = table.record(table.rows["Anna"])
+    assert record.email.value == "anna@gmail.com"
+    assert [phone.value for phone in record.phones] == ["0991112233", "0671234567"]
+
+
+def test_records_which_do_not_fit_a_row_are_kept_whole():
+    odd = contact("Odd", "099")
+    odd.home_address = HomeAddress("line\x1eother")
+    table = ContactTable({"Odd": odd, "Anna": contact("Anna", "067")})
+
+    assert table["Odd"] is odd
+    assert list(table.records.values()) == [odd]
+    del table["Odd"]
+    assert not table.records
+    assert list(table) == ["Anna"]
+
+
+def test_removed_rows_are_reused_and_compacted():
+    table = ContactTable()
+    table.compact_threshold = 0
+    for i in range(10):
+        table[f"name {i}"] = contact(f"name {i}", f"{i:03}")
+    for i in range(7):
+        del table[f"name {i}"]
+    table["new"] = contact("new", "123")
+
+    assert len(table.names) == 10
+    assert table.garbage == 0
+    assert len(table.buffer) == sum(table.lengths)
+    assert [phone.value for phone in table["name 8"].phones] == ["008"]
+    assert table["new"].phones[0].value == "123"
+
+
+def test_table_pickles_its_views_as_records():
+    table = ContactTable({"Anna": contact("Anna", "099", email="anna@gmail.com")})
+
+    record = pickle.loads(pickle.dumps(table["Anna"]))
+    copied = pickle.loads(pickle.dumps(table.copy()))
+
+    assert type(record) is Record
+    assert record.email.value == "anna@gmail.com"
+    assert copied["Anna"].phones[0].value == "099"
+
+
+def test_pop_returns_a_plain_record():
+    table = ContactTable({"Anna": contact("Anna", "099")})
+
+    record = table.pop("Anna")
+
+    assert type(record) is Record
+    assert record.phones[0].value == "099"
+    assert "Anna" not in table
+    assert table.pop("Anna", None) is None
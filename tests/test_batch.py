@@ -0,0 +1,90 @@
+import io
+
+import pytest
+
+from sublayers import addressbook, notebook, writer
+from sublayers.batch import BatchRunner, read_script
+from sublayers.registry import SUBLAYERS
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    """BatchRunner over empty stores in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(writer, "stores", [])
+    monkeypatch.setattr(writer, "deferred", False)
+    for store_class, handler_class, name in (
+        (addressbook.AddressBook, addressbook.CommandsHandler, "address_book"),
+        (notebook.Notebook, notebook.CommandsHandler, "notebook"),
+    ):
+        monkeypatch.setattr(store_class, "_instance", None)
+        monkeypatch.setattr(handler_class.__dict__[name], "store", None)
+    return BatchRunner(SUBLAYERS)
+
+
+def run(runner, script):
+    return list(runner.run_script(io.StringIO(script)))
+
+
+def test_commands_run_with_args_and_are_saved_by_finish(runner):
+    results = run(
+        runner,
+        '{"sublayer": "note book", "command": "add", "args": ["todo", "milk", ""]}\n'
+        '{"sublayer": "Note Book", "command": "search", "args": ["milk"]}\n',
+    )
+
+    assert [result["ok"] for result in results] == [True, True]
+    assert "todo" in results[1]["output"]
+    store = notebook.CommandsHandler.notebook.store
+    assert store.dirty
+    runner.finish()
+    assert not store.dirty
+
+
+def test_command_reporting_an_error_fails(runner):
+    [result] = run(
+        runner,
+        '{"sublayer": "note book", "command": "restore", "args": ["missing"]}\n',
+    )
+
+    assert not result["ok"]
+    assert result["message"] == "Note missing not found."
+
+
+def test_error_of_one_command_does_not_fail_the_next(runner):
+    results = run(
+        runner,
+        '{"sublayer": "note book", "command": "history", "args": ["missing"]}\n'
+        '{"sublayer": "note book", "command": "search", "args": ["anything"]}\n',
+    )
+
+    assert [result["ok"] for result in results] == [False, True]
+
+
+def test_unknown_command_gets_a_suggestion(runner):
+    [result] = run(runner, '{"sublayer": "note book", "command": "serach"}\n')
+
+    assert not result["ok"]
+    assert result["message"] == "unknown command 'serach', did you mean 'search'?"
+
+
+def test_missing_and_unused_args(runner):
+    results = run(
+        runner,
+        '{"sublayer": "note book", "command": "add", "args": ["todo"]}\n'
+        '{"sublayer": "note book", "command": "search", "args": ["a", "b"]}\n',
+    )
+
+    assert (results[0]["ok"], results[0]["message"]) == (False, "not enough args")
+    assert (results[1]["ok"], results[1]["message"]) == (True, "ok, 1 args not used")
+
+
+def test_read_script_reports_bad_lines():
+    lines = io.StringIO('# comment\n\nnot json\n[1]\n{"command": "help"}\n')
+
+    items = list(read_script(lines))
+
+    assert [number for number, _ in items] == [3, 4, 5]
+    assert items[0][1].startswith("invalid JSON")
+    assert items[1][1] == "expected an object with sublayer, command and args"
+    assert items[2][1] == {"command": "help"}
@@ -0,0 +1,91 @@
+import os
+
+from sublayers import dedup
+from sublayers.dedup import BLOCK_SIZE, find_duplicates, remove_duplicates
+
+
+def write(folder, files):
+    paths = []
+    for name, data in files.items():
+        path = folder / name
+        path.write_bytes(data)
+        paths.append(str(path))
+    return paths
+
+
+def test_only_files_with_the_same_content_are_grouped(tmp_path):
+    paths = write(
+        tmp_path,
+        {
+            "a.txt": b"same text",
+            "b.txt": b"same text",
+            "c.txt": b"else text",
+            "d.txt": b"same text, longer",
+            "e.txt": b"",
+            "f.txt": b"",
+        },
+    )
+
+    assert find_duplicates(paths + [str(tmp_path / "missing.txt")]) == [
+        [paths[0], paths[1]]
+    ]
+
+
+def test_big_files_are_read_whole_only_when_their_ends_match(tmp_path, monkeypatch):
+    size = 3 * BLOCK_SIZE
+    middle = bytearray(size)
+    middle[size // 2] = 1
+    paths = write(
+        tmp_path,
+        {
+            "a.bin": bytes(size),
+            "b.bin": bytes(size),
+            "c.bin": bytes(middle),
+            "d.bin": b"\x01" * size,
+            "small 1.bin": b"s" * 100,
+            "small 2.bin": b"s" * 100,
+        },
+    )
+    hashed = []
+    real_full_hash = dedup.full_hash
+
+    def full_hash(path, size):
+        hashed.append(os.path.basename(path))
+        return real_full_hash(path, size)
+
+    monkeypatch.setattr(dedup, "full_hash", full_hash)
+
+    groups = find_duplicates(paths, workers=2)
+
+    assert groups == [[paths[0], paths[1]], [paths[4], paths[5]]]
+    assert sorted(hashed) == ["a.bin", "b.bin", "c.bin"]
+
+
+def test_copies_after_the_first_file_are_removed(tmp_path):
+    paths = write(tmp_path, {"a.txt": b"text", "b.txt": b"text", "c.txt": b"text"})
+
+    done, saved, failed = remove_duplicates([paths])
+
+    assert (done, saved, failed) == (paths[1:], 8, [])
+    assert os.listdir(tmp_path) == ["a.txt"]
+
+
+def test_copies_are_replaced_by_hard_links(tmp_path):
+    paths = write(tmp_path, {"a.txt": b"text", "b.txt": b"text"})
+
+    assert remove_duplicates([paths], "link") == ([paths[1]], 4, [])
+
+    assert os.path.samefile(*paths)
+    assert sorted(os.listdir(tmp_path)) == ["a.txt", "b.txt"]
+    # linked files are not counted again
+    assert remove_duplicates([paths], "link") == ([], 0, [])
+
+
+def test_missing_copies_are_reported(tmp_path):
+    paths = write(tmp_path, {"a.txt": b"text"})
+    missing = str(tmp_path / "b.txt")
+
+    done, saved, failed = remove_duplicates([[paths[0], missing]])
+
+    assert (done, saved) == ([], 0)
+    assert [path for path, _ in failed] == [missing]
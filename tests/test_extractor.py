@@ -0,0 +1,102 @@
+import io
+import os
+import tarfile
+import zipfile
+
+from sublayers.extractor import extract_all, extract_archive, member_path
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+def make_tar(path, members):
+    with tarfile.open(path, "w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+
+def test_archive_is_unpacked_and_removed(tmp_path):
+    make_zip(tmp_path / "photos.zip", {"a.jpg": b"a" * 10, "trip/b.jpg": b"b" * 20})
+
+    result = extract_archive(str(tmp_path / "photos.zip"), 1000, 10, 2)
+
+    assert (result["ok"], result["members"], result["bytes"]) == (True, 2, 30)
+    assert not (tmp_path / "photos.zip").exists()
+    assert (tmp_path / "photos" / "trip" / "b.jpg").read_bytes() == b"b" * 20
+
+
+def test_too_many_bytes_keep_the_archive(tmp_path):
+    make_tar(tmp_path / "big.tar.gz", {"a.bin": b"0" * 1000, "b.bin": b"0" * 1000})
+
+    result = extract_archive(str(tmp_path / "big.tar.gz"), 1500, 10, 2)
+
+    assert not result["ok"]
+    assert result["error"] == "more than 1500 bytes"
+    assert (tmp_path / "big.tar.gz").exists()
+    assert not (tmp_path / "big").exists()
+
+
+def test_too_many_members_keep_the_archive(tmp_path):
+    make_zip(tmp_path / "many.zip", {f"{i}.txt": b"x" for i in range(5)})
+
+    result = extract_archive(str(tmp_path / "many.zip"), 1000, 4, 2)
+
+    assert not result["ok"]
+    assert result["error"] == "more than 4 members"
+    assert result["members"] == 5
+    assert (tmp_path / "many.zip").exists()
+    assert not (tmp_path / "many").exists()
+
+
+def test_nested_archives_share_the_limits(tmp_path):
+    inner = io.BytesIO()
+    make_zip(inner, {"deep.txt": b"d" * 100})
+    make_zip(tmp_path / "outer.zip", {"inner.zip": inner.getvalue()})
+
+    assert not extract_archive(str(tmp_path / "outer.zip"), 150, 10, 2)["ok"]
+    result = extract_archive(str(tmp_path / "outer.zip"), 1000, 10, 2)
+
+    assert result["ok"]
+    assert result["members"] == 2
+    assert (tmp_path / "outer" / "inner" / "deep.txt").read_bytes() == b"d" * 100
+    assert not (tmp_path / "outer" / "inner.zip").exists()
+
+
+def test_archives_deeper_than_max_depth_are_kept(tmp_path):
+    inner = io.BytesIO()
+    make_zip(inner, {"deep.txt": b"d"})
+    make_zip(tmp_path / "outer.zip", {"inner.zip": inner.getvalue()})
+
+    assert extract_archive(str(tmp_path / "outer.zip"), 1000, 10, 1)["ok"]
+
+    assert os.listdir(tmp_path / "outer") == ["inner.zip"]
+
+
+def test_members_outside_the_folder_are_skipped(tmp_path):
+    make_zip(tmp_path / "evil.zip", {"../escaped.txt": b"x", "kept.txt": b"y"})
+
+    assert extract_archive(str(tmp_path / "evil.zip"), 1000, 10, 2)["ok"]
+
+    assert not (tmp_path / "escaped.txt").exists()
+    assert os.listdir(tmp_path / "evil") == ["kept.txt"]
+    assert member_path("folder", "/etc/passwd") is None
+    assert member_path("folder", "C:/windows") is None
+
+
+def test_all_archives_are_unpacked_in_worker_processes(tmp_path):
+    make_zip(tmp_path / "a.zip", {"a.txt": b"a"})
+    make_tar(tmp_path / "b.tgz", {"b.txt": b"b" * 2000})
+    (tmp_path / "c.txt").write_text("not an archive")
+
+    results = extract_all(str(tmp_path), workers=2, max_size=1000)
+
+    assert [(result["name"], result["ok"]) for result in results] == [
+        ("a.zip", True),
+        ("b.tgz", False),
+    ]
+    assert sorted(os.listdir(tmp_path)) == ["a", "b.tgz", "c.txt"]
@@ -0,0 +1,50 @@
+import difflib
+
+import pytest
+
+from sublayers.handler import Handler
+from sublayers.indexes import edit_distance
+
+COMMANDS = [
+    "add",
+    "help",
+    "del",
+    "change",
+    "find",
+    "search",
+    "tag sort",
+    "history",
+    "restore",
+    "show all",
+    "back",
+]
+
+
+def difflib_suggestion(query):
+    """Suggestion the handler made before it had an index"""
+    return difflib.get_close_matches(query, COMMANDS, n=1, cutoff=0.6)
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [("hlep", ["help"]), ("fnid", ["find"]), ("delte", ["del"]), ("bakc", ["back"])],
+)
+def test_suggestion_for_swapped_and_missing_letters(query, expected):
+    handler = Handler(dict.fromkeys(COMMANDS))
+
+    assert handler.get_command_suggestion(query) == expected
+    assert difflib_suggestion(query) == expected
+
+
+@pytest.mark.parametrize("query", ["a", "s", "d"])
+def test_no_suggestion_for_one_letter(query):
+    handler = Handler(dict.fromkeys(COMMANDS))
+
+    assert handler.get_command_suggestion(query) == []
+    assert difflib_suggestion(query) == []
+
+
+def test_adjacent_swap_is_one_edit():
+    assert edit_distance("hlep", "help") == 1
+    assert edit_distance("abcd", "badc") == 2
+    assert edit_distance("kitten", "sitting", limit=1) == 2
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from sublayers import history
+from sublayers.history import History, apply_delta, text_delta
+
+
+@pytest.mark.parametrize(
+    "old, new",
+    [
+        ("", ""),
+        ("", "new text"),
+        ("old text", ""),
+        ("buy milk and bread", "buy milk, eggs and bread"),
+        ("aaaa", "aaaaaa"),
+        ("same", "same"),
+        ("head middle tail", "head tail"),
+    ],
+)
+def test_delta_turns_old_text_into_new(old, new):
+    assert apply_delta(old, text_delta(old, new)) == new
+
+
+def test_random_edits_round_trip():
+    rng = random.Random(7)
+    text = "".join(rng.choice("ab c") for _ in range(200))
+    for _ in range(100):
+        start = rng.randrange(len(text) + 1)
+        end = rng.randrange(start, min(len(text), start + 10) + 1)
+        new = text[:start] + "".join(rng.choice("abc d") for _ in range(5)) + text[end:]
+        assert apply_delta(text, text_delta(text, new)) == new
+        text = new
+
+
+def test_common_prefix_and_suffix_are_not_stored():
+    old = "x" * 1000 + "old" + "y" * 1000
+
+    delta = text_delta(old, "x" * 1000 + "new" + "y" * 1000)
+
+    assert delta == [(1000, 1003, "new")]
+
+
+def test_long_middles_are_replaced_whole(monkeypatch):
+    monkeypatch.setattr(history, "MAX_DIFF_WORK", 10)
+
+    assert text_delta("<abcdef>", "<ghijkl>") == [(1, 7, "ghijkl")]
+
+
+@pytest.fixture
+def notes(tmp_path):
+    notes = History(str(tmp_path / "history"))
+    notes.keyframe_interval = 3
+    return notes
+
+
+def test_every_revision_is_rebuilt_across_keyframes(notes, tmp_path):
+    states = [("note", f"text version {i}", ("tag",) * (i % 2)) for i in range(8)]
+    for state in states:
+        assert notes.append("note", state)
+    notes.save()
+
+    loaded = History(str(tmp_path / "history"))
+    loaded.keyframe_interval = 3
+
+    kinds = [revision[1] for revision in loaded.store.get("note")]
+    assert kinds == ["full", "delta", "delta"] * 2 + ["full", "delta"]
+    assert [loaded.version("note", i) for i in range(8)] == states
+    assert loaded.version("note", 8) is None
+    assert [number for number, *_ in loaded.revisions("note")] == list(range(8))
+
+
+def test_unchanged_state_is_not_a_revision(notes):
+    assert notes.append("note", ("note", "text", ()))
+    assert not notes.append("note", ("note", "text", ()))
+    assert len(notes.revisions("note")) == 1
+
+
+def test_rename_moves_revisions(notes):
+    notes.append("old", ("old", "text", ()))
+
+    notes.rename("old", "new")
+
+    assert notes.revisions("old") == []
+    assert notes.version("new", 0) == ("old", "text", ())
@@ -0,0 +1,50 @@
+from datetime import date
+
+import pytest
+
+from sublayers.indexes import BirthdayIndex, birthday_ranges
+
+BIRTHDAYS = {
+    "new year": "01.01.1990",
+    "second": "02.01.1985",
+    "leap": "29.02.1988",
+    "spring": "01.03.1990",
+    "eve": "31.12.1979",
+}
+
+
+@pytest.fixture
+def index():
+    index = BirthdayIndex()
+    index.build((birthday, key) for key, birthday in BIRTHDAYS.items())
+    return index
+
+
+def test_range_over_the_new_year_is_split(index):
+    today = date(2023, 12, 30)
+
+    assert len(birthday_ranges(5, today)) == 2
+    # till 04.01 not including, the nearest birthday first
+    assert index.upcoming(5, today) == ["eve", "new year", "second"]
+    assert index.upcoming(3, today) == ["eve", "new year"]
+
+
+def test_leap_day_is_celebrated_on_first_of_march_in_common_years(index):
+    assert index.upcoming(2, date(2023, 2, 27)) == []
+    assert index.upcoming(3, date(2023, 2, 27)) == ["leap", "spring"]
+    assert index.upcoming(1, date(2023, 3, 1)) == ["leap", "spring"]
+
+
+def test_leap_day_in_a_leap_year(index):
+    assert index.upcoming(2, date(2024, 2, 28)) == ["leap"]
+    assert index.upcoming(1, date(2024, 3, 1)) == ["spring"]
+
+
+def test_whole_year_lists_everyone_once(index):
+    found = index.upcoming(400, date(2023, 3, 2))
+
+    assert found == ["eve", "new year", "second", "leap", "spring"]
+
+
+def test_no_days_no_ranges():
+    assert birthday_ranges(0, date(2023, 5, 5)) == []
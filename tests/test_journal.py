@@ -0,0 +1,73 @@
+import os
+
+from sublayers.journal import Journal
+
+
+def test_log_is_replayed_over_the_snapshot(tmp_path):
+    journal = Journal(str(tmp_path / "book.bin"))
+    journal.write_snapshot({"a": 1, "b": 2})
+    journal.append([("set", "a", 10), ("del", "b", None), ("set", "c", 3)])
+
+    assert Journal(str(tmp_path / "book.bin")).load() == {"a": 10, "c": 3}
+
+
+def test_clear_entry_drops_older_keys(tmp_path):
+    journal = Journal(str(tmp_path / "book.bin"))
+    journal.append([("set", "a", 1), ("clear", None, None), ("set", "b", 2)])
+
+    assert Journal(str(tmp_path / "book.bin")).load() == {"b": 2}
+
+
+def test_torn_last_entry_is_skipped(tmp_path):
+    journal = Journal(str(tmp_path / "book.bin"))
+    journal.append([("set", "a", 1)])
+    journal.append([("set", "b", "a long value of the torn entry")])
+    with open(journal.log_file, "r+b") as f:
+        f.truncate(os.path.getsize(journal.log_file) - 5)
+
+    reader = Journal(str(tmp_path / "book.bin"))
+
+    assert reader.load() == {"a": 1}
+    # the next append goes after the entries which could be read
+    reader.append([("set", "c", 3)])
+    assert Journal(str(tmp_path / "book.bin")).load() == {"a": 1, "c": 3}
+
+
+def test_compaction_moves_the_log_into_the_snapshot(tmp_path):
+    journal = Journal(str(tmp_path / "book.bin"))
+    journal.compact_threshold = 100
+    data = journal.load()
+    for i in range(20):
+        data[f"key {i}"] = i
+        journal.append([("set", f"key {i}", i)])
+    assert journal.need_compaction()
+
+    journal.compact(data, background=False)
+
+    assert journal.log_size() == 0
+    assert Journal(str(tmp_path / "book.bin")).load() == data
+
+
+def test_entries_after_a_background_snapshot_stay_in_the_log(tmp_path):
+    journal = Journal(str(tmp_path / "book.bin"))
+    data = {"a": 1}
+    journal.append([("set", "a", 1)])
+    journal.compact(data)
+    journal.append([("set", "b", 2)])
+    journal.wait()
+
+    assert Journal(str(tmp_path / "book.bin")).load() == {"a": 1, "b": 2}
+
+
+def test_changes_of_another_journal_are_read_incrementally(tmp_path):
+    writer = Journal(str(tmp_path / "book.bin"))
+    reader = Journal(str(tmp_path / "book.bin"))
+    writer.append([("set", "a", 1)])
+    assert reader.load() == {"a": 1}
+
+    writer.append([("set", "b", 2)])
+
+    assert reader.changes() == [("set", "b", 2)]
+    assert reader.changes() == []
+    writer.write_snapshot({"a": 1, "b": 2})
+    assert reader.changes() is None
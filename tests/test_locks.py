@@ -0,0 +1,152 @@
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from sublayers import locks, writer
+from sublayers.addressbook import AddressBook, Name, Phone, Record
+from sublayers.locks import FileLock
+from sublayers.notebook import Notebook, Text, Title
+from sublayers.notebook import Record as Note
+from sublayers.shards import ShardStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_process(folder, code):
+    """Runs code in another python process with folder as working directory"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.Popen(
+        [sys.executable, "-c", textwrap.dedent(code)], cwd=folder, env=env
+    )
+
+
+def run_process(folder, code):
+    assert start_process(folder, code).wait(timeout=30) == 0
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(writer, "stores", [])
+    monkeypatch.setattr(Notebook, "_instance", None)
+    monkeypatch.setattr(AddressBook, "_instance", None)
+    return tmp_path
+
+
+@pytest.mark.skipif(locks.fcntl is None, reason="file locks need fcntl")
+def test_lock_waits_for_another_process(tmp_path):
+    lock_file = tmp_path / "files.lock"
+    process = start_process(
+        tmp_path,
+        f"""
+        import time
+        from sublayers.locks import FileLock
+
+        with FileLock({str(lock_file)!r}).hold():
+            open("ready", "w").close()
+            time.sleep(0.3)
+            open("log", "w").write("written under the lock")
+        """,
+    )
+    deadline = time.monotonic() + 10
+    while not (tmp_path / "ready").exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    with FileLock(str(lock_file)).hold(shared=True):
+        assert (tmp_path / "log").read_text() == "written under the lock"
+    assert process.wait(timeout=10) == 0
+
+
+def test_nested_holds_keep_the_outer_lock(tmp_path):
+    lock = FileLock(str(tmp_path / "files.lock"))
+
+    with lock.hold():
+        outer = lock._file
+        with lock.hold(shared=True):
+            assert lock._file is outer
+        assert lock._file is outer
+    assert lock._file is None
+
+
+def test_store_merges_keys_saved_by_another_store(tmp_path):
+    first = ShardStore(str(tmp_path / "store"))
+    second = ShardStore(str(tmp_path / "store"))
+    assert first.load() == {}
+    first.put("a", 1)
+    first.save()
+    assert second.load() == {"a": 1}
+
+    first.put("b", 2)
+    first.save()
+    second.put("c", 3)
+
+    assert second.save() == {"b": 2}
+    assert first.changes() == {"c": 3}
+    assert first.changes() == {}
+    assert ShardStore(str(tmp_path / "store")).load() == {"a": 1, "b": 2, "c": 3}
+
+
+def test_notebook_reads_notes_saved_by_another_process(shared, monkeypatch):
+    notebook = Notebook()
+    notebook.add_record(Note(Title("groceries"), Text("milk and bread")))
+    notebook.write_notes()
+
+    run_process(
+        shared,
+        """
+        from sublayers.notebook import Notebook, Record, Text, Title
+
+        notebook = Notebook()
+        record = notebook.data["groceries"]
+        record.text = Text("milk and eggs")
+        notebook.update_record(record)
+        notebook.add_record(Record(Title("work"), Text("send the report")))
+        notebook.write_notes()
+        """,
+    )
+
+    # only the changed shards are read, not the whole notebook
+    monkeypatch.setattr(notebook, "reload_notes", None)
+    notebook.refresh()
+
+    assert sorted(notebook.data) == ["groceries", "work"]
+    assert notebook.data["groceries"].text.value == "milk and eggs"
+    assert [title for title, _ in notebook.search("report")] == ["work"]
+    assert notebook.search("bread") == []
+
+
+@pytest.mark.parametrize("storage_type", ["pickle", "sqlite", "mmap"])
+def test_address_book_reads_contacts_saved_by_another_process(
+    shared, monkeypatch, storage_type
+):
+    monkeypatch.setattr(AddressBook, "storage_type", storage_type)
+    book = AddressBook()
+    for name, phone in (("Anna", "0991112233"), ("Bob", "0671234567")):
+        record = Record(Name(name))
+        record.add_phone(Phone(phone))
+        book.add_record(record)
+    book.save_contacts(verbose=False)
+
+    run_process(
+        shared,
+        f"""
+        from sublayers.addressbook import AddressBook, Name, Phone, Record
+
+        AddressBook.storage_type = {storage_type!r}
+        book = AddressBook()
+        book.remove_record("Bob")
+        record = Record(Name("Carl"))
+        record.add_phone(Phone("0501112233"))
+        book.add_record(record)
+        book.save_contacts(verbose=False)
+        """,
+    )
+    book.refresh()
+
+    assert sorted(book.data) == ["Anna", "Carl"]
+    assert book.find_by_phone("0501") == {"Carl"}
+    assert book.find_by_phone("067") == set()
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from sublayers.mover import MoveExecutor
+
+
+@pytest.fixture
+def files(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    for name in ("a.jpg", "b.jpg", "c.txt"):
+        (source / name).write_text(f"data of {name}")
+    (tmp_path / "images").mkdir()
+    (tmp_path / "documents").mkdir()
+    return tmp_path
+
+
+def move_all(executor, root):
+    for name, folder, category in (
+        ("a.jpg", "images", "images"),
+        ("b.jpg", "images", "images"),
+        ("c.txt", "documents", "documents"),
+    ):
+        executor.move(str(root / "source" / name), str(root / folder), name, category)
+    return executor.finish()
+
+
+def assert_moved(root):
+    assert os.listdir(root / "source") == []
+    assert (root / "images" / "a.jpg").read_text() == "data of a.jpg"
+    assert (root / "documents" / "c.txt").read_text() == "data of c.txt"
+
+
+def test_same_filesystem_is_renamed_at_once(files):
+    executor = MoveExecutor()
+
+    moved = move_all(executor, files)
+
+    assert moved == {"images": 2, "documents": 1}
+    assert (executor.renamed, executor.copied) == (3, 0)
+    assert executor.pool is None
+    assert_moved(files)
+
+
+@pytest.fixture
+def other_filesystem(files, monkeypatch):
+    """Puts the source folder on another device than the category folders"""
+    source = str(files / "source")
+    monkeypatch.setattr(
+        MoveExecutor, "device", lambda self, folder: 1 if folder == source else 2
+    )
+
+
+def test_other_filesystem_is_copied_in_batches(files, other_filesystem):
+    executor = MoveExecutor()
+    executor.batch_size = 2
+
+    moved = move_all(executor, files)
+
+    assert moved == {"images": 2, "documents": 1}
+    assert (executor.renamed, executor.copied) == (0, 3)
+    assert sorted(executor.take_completed()) == sorted(
+        str(files / folder / name)
+        for folder, name in (
+            ("images", "a.jpg"),
+            ("images", "b.jpg"),
+            ("documents", "c.txt"),
+        )
+    )
+    assert executor.take_completed() == []
+    assert_moved(files)
+
+
+def test_failed_rename_falls_back_to_a_copy(files, monkeypatch):
+    def rename(source, target):
+        raise OSError("busy file")
+
+    monkeypatch.setattr(os, "rename", rename)
+    executor = MoveExecutor()
+
+    moved = move_all(executor, files)
+
+    assert moved == {"images": 2, "documents": 1}
+    assert (executor.renamed, executor.copied) == (0, 3)
+    assert_moved(files)
+
+
+def test_failed_copies_are_listed(files, other_filesystem):
+    executor = MoveExecutor()
+    missing = str(files / "source" / "missing.jpg")
+
+    executor.move(missing, str(files / "images"), "missing.jpg", "images")
+    executor.move(
+        str(files / "source" / "a.jpg"), str(files / "images"), "a.jpg", "images"
+    )
+
+    assert executor.finish() == {"images": 1}
+    assert [source for source, _ in executor.failed] == [missing]
+
+
+def test_file_already_in_place_is_left(files):
+    executor = MoveExecutor()
+    folder = str(files / "source")
+
+    executor.move(os.path.join(folder, "a.jpg"), folder, "a.jpg", "images")
+
+    assert executor.finish() == {}
+    assert os.path.exists(os.path.join(folder, "a.jpg"))
@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+from sublayers.notebook import CommandsHandler, Notebook, Record, Text, Title
+from sublayers.shards import shard_of
+
+
+@pytest.fixture
+def notebook(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Notebook, "_instance", None)
+    return Notebook()
+
+
+def folder_files(folder):
+    """Names and modification times of the files in the folder"""
+    return {
+        name: os.stat(os.path.join(folder, name)).st_mtime_ns
+        for name in os.listdir(folder)
+    }
+
+
+def test_save_of_one_note_writes_its_shard_and_manifest(notebook):
+    for i in range(50):
+        notebook.add_record(Record(Title(f"note {i}"), Text(f"text number {i}")))
+    notebook.write_notes()
+    notes_before = folder_files(notebook.shards_folder)
+    search_before = folder_files(notebook.search_folder)
+
+    record = notebook.data["note 7"]
+    record.text = Text("a changed text")
+    notebook.update_record(record)
+    notebook.write_notes()
+
+    count = notebook.store.shard_count
+    keys = ["note:note 7"]
+    keys += [f"term:{term}" for term in ("note", "7", "text", "number", "a", "changed")]
+    for folder, before, numbers in (
+        (notebook.shards_folder, notes_before, {shard_of("note 7", count)}),
+        (notebook.search_folder, search_before, {shard_of(k, count) for k in keys}),
+    ):
+        after = folder_files(folder)
+        written = {name for name in after if before.get(name) != after[name]}
+        shards = {f"shard-{number:04}.2.bin" for number in numbers}
+        assert written == {"manifest.bin"} | shards
+    assert [title for title, _ in notebook.search("changed")] == ["note 7"]
+
+
+def test_search_index_is_loaded_from_shards(notebook):
+    notebook.add_record(Record(Title("groceries"), Text("milk and bread")))
+    notebook.add_record(Record(Title("work"), Text("send the report")))
+    notebook.write_notes()
+
+    Notebook._instance = None
+    loaded = Notebook()
+
+    assert loaded.search_index.store.shards == {}
+    assert [title for title, _ in loaded.search("report")] == ["work"]
+    assert set(loaded.search_index.store.shards) == {
+        shard_of("term:report", loaded.search_index.store.shard_count)
+    }
+    assert [title for title, _ in loaded.search('"milk and"')] == ["groceries"]
+
+
+def test_notes_changed_after_the_index_was_saved_are_indexed_again(notebook):
+    notebook.add_record(Record(Title("plans"), Text("visit the museum")))
+    notebook.add_record(Record(Title("old"), Text("forgotten words")))
+    notebook.write_notes()
+    notebook.remove_record("old")
+    record = notebook.data["plans"]
+    record.text = Text("visit the zoo")
+    notebook.update_record(record)
+    # notes are saved without the index, as after a crash between the saves
+    notebook.store.save()
+
+    Notebook._instance = None
+    loaded = Notebook()
+
+    assert [title for title, _ in loaded.search("zoo")] == ["plans"]
+    assert loaded.search("museum") == []
+    assert loaded.search("forgotten") == []
+    assert len(loaded.search_index) == 1
+
+
+def test_restore_of_an_old_title_keeps_the_live_size(notebook):
+    notebook.add_record(Record(Title("draft"), Text("first words")))
+    record = notebook.data["draft"]
+    record.title = Title("final")
+    notebook.rename_record("draft", "final")
+    record.text = Text("a much longer text of the final note")
+    notebook.update_record(record)
+
+    restored = notebook.restore_revision("final", 0)
+
+    assert restored.title.value == "draft"
+    assert restored.text.value == "first words"
+    assert set(notebook.text_sizes) == {"draft"}
+    assert notebook.live_size == sum(notebook.text_sizes.values())
+    assert notebook.live_size == restored.text.ref[2]
+
+
+def test_invalid_change_choice_keeps_no_revision(notebook, monkeypatch):
+    notebook.add_record(Record(Title("idea"), Text("some text")))
+    # as a note saved before notes had history
+    notebook.history.delete("idea")
+    answers = iter(["idea", "7"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    # Read through __dict__, the LazyStore would create Notebook() again
+    monkeypatch.setattr(CommandsHandler.__dict__["notebook"], "store", notebook)
+
+    CommandsHandler().change_note()
+
+    assert notebook.revisions("idea") == []
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from sublayers.cleaner import paths
+from sublayers.scanner import scan
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Sorted folder with a file, a subfolder and a link to a folder outside"""
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "photo.jpg").write_bytes(b"jpg")
+    root = tmp_path / "root"
+    (root / "docs").mkdir(parents=True)
+    (root / "docs" / "report.txt").write_text("report")
+    (root / "song.mp3").write_bytes(b"mp3")
+    os.symlink(outside, root / "linked", target_is_directory=True)
+    os.symlink(outside / "photo.jpg", root / "photo.jpg")
+    return root
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_scan_skips_symlinks(tree, workers):
+    found = {os.path.relpath(entry.path, tree) for entry in scan(str(tree), workers)}
+
+    assert found == {"docs", os.path.join("docs", "report.txt"), "song.mp3"}
+
+
+def test_symlinked_folder_is_not_sorted(tree):
+    file_paths, subfolders = paths(str(tree))
+
+    assert sorted(os.path.relpath(path, tree) for path in file_paths) == [
+        os.path.join("docs", "report.txt"),
+        "song.mp3",
+    ]
+    assert subfolders == [str(tree / "docs")]
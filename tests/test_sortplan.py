@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from sublayers import cleaner
+from sublayers.mover import MoveExecutor
+from sublayers.sortplan import SortPlan
+
+FILES = {
+    "song.mp3": "audio",
+    "photo.jpg": "images",
+    "docs/report.txt": "documents",
+    "docs/notes.txt": "documents",
+    "readme": "others",
+}
+
+
+def files_of(root):
+    """Relative paths and contents of all files, the plan journal skipped"""
+    plan = SortPlan(str(root))
+    found = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(folder, name)
+            if not plan.is_journal_file(path):
+                found[os.path.relpath(path, root)] = open(path).read()
+    return found
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / "root"
+    for name in FILES:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"data of {name}")
+    return root
+
+
+def sorted_files():
+    return {
+        os.path.join(category, os.path.basename(name)): f"data of {name}"
+        for name, category in FILES.items()
+    }
+
+
+def test_dry_run_changes_nothing(root, capsys):
+    cleaner.dry_run(str(root))
+
+    output = capsys.readouterr().out
+    assert "5 files would be moved, nothing was changed" in output
+    assert os.path.join("docs", "notes.txt") + " -> " in output
+    assert sorted(os.listdir(root)) == ["docs", "photo.jpg", "readme", "song.mp3"]
+
+
+def test_sort_is_undone(root):
+    before = files_of(root)
+
+    cleaner.sort_folder(str(root))
+
+    assert files_of(root) == sorted_files()
+    assert not (root / "docs").exists()
+    cleaner.undo_folder(str(root))
+    assert files_of(root) == before
+    assert sorted(os.listdir(root / "docs")) == ["notes.txt", "report.txt"]
+
+
+def test_interrupted_sort_is_resumed(root, monkeypatch, capsys):
+    move = MoveExecutor.move
+    calls = []
+
+    def interrupted_move(self, *args):
+        move(self, *args)
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(SortPlan, "checkpoint_every", 2)
+    with monkeypatch.context() as patch:
+        patch.setattr(MoveExecutor, "move", interrupted_move)
+        with pytest.raises(KeyboardInterrupt):
+            cleaner.sort_folder(str(root))
+    plan = SortPlan(str(root))
+    plan.load()
+    assert (plan.status, len(plan.done)) == ("running", 2)
+
+    cleaner.sort_folder(str(root))
+
+    assert "Resuming the interrupted sort, 2 of 5 files are moved" in (
+        capsys.readouterr().out
+    )
+    assert files_of(root) == sorted_files()
+    plan.load()
+    assert (plan.status, len(plan.done)) == ("finished", 5)
+
+
+def test_taken_names_get_a_number(root):
+    (root / "images").mkdir()
+    (root / "images" / "photo.jpg").write_text("sorted before")
+    plan = SortPlan(str(root))
+
+    plan.build([str(root / "photo.jpg")], cleaner.categories, cleaner.normalize)
+
+    assert plan.moves == [
+        (str(root / "photo.jpg"), str(root / "images" / "photo_1.jpg"), "images")
+    ]
+
+
+def test_file_which_cannot_be_moved_back_is_tried_once(root):
+    cleaner.sort_folder(str(root))
+    (root / "song.mp3").write_text("a new song")
+    plan = SortPlan(str(root))
+    plan.load()
+
+    restored, failed = plan.undo()
+
+    assert restored == 4
+    assert [path for path, _ in failed] == [str(root / "audio" / "song.mp3")]
+    assert (root / "audio" / "song.mp3").read_text() == "data of song.mp3"
+    plan.load()
+    assert (plan.status, plan.done, len(plan.failed)) == ("undone", set(), 1)
+    assert plan.undo() == (0, [])
@@ -0,0 +1,142 @@
+import pickle
+import struct
+import time
+
+import pytest
+
+from sublayers import writer
+from sublayers.addressbook import AddressBook, Birthday, Email, Name, Phone, Record
+from sublayers.storage import MmapStorage, key_hash
+
+
+@pytest.fixture
+def new_book(tmp_path, monkeypatch):
+    """Makes AddressBook() read the files in tmp_path again on every call"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(writer, "stores", [])
+
+    def new_book(**options):
+        for name, value in options.items():
+            monkeypatch.setattr(AddressBook, name, value)
+        AddressBook._instance = None
+        return AddressBook()
+
+    monkeypatch.setattr(AddressBook, "_instance", None)
+    return new_book
+
+
+def contact(name, phone):
+    record = Record(Name(name))
+    record.add_phone(Phone(phone))
+    return record
+
+
+def fill(book):
+    anna = contact("Anna", "0991112233")
+    anna.email = Email("anna@gmail.com")
+    anna.birthday = Birthday("05.06.1990")
+    book.add_record(anna)
+    book.add_record(contact("Bob", "0671234567"))
+    book.add_record(contact("Carl", "0501112233"))
+    book.save_contacts(verbose=False)
+
+
+@pytest.mark.parametrize("storage_type", ["pickle", "sqlite", "mmap"])
+def test_changes_are_kept_after_reload(new_book, storage_type):
+    book = new_book(storage_type=storage_type)
+    fill(book)
+    record = book.data["Bob"]
+    record.name = Name("Robert")
+    book.rename_record("Bob", "Robert")
+    book.remove_record("Carl")
+    book.save_contacts(verbose=False)
+
+    loaded = new_book(storage_type=storage_type)
+
+    assert sorted(loaded.data) == ["Anna", "Robert"]
+    assert loaded.data["Anna"].email.value == "anna@gmail.com"
+    assert loaded.data["Anna"].birthday.value == "05.06.1990"
+    assert loaded.find_by_name("Rob") == {"Robert"}
+    assert loaded.find_by_phone("067 123") == {"Robert"}
+    assert loaded.find_by_phone("050") == set()
+    assert loaded.fuzzy_find("anna@gmail") == ["Anna"]
+
+
+@pytest.mark.parametrize("storage_type", ["pickle", "sqlite", "mmap"])
+def test_clear_is_kept_after_reload(new_book, storage_type):
+    book = new_book(storage_type=storage_type)
+    fill(book)
+    book.clear_records()
+    book.add_record(contact("Dana", "0931112233"))
+    book.save_contacts(verbose=False)
+
+    loaded = new_book(storage_type=storage_type)
+
+    assert list(loaded.data) == ["Dana"]
+    assert loaded.find_by_phone("099") == set()
+
+
+@pytest.mark.parametrize("storage_type", ["sqlite", "mmap"])
+def test_pickled_book_is_migrated_once(new_book, storage_type, tmp_path):
+    fill(new_book(storage_type="pickle"))
+
+    book = new_book(storage_type=storage_type)
+
+    assert sorted(book.data) == ["Anna", "Bob", "Carl"]
+    assert book.find_by_phone("0991") == {"Anna"}
+    # the new book has only the log, no snapshot yet
+    assert (tmp_path / "AddressBook.log.migrated").exists()
+    assert not (tmp_path / "AddressBook.log").exists()
+    book.remove_record("Bob")
+    book.save_contacts(verbose=False)
+    assert sorted(new_book(storage_type=storage_type).data) == ["Anna", "Carl"]
+
+
+def test_mmap_decodes_no_record_for_indexes(new_book):
+    fill(new_book(storage_type="mmap"))
+
+    book = new_book(storage_type="mmap")
+
+    assert book.find_by_phone("0501") == {"Carl"}
+    assert book.find_by_name("A") == {"Anna"}
+    assert len(book.data) == 3
+    assert book.data.cache == {}
+    assert book.data["Bob"].phones[0].value == "0671234567"
+    assert list(book.data.cache) == ["Bob"]
+
+
+def test_mmap_files_without_terms_are_upgraded(new_book, tmp_path):
+    records = {"Anna": contact("Anna", "0991112233"), "Bob": contact("Bob", "067")}
+    blob = b""
+    entries = []
+    for key, record in records.items():
+        encoded = key.encode()
+        chunk = struct.pack("<I", len(encoded)) + encoded + pickle.dumps(record)
+        entries.append((key_hash(key), len(blob), len(chunk)))
+        blob += chunk
+    (tmp_path / "AddressBook.dat").write_bytes(blob)
+    (tmp_path / "AddressBook.idx").write_bytes(
+        MmapStorage.old_magic
+        + b"".join(MmapStorage.entry.pack(*entry) for entry in sorted(entries))
+    )
+
+    book = new_book(storage_type="mmap")
+
+    assert (tmp_path / "AddressBook.idx").read_bytes().startswith(MmapStorage.magic)
+    assert sorted(book.data) == ["Anna", "Bob"]
+    assert book.find_by_phone("099") == {"Anna"}
+
+
+def test_sqlite_with_background_writer(new_book):
+    book = new_book(storage_type="sqlite", background_save=True, save_debounce=0.01)
+    book.add_record(contact("Anna", "0991112233"))
+    book.save_contacts(verbose=False)
+
+    deadline = time.monotonic() + 5
+    while book.writer.writes == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert book.writer.writes == 1
+    assert book.writer.failures == 0
+    loaded = new_book(storage_type="sqlite", background_save=False)
+    assert loaded.find_by_phone("099111") == {"Anna"}
@@ -0,0 +1,115 @@
+import pytest
+
+from sublayers import writer
+from sublayers.addressbook import AddressBook, CommandsHandler
+from sublayers.transfer import (
+    chunks,
+    file_format,
+    read_csv,
+    read_vcard,
+    readers,
+    vcard_escape,
+    vcard_unescape,
+    write_csv,
+    write_vcard,
+    writers,
+)
+
+
+@pytest.mark.parametrize(
+    "value",
+    ["C:\\new\\table", "ends with \\", "\\\\n", "a, b; c\nd", "\\,\\;"],
+)
+def test_vcard_escape_round_trip(value):
+    assert vcard_unescape(vcard_escape(value)) == value
+
+
+def test_vcard_file_round_trip_with_backslashes(tmp_path):
+    contact = {
+        "name": "Back\\slash\\n",
+        "phones": ["+380991112233"],
+        "email": "",
+        "birthday": "",
+        "home_address": "Kyiv\\",
+    }
+    path = tmp_path / "contacts.vcf"
+
+    write_vcard(path, [contact])
+
+    assert list(read_vcard(path)) == [contact]
+
+
+CONTACTS = [
+    {
+        "name": "Анна Коваль",
+        "phones": ["+380991112233", "+380671234567"],
+        "email": "anna@gmail.com",
+        "birthday": "05.06.1990",
+        "home_address": 'Kyiv, "Main" st. 1',
+    },
+    {
+        "name": "Bob",
+        "phones": [],
+        "email": "",
+        "birthday": "",
+        "home_address": "",
+    },
+]
+
+
+@pytest.mark.parametrize("file_name", ["contacts.csv", "contacts.vcf"])
+def test_file_round_trip(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    kind = file_format(path)
+
+    assert writers[kind](path, iter(CONTACTS)) == 2
+    assert list(readers[kind](path)) == CONTACTS
+
+
+def test_vcard_dates_and_folded_lines(tmp_path):
+    path = tmp_path / "contacts.vcf"
+    path.write_text(
+        "BEGIN:VCARD\r\nFN:Long\r\n  Name\r\nBDAY:19900605\r\n"
+        "ADR:;;Main st. 1;Kyiv;;;\r\nEND:VCARD\r\n",
+        encoding="utf-8",
+    )
+
+    [contact] = read_vcard(path)
+
+    assert contact["name"] == "Long Name"
+    assert contact["birthday"] == "05.06.1990"
+    assert contact["home_address"] == "Main st. 1, Kyiv"
+
+
+def test_csv_rows_are_appended_without_a_header(tmp_path):
+    path = tmp_path / "errors.csv"
+
+    write_csv(path, [{**CONTACTS[1], "error": "no phone"}], ["error"])
+    write_csv(path, [{**CONTACTS[1], "error": "again"}], ["error"], append=True)
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert lines[0] == "name,phones,email,birthday,home_address,error"
+    assert lines[1:] == ["Bob,,,,,no phone", "Bob,,,,,again"]
+
+
+def test_chunks_split_a_stream():
+    assert list(chunks(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_import_keeps_valid_contacts_and_writes_rejected_ones(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(writer, "stores", [])
+    monkeypatch.setattr(AddressBook, "_instance", None)
+    monkeypatch.setattr(CommandsHandler.__dict__["address_book"], "store", None)
+    monkeypatch.setattr(CommandsHandler, "import_batch_size", 2)
+    rows = [*CONTACTS, {**CONTACTS[1], "name": "Bad", "phones": ["12"]}]
+    write_csv("contacts.csv", rows)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "contacts.csv")
+
+    CommandsHandler().import_contacts()
+
+    book = CommandsHandler.address_book
+    assert sorted(book.data) == ["Bob", "Анна Коваль"]
+    assert book.find_by_phone("38067") == {"Анна Коваль"}
+    [rejected] = read_csv("contacts.csv.errors.csv")
+    assert rejected["name"] == "Bad"